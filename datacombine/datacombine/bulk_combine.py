@@ -0,0 +1,438 @@
+from dateutil import parser
+from itertools import islice
+
+from django.core.exceptions import FieldError
+from .bulk_sql import upsert_objects
+from .cc_index import CCIdIndex
+from .mappers import CONTACT_UPDATE_FIELDS, MAPPERS
+from .phone_cache import PHONE_CACHE
+from .models import (
+    Contact,
+    Phone,
+    EmailAddress,
+    ConstantContactList,
+    Note,
+    Address,
+    UserStatusOnCCList,
+    RequiringRemediation
+)
+
+DEFAULT_BATCH_SIZE = 500
+PHONE_FIELDS = ['home_phone', 'work_phone', 'cell_phone', 'fax']
+NON_PHONE_OR_CCLIST_M2M = [
+    (Address, "addresses"),
+    (EmailAddress, "email_addresses"),
+]
+
+
+def chunked(iterable, size):
+    """Yields lists of at most `size` items from `iterable`"""
+    it = iter(iterable)
+    chunk = list(islice(it, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(it, size))
+
+
+def m2m_through(field_name, model=Contact):
+    """Returns the through model and its two FK column names for a M2M field
+
+    :param field_name: (str) Name of the ManyToManyField on `model`
+    :param model: The model the M2M field is declared on
+    :return: (tuple) (through model, source FK attname, target FK attname)
+    """
+    fld = model._meta.get_field(field_name)
+    return (
+        fld.remote_field.through,
+        f"{fld.m2m_field_name()}_id",
+        f"{fld.m2m_reverse_field_name()}_id"
+    )
+
+
+class _PendingContact():
+    """Everything gathered from one contact's JSON before it's written"""
+    def __init__(self, contact, obj, pk=None):
+        self.contact = contact
+        self.obj = obj
+        self.pk = pk
+        self.contact_in_db = pk is not None
+        self.phones = []
+        self.m2m = []
+        self.notes = []
+        self.ustats = []
+        self.bad_phone_entry = None
+        self.bad_m2m_entry = None
+
+
+class BulkCombiner():
+    def __init__(self, dcombine, batch_size=DEFAULT_BATCH_SIZE, index=None):
+        """Combines contacts into the local DB a batch at a time
+
+        Produces the same rows as `DataCombine.combine_contacts_into_db` does
+        contact by contact, but each model (and each M2M through table) is
+        written with a single `bulk_create` per batch. Should anything go
+        wrong with a batch, it is rolled back and handed to the per-contact
+        path of `dcombine`, so one bad contact can't sink its neighbours.
+
+        :param dcombine: (`DataCombine`) Owner of the logger and the
+            remediation bookkeeping (`bad_phone_nums`, `bad_m2m`)
+        :param batch_size: (int) Number of contacts written per batch
+        :param index: (`cc_index.CCIdIndex`) Preloaded index of the objects
+            already in the local DB. If None, a fresh index is loaded for the
+            ids in each batch as it arrives.
+        """
+        self.dc = dcombine
+        self.logger = dcombine.logger
+        self.batch_size = batch_size
+        self.preloaded = index is not None
+        self.index = index if index is not None else CCIdIndex()
+
+    def combine(self, contacts):
+        """Combines `contacts`, yielding the size of each finished batch
+
+        :param contacts: (iterable of dict) ConstantContact contact JSON
+        :return: Generator of (int), the number of contacts in each batch
+        """
+        for batch in chunked(contacts, self.batch_size):
+            if not self.preloaded:
+                self.index.load_for_contacts(batch)
+            self.index.begin()
+            try:
+                with self.dc.transaction_policy.transaction():
+                    pending, leftovers = self.combine_batch(batch)
+            except Exception:
+                self.index.rollback()
+                self.logger.exception(
+                    f"Bulk combine failed on a batch of {len(batch)} "
+                    "contacts...falling back to combining one at a time"
+                )
+                leftovers = batch
+            else:
+                self.index.commit()
+                self._note_committed(pending)
+                self.dc.counts['skipped'] += \
+                    len(batch) - len(pending) - len(leftovers)
+            for contact in leftovers:
+                self.dc._combine_contact_safely(contact)
+            yield len(batch)
+
+    def combine_batch(self, contacts):
+        """Writes one batch of contacts to the local DB
+
+        :param contacts: (list of dict) ConstantContact contact JSON
+        :return: (tuple) The `_PendingContact`s written, and a list of the
+            contacts which appeared more than once in the batch; these must be
+            combined after the batch is committed
+        """
+        pending, leftovers = self._sort_batch(contacts)
+        if not pending:
+            return pending, leftovers
+        self._insert_new_contacts(pending)
+        self._update_changed_contacts(pending)
+        for pc in pending:
+            self._gather_related(pc)
+        self._reconcile_ustats(pending)
+        self._reconcile_phones(pending)
+        self._reconcile_m2m(pending)
+        self._upsert_notes(pending)
+        self._insert_remediations(pending)
+        return pending, leftovers
+
+    def _sort_batch(self, contacts):
+        seen = set()
+        pending = []
+        leftovers = []
+        backfill = dict()
+        for contact in contacts:
+            cc_id = int(contact.get('id'))
+            if cc_id in seen:
+                leftovers.append(contact)
+                continue
+            seen.add(cc_id)
+            fingerprint = Contact.make_fingerprint(contact)
+            contact_in_db = self.index.contact(cc_id)
+            if contact_in_db:
+                pk, _, stored = contact_in_db
+                if self.dc._contact_unchanged(contact_in_db, contact,
+                                              fingerprint):
+                    if stored is None:
+                        backfill[cc_id] = (pk, fingerprint)
+                    continue
+                obj = self.dc._contact_from_json(contact, fingerprint)
+                obj.pk = pk
+                pending.append(_PendingContact(contact, obj, pk))
+            else:
+                obj = self.dc._contact_from_json(contact, fingerprint)
+                pending.append(_PendingContact(contact, obj))
+        self.dc.backfill_fingerprints(backfill, index=self.index)
+        return pending, leftovers
+
+    def _insert_new_contacts(self, pending):
+        new = [pc for pc in pending if pc.pk is None]
+        if not new:
+            return
+        objs = [pc.obj for pc in new]
+        self._write(Contact, objs, with_pks=True)
+        for pc in new:
+            pc.pk = pc.obj.pk
+            self.index.add(
+                Contact, pc.obj.cc_id, pc.pk,
+                parser.parse(pc.contact.get("modified_date")),
+                pc.obj.fingerprint
+            )
+
+    def _update_changed_contacts(self, pending):
+        # Changed contacts keep their row (and pk); every column is set to
+        # what ConstantContact sent, in one statement per batch
+        changed = [pc for pc in pending if pc.contact_in_db]
+        if not changed:
+            return
+        upsert_objects(Contact, [pc.obj for pc in changed], ['cc_id'],
+                       CONTACT_UPDATE_FIELDS)
+        for pc in changed:
+            self.index.add(
+                Contact, pc.obj.cc_id, pc.pk,
+                parser.parse(pc.contact.get("modified_date")),
+                pc.obj.fingerprint
+            )
+
+    def _write(self, model, objs, with_pks=False):
+        """Inserts `objs` into the table of `model`, all in one go
+
+        The one place rows are written, so subclasses can change how.
+
+        :param model: Django model class of `objs`
+        :param objs: (list) Unsaved model instances
+        :param with_pks: (bool) Make sure every object's `pk` is set after
+        :return: None
+        """
+        model.objects.bulk_create(objs)
+        if with_pks:
+            self._assign_pks(model, objs)
+
+    @staticmethod
+    def _assign_pks(model, objs, field='cc_id'):
+        # Postgres hands back the new primary keys from `bulk_create`, other
+        # backends don't, so look them up by a unique field
+        missing = [obj for obj in objs if obj.pk is None]
+        if not missing:
+            return
+        pks = dict(
+            model.objects.filter(**{
+                f"{field}__in": [getattr(obj, field) for obj in missing]
+            }).values_list(field, 'pk')
+        )
+        key = model._meta.get_field(field).to_python
+        for obj in missing:
+            obj.pk = pks[key(getattr(obj, field))]
+
+    def _gather_related(self, pc):
+        contact = pc.contact
+        for xcclist in contact.get('lists'):
+            liststat = "HI" if xcclist.get('status').startswith('H') \
+                else "AC"
+            pc.ustats.append((xcclist['id'], liststat))
+
+        for phfld in PHONE_FIELDS:
+            phone_num = contact.get(phfld)
+            if not phone_num:
+                continue
+            ph = Phone()
+            try:
+                ph.create_from_str(phone_num)
+            except FieldError:
+                pc.bad_phone_entry = {phfld: phone_num}
+                continue
+            # Numbers that parse to nothing aren't stored as phones
+            if not any(ph.key):
+                self.logger.info(f"phone_num='{phone_num}' produces None")
+                continue
+            pc.phones.append(
+                (phfld, (ph.area_code, ph.number, ph.extension))
+            )
+
+        for cls_obj, m2m in NON_PHONE_OR_CCLIST_M2M:
+            m2mobjs = MAPPERS[cls_obj].build_many(contact.get(m2m))
+            for m2mattrs, m2mobj in zip(contact.get(m2m), m2mobjs):
+                if self._has_too_long_field(m2mobj):
+                    pc.bad_m2m_entry = {pc.obj.cc_id: m2mattrs}
+                    continue
+                pc.m2m.append((m2m, m2mattrs.get('id'), m2mobj))
+
+        pc.notes.extend(contact.get('notes'))
+
+    @staticmethod
+    def _has_too_long_field(obj):
+        # What the DB would refuse with a DataError on a one-by-one save
+        for fld in obj._meta.concrete_fields:
+            val = getattr(obj, fld.attname)
+            if val and fld.max_length and len(val) > fld.max_length:
+                return True
+        return False
+
+    def _existing_links(self, through, src, tgt, pending, *extra):
+        # Link rows of the changed contacts in `pending`; new contacts have
+        # none. Maps (src, tgt) -> [(pk, *extra), ...], oldest row first.
+        pks = [pc.pk for pc in pending if pc.contact_in_db]
+        links = dict()
+        if not pks:
+            return links
+        rows = through.objects.filter(**{f"{src}__in": pks})\
+            .order_by('pk').values_list('pk', src, tgt, *extra)
+        for pk, src_pk, tgt_pk, *values in rows:
+            links.setdefault((src_pk, tgt_pk), []).append((pk, *values))
+        return links
+
+    def _reconcile_links(self, through, src, tgt, pending, desired,
+                         existing=None):
+        """Makes the link rows of `pending` contacts match `desired`
+
+        Only the difference is written: links which should go (or are
+        duplicated) are deleted in one query, and missing ones are inserted
+        in one more.
+
+        :param through: M2M through model
+        :param src: (str) Column of `through` pointing at the contact
+        :param tgt: (str) Column of `through` pointing at the other side
+        :param pending: (list of `_PendingContact`) The batch
+        :param desired: (iterable of tuple) Every (src, tgt) pair wanted
+        :param existing: (dict) `_existing_links` result, if already fetched
+        :return: None
+        """
+        if existing is None:
+            existing = self._existing_links(through, src, tgt, pending)
+        desired = set(desired)
+        stale = [
+            row[0] for link, rows in existing.items()
+            for row in (rows[1:] if link in desired else rows)
+        ]
+        if stale:
+            through.objects.filter(pk__in=stale).delete()
+        self._write(through, [
+            through(**{src: src_pk, tgt: tgt_pk})
+            for src_pk, tgt_pk in sorted(desired.difference(existing))
+        ])
+
+    def _reconcile_ustats(self, pending):
+        desired = dict()
+        for pc in pending:
+            for list_id, liststat in pc.ustats:
+                cclist_pk = self.index.pk(ConstantContactList, list_id)
+                desired[(pc.pk, cclist_pk)] = liststat
+        existing = self._existing_links(
+            UserStatusOnCCList, 'user_id', 'cclist_id', pending, 'status'
+        )
+        restatus = dict()
+        for link, rows in existing.items():
+            pk, status = rows[0]
+            if link in desired and status != desired[link]:
+                restatus.setdefault(desired[link], []).append(pk)
+        for status, pks in restatus.items():
+            UserStatusOnCCList.objects.filter(pk__in=pks).update(status=status)
+
+        stale = [
+            row[0] for link, rows in existing.items()
+            for row in (rows[1:] if link in desired else rows)
+        ]
+        if stale:
+            UserStatusOnCCList.objects.filter(pk__in=stale).delete()
+        self._write(UserStatusOnCCList, [
+            UserStatusOnCCList(user_id=user_pk, cclist_id=cclist_pk,
+                               status=status)
+            for (user_pk, cclist_pk), status in desired.items()
+            if (user_pk, cclist_pk) not in existing
+        ])
+
+    def _reconcile_phones(self, pending):
+        keys = {key for pc in pending for _, key in pc.phones}
+        if not keys and not any(pc.contact_in_db for pc in pending):
+            return
+        pks = PHONE_CACHE.pks_for(keys) if keys else dict()
+
+        for phfld in PHONE_FIELDS:
+            through, src, tgt = m2m_through(phfld)
+            self._reconcile_links(through, src, tgt, pending, {
+                (pc.pk, pks[key])
+                for pc in pending for fld, key in pc.phones if fld == phfld
+            })
+
+    def _reconcile_m2m(self, pending):
+        for cls_obj, m2m in NON_PHONE_OR_CCLIST_M2M:
+            new_objs = []
+            owners = []
+            changed_objs = dict()
+            desired = set()
+            for pc in pending:
+                for fld, cc_id, m2mobj in pc.m2m:
+                    if fld != m2m:
+                        continue
+                    if (cls_obj, cc_id) in self.index:
+                        pk = self.index.pk(cls_obj, cc_id)
+                        if pc.contact_in_db and pk is not None:
+                            # Still the contact's; bring the row up to date
+                            m2mobj.pk = pk
+                            changed_objs[m2mobj.cc_id] = m2mobj
+                            desired.add((pc.pk, pk))
+                            continue
+                        self.logger.debug(
+                            f"{m2m.capitalize()} {cc_id} already in database"
+                            f"...skipping"
+                        )
+                        continue
+                    # Claim the id now, later duplicates in the batch skip it
+                    self.index.add(cls_obj, cc_id, None)
+                    new_objs.append(m2mobj)
+                    owners.append(pc.pk)
+            upsert_objects(cls_obj, list(changed_objs.values()), ['cc_id'])
+            self._write(cls_obj, new_objs, with_pks=True)
+            for cpk, m2mobj in zip(owners, new_objs):
+                self.index.add(cls_obj, m2mobj.cc_id, m2mobj.pk)
+                desired.add((cpk, m2mobj.pk))
+            through, src, tgt = m2m_through(m2m)
+            self._reconcile_links(through, src, tgt, pending, desired)
+
+    def _upsert_notes(self, pending):
+        new_notes = []
+        changed_notes = dict()
+        for pc in pending:
+            for note in pc.notes:
+                if (Note, note.get('id')) in self.index:
+                    if pc.contact_in_db\
+                            and self.index.pk(Note, note.get('id')):
+                        changed_note = MAPPERS[Note].build(note)
+                        changed_note.contact_id = pc.pk
+                        changed_notes[changed_note.cc_id] = changed_note
+                    continue
+                self.index.add(Note, note.get('id'), None)
+                new_note = MAPPERS[Note].build(note)
+                new_note.contact_id = pc.pk
+                new_notes.append(new_note)
+        upsert_objects(Note, list(changed_notes.values()), ['cc_id'])
+        if not new_notes:
+            return
+        self._write(Note, new_notes, with_pks=True)
+        for new_note in new_notes:
+            self.index.add(Note, new_note.cc_id, new_note.pk)
+
+    def _insert_remediations(self, pending):
+        remediations = []
+        for pc in pending:
+            for entry in (pc.bad_m2m_entry, pc.bad_phone_entry):
+                if entry:
+                    remediations.append(RequiringRemediation(
+                        contact_pk_id=pc.pk, fields=entry
+                    ))
+        self._write(RequiringRemediation, remediations)
+
+    def _note_committed(self, pending):
+        # Only once the batch is committed, or a fallback would count twice
+        for pc in pending:
+            self.dc.counts['updated' if pc.contact_in_db else 'inserted'] += 1
+            if pc.bad_m2m_entry or pc.bad_phone_entry:
+                self.dc.counts['remediated'] += 1
+            if pc.bad_m2m_entry:
+                self.dc.bad_m2m.setdefault(pc.obj.cc_id, [])\
+                    .append(pc.bad_m2m_entry)
+            if pc.bad_phone_entry:
+                self.dc.bad_phone_nums.setdefault(pc.obj.cc_id, [])\
+                    .append(pc.bad_phone_entry)
@@ -0,0 +1,212 @@
+import io
+import json
+
+from django.db import connection, transaction
+
+DEFAULT_SQL_BATCH_SIZE = 1000
+
+
+def _insert_columns(model):
+    return [f for f in model._meta.concrete_fields if not f.primary_key]
+
+
+def insert_ignoring_conflicts(model, objs, conflict_fields,
+                              batch_size=DEFAULT_SQL_BATCH_SIZE):
+    """Inserts `objs`, silently skipping any that hit a unique constraint
+
+    Equivalent to `bulk_create` with the rows that would conflict left out,
+    but safe against other connections inserting the same rows at the same
+    time. Uses `INSERT ... ON CONFLICT DO NOTHING` on postgres and
+    `INSERT OR IGNORE` on sqlite; other backends check first, then insert.
+    Primary keys are *not* set on `objs`; look them up by `conflict_fields`.
+
+    :param model: Django model class of `objs`
+    :param objs: (list) Unsaved model instances
+    :param conflict_fields: (list of str) Names of the field(s) making up the
+        unique constraint which identifies a conflict
+    :param batch_size: (int) Rows per INSERT statement
+    :return: None
+    """
+    if not objs:
+        return
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        with transaction.atomic():
+            _filter_then_bulk_create(model, objs, conflict_fields)
+        return
+
+    qn = connection.ops.quote_name
+    fields = _insert_columns(model)
+    columns = ", ".join(qn(f.column) for f in fields)
+    row = "(" + ", ".join(["%s"] * len(fields)) + ")"
+    conflict = ", ".join(
+        qn(model._meta.get_field(name).column) for name in conflict_fields
+    )
+    if connection.vendor == 'postgresql':
+        head = f"INSERT INTO {qn(model._meta.db_table)} ({columns}) VALUES "
+        tail = f" ON CONFLICT ({conflict}) DO NOTHING"
+    else:
+        head = (f"INSERT OR IGNORE INTO {qn(model._meta.db_table)} "
+                f"({columns}) VALUES ")
+        tail = ""
+
+    with connection.cursor() as cursor:
+        for i in range(0, len(objs), batch_size):
+            chunk = objs[i:i + batch_size]
+            params = [
+                f.get_db_prep_save(f.pre_save(obj, True), connection)
+                for obj in chunk for f in fields
+            ]
+            cursor.execute(
+                head + ", ".join([row] * len(chunk)) + tail, params
+            )
+
+
+def upsert_objects(model, objs, conflict_fields, update_fields=None,
+                   batch_size=DEFAULT_SQL_BATCH_SIZE):
+    """Inserts `objs`, updating the existing row wherever one conflicts
+
+    One `INSERT ... ON CONFLICT (...) DO UPDATE` per `batch_size` objects on
+    postgres and sqlite; other backends update the rows which exist, then
+    insert the rest. As with `insert_ignoring_conflicts`, primary keys are
+    *not* set on `objs`, and no two of them may share `conflict_fields`.
+
+    :param model: Django model class of `objs`
+    :param objs: (list) Model instances; their `pk` is ignored
+    :param conflict_fields: (list of str) Names of the field(s) making up the
+        unique constraint which identifies an existing row
+    :param update_fields: (list of str, default: every other column) Names
+        of the fields overwritten on an existing row
+    :param batch_size: (int) Rows per statement
+    :return: None
+    """
+    if not objs:
+        return
+    fields = _insert_columns(model)
+    if update_fields is None:
+        update_fields = [
+            f.name for f in fields if f.name not in conflict_fields
+        ]
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        with transaction.atomic():
+            _update_then_bulk_create(
+                model, objs, conflict_fields, update_fields
+            )
+        return
+
+    qn = connection.ops.quote_name
+    columns = ", ".join(qn(f.column) for f in fields)
+    row = "(" + ", ".join(["%s"] * len(fields)) + ")"
+    conflict = ", ".join(
+        qn(model._meta.get_field(name).column) for name in conflict_fields
+    )
+    updates = ", ".join(
+        f"{qn(col)} = EXCLUDED.{qn(col)}" for col in (
+            model._meta.get_field(name).column for name in update_fields
+        )
+    )
+    head = f"INSERT INTO {qn(model._meta.db_table)} ({columns}) VALUES "
+    tail = f" ON CONFLICT ({conflict}) DO UPDATE SET {updates}"
+
+    with connection.cursor() as cursor:
+        for i in range(0, len(objs), batch_size):
+            chunk = objs[i:i + batch_size]
+            params = [
+                f.get_db_prep_save(f.pre_save(obj, True), connection)
+                for obj in chunk for f in fields
+            ]
+            cursor.execute(
+                head + ", ".join([row] * len(chunk)) + tail, params
+            )
+
+
+def _update_then_bulk_create(model, objs, conflict_fields, update_fields):
+    def key(obj):
+        return tuple(getattr(obj, name) for name in conflict_fields)
+
+    lookup = {f"{conflict_fields[0]}__in": [key(o)[0] for o in objs]}
+    in_db = set(
+        model.objects.filter(**lookup).values_list(*conflict_fields)
+    )
+    for obj in objs:
+        if key(obj) in in_db:
+            model.objects.filter(
+                **dict(zip(conflict_fields, key(obj)))
+            ).update(**{name: getattr(obj, name) for name in update_fields})
+    model.objects.bulk_create([o for o in objs if key(o) not in in_db])
+
+
+def _filter_then_bulk_create(model, objs, conflict_fields):
+    def key(obj):
+        return tuple(getattr(obj, name) for name in conflict_fields)
+
+    lookup = {f"{conflict_fields[0]}__in": [key(o)[0] for o in objs]}
+    in_db = set(
+        model.objects.filter(**lookup).values_list(*conflict_fields)
+    )
+    missing = {}
+    for obj in objs:
+        if key(obj) not in in_db:
+            missing.setdefault(key(obj), obj)
+    model.objects.bulk_create(list(missing.values()))
+
+
+def reserve_pks(model, count):
+    """Takes `count` primary keys from the postgres sequence of `model`
+
+    The keys are consumed from the sequence exactly as inserts would consume
+    them, so rows written with them (e.g. by `copy_objects`) never collide
+    with later ORM inserts and the sequence needs no `setval` afterwards.
+
+    :param model: Django model class with a serial primary key
+    :param count: (int) Number of keys wanted
+    :return: (list of int) The keys, in increasing order
+    """
+    if not count:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, %s)) "
+            "FROM generate_series(1, %s)",
+            [model._meta.db_table, model._meta.pk.column, count]
+        )
+        return sorted(pk for pk, in cursor.fetchall())
+
+
+def _copy_text(value):
+    # One field of postgres' COPY text format
+    if value is None:
+        return "\\N"
+    if hasattr(value, 'adapted'):  # psycopg2's Json, from JSONField
+        value = json.dumps(value.adapted)
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t")\
+        .replace("\n", "\\n").replace("\r", "\\r")
+
+
+def copy_objects(model, objs):
+    """Streams `objs` into the table of `model` with `COPY ... FROM STDIN`
+
+    Much faster than any INSERT for large numbers of rows, but postgres
+    only, and with no conflict handling at all: primary keys must already
+    be set (see `reserve_pks`) and no row may break a constraint.
+
+    :param model: Django model class of `objs`
+    :param objs: (list) Unsaved model instances, with their `pk` set
+    :return: None
+    """
+    if not objs:
+        return
+    qn = connection.ops.quote_name
+    fields = model._meta.concrete_fields
+    buf = io.StringIO()
+    for obj in objs:
+        buf.write("\t".join(
+            _copy_text(f.get_db_prep_save(f.pre_save(obj, True), connection))
+            for f in fields
+        ))
+        buf.write("\n")
+    buf.seek(0)
+    columns = ", ".join(qn(f.column) for f in fields)
+    with connection.cursor() as cursor:
+        cursor.cursor.copy_expert(
+            f"COPY {qn(model._meta.db_table)} ({columns}) FROM STDIN", buf
+        )
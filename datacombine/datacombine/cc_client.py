@@ -0,0 +1,239 @@
+from collections import deque
+import datetime
+from email.utils import parsedate_to_datetime
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+BASE_URI = 'https://api.constantcontact.com'
+# ConstantContact's v2 API allows 4 requests per second per API key
+CC_REQUESTS_PER_SECOND = 4
+DEFAULT_TIMEOUT = (5, 60)
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_MAX_BACKOFF = 60
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+LATENCY_SAMPLES = 1000
+
+
+class TokenBucket():
+    def __init__(self, rate=CC_REQUESTS_PER_SECOND, capacity=None,
+                 clock=time.monotonic, sleep=time.sleep):
+        """Thread-safe token bucket rate limiter
+
+        Holds up to `capacity` tokens, refilled at `rate` tokens per second.
+        Every request takes one token, waiting for it if the bucket is empty,
+        so bursts are allowed but the long run average never exceeds `rate`.
+
+        :param rate: (float) Tokens added per second
+        :param capacity: (float, default: rate) Most tokens the bucket holds
+        :param clock: (callable) Monotonic time source, in seconds
+        :param sleep: (callable) Called with the number of seconds to wait
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._last) * self.rate
+        )
+        self._last = now
+
+    def acquire(self, tokens=1):
+        """Takes `tokens` from the bucket, blocking until they are available
+
+        :param tokens: (float) Tokens to take
+        :return: (float) Seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait = (tokens - self._tokens) / self.rate
+            self._sleep(wait)
+            waited += wait
+
+
+class LatencyStats():
+    def __init__(self, samples=LATENCY_SAMPLES):
+        """Running per-request statistics for an API client
+
+        :param samples: (int) Number of most recent latencies kept for the
+            percentiles
+        """
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=samples)
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttled_seconds = 0.0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds, ok=True):
+        with self._lock:
+            self.requests += 1
+            self.errors += 0 if ok else 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self._recent.append(seconds)
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def record_throttle(self, seconds):
+        with self._lock:
+            self.throttled_seconds += seconds
+
+    def percentile(self, pct):
+        """Returns the `pct` percentile of the recent latencies, or None"""
+        with self._lock:
+            recent = sorted(self._recent)
+        if not recent:
+            return None
+        return recent[min(len(recent) - 1, int(len(recent) * pct / 100))]
+
+    def summary(self):
+        """Returns the statistics as a dict, latencies in seconds"""
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'throttled_seconds': self.throttled_seconds,
+            'mean_seconds': (
+                self.total_seconds / self.requests if self.requests else None
+            ),
+            'p50_seconds': self.percentile(50),
+            'p95_seconds': self.percentile(95),
+            'max_seconds': self.max_seconds,
+        }
+
+
+class ConstantContactClient():
+    def __init__(self, api_key, auth_key, base_uri=BASE_URI,
+                 timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                 max_backoff=DEFAULT_MAX_BACKOFF,
+                 rate_limiter=None, pool_maxsize=10, logger=None,
+                 sleep=time.sleep):
+        """HTTP client for the ConstantContact API
+
+        Keeps one `requests.Session`, so connections are pooled and kept
+        alive between pages instead of paying for a new TCP+TLS handshake on
+        every request. Requests are throttled by a token bucket shared by
+        every thread using the client, and 429 or 5xx responses (and
+        connection errors / timeouts) are retried with exponential backoff
+        and full jitter, honouring the `Retry-After` header when the API
+        sends one.
+
+        :param api_key: (str) ConstantContact developer API key
+        :param auth_key: (str) ConstantContact account authorization key
+        :param base_uri: (str) Scheme and host prepended to relative URIs
+        :param timeout: (float / tuple) `requests` (connect, read) timeout
+        :param max_retries: (int) Retries after the first attempt
+        :param backoff_factor: (float) First backoff ceiling, in seconds;
+            doubles with every retry
+        :param max_backoff: (float) Longest wait between two attempts
+        :param rate_limiter: (TokenBucket, default: CC's per-second quota)
+            Limiter to share, e.g. between clients using the same API key
+        :param pool_maxsize: (int) Connections kept alive per host
+        :param logger: (logging.Logger) Logger for retries and failures
+        :param sleep: (callable) Called with the number of seconds to wait
+        """
+        self.api_key = api_key
+        self.base_uri = base_uri
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.rate_limiter = rate_limiter or TokenBucket(sleep=sleep)
+        self.logger = logger or logging.getLogger(__name__)
+        self.stats = LatencyStats()
+        self._sleep = sleep
+
+        self.session = requests.Session()
+        self.session.headers.update({'Authorization': f'Bearer {auth_key}'})
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_maxsize, max_retries=0
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _url(self, uri):
+        return uri if uri.startswith('http') else f"{self.base_uri}{uri}"
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response is not None\
+            and response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = (
+                        parsedate_to_datetime(retry_after) -
+                        datetime.datetime.now(datetime.timezone.utc)
+                    ).total_seconds()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(self.max_backoff, max(0.0, delay))
+        ceiling = min(self.max_backoff, self.backoff_factor * 2 ** attempt)
+        return random.uniform(0, ceiling)
+
+    def get(self, uri, params=None):
+        """GETs `uri`, retrying throttled and failed requests
+
+        :param uri: (str) Absolute URL, or path relative to `base_uri`
+        :param params: (dict) Query string parameters
+        :return: (requests.Response) The first response which should not be
+            retried, or the last one once retries are exhausted. Connection
+            errors are re-raised once retries are exhausted.
+        """
+        url = self._url(uri)
+        attempt = 0
+        while True:
+            self.stats.record_throttle(self.rate_limiter.acquire())
+            start = time.monotonic()
+            try:
+                r = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.stats.record(time.monotonic() - start, ok=False)
+                if attempt >= self.max_retries:
+                    raise
+                r, error = None, e
+            else:
+                self.stats.record(
+                    time.monotonic() - start,
+                    ok=r.status_code not in RETRY_STATUSES
+                )
+                if r.status_code not in RETRY_STATUSES\
+                        or attempt >= self.max_retries:
+                    return r
+                error = f"{r.status_code}: {r.reason}"
+
+            delay = self._backoff(attempt, r)
+            attempt += 1
+            self.stats.record_retry()
+            self.logger.warning(
+                f"GET {url} failed with {error}; retry {attempt} of "
+                f"{self.max_retries} in {delay:.2f} seconds."
+            )
+            self._sleep(delay)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,164 @@
+from .models import (
+    Contact,
+    EmailAddress,
+    ConstantContactList,
+    Note,
+    Address
+)
+
+DEFAULT_CHUNK_SIZE = 500
+_MISSING = object()
+INDEXED_MODELS = (Contact, Address, EmailAddress, Note, ConstantContactList)
+
+
+class CCIdIndex():
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """In-memory map of ConstantContact ids to local primary keys
+
+        Combining asks "is this ConstantContact object already in the local
+        DB?" for every contact, address, email and note it sees. Loading the
+        answers once up front, and keeping them current as rows are
+        inserted, replaces those per-object queries with dict lookups.
+
+        Contacts map `cc_id -> (pk, cc_modified_date, fingerprint)` (see
+        `models.Contact.make_fingerprint`); addresses, email
+        addresses, notes and lists map `cc_id -> pk`. Keys are normalized
+        to the python type of each model's `cc_id` field, so '1983' and 1983
+        are the same contact.
+
+        :param chunk_size: (int) Maximum number of ids per `IN` query when
+            loading only some ids (see `load_for_contacts`)
+        """
+        self.chunk_size = chunk_size
+        self._maps = {model: dict() for model in INDEXED_MODELS}
+        # One undo log per open `begin`, innermost last
+        self._undo = []
+
+    @staticmethod
+    def _key(model, cc_id):
+        return model._meta.get_field('cc_id').to_python(cc_id)
+
+    @staticmethod
+    def _value_fields(model):
+        if model is Contact:
+            return ('cc_id', 'pk', 'cc_modified_date', 'fingerprint')
+        return ('cc_id', 'pk')
+
+    def _store(self, model, rows):
+        ccmap = self._maps[model]
+        if model is Contact:
+            for cc_id, pk, modified_date, fingerprint in rows:
+                ccmap[cc_id] = (pk, modified_date, fingerprint)
+        else:
+            for cc_id, pk in rows:
+                ccmap[cc_id] = pk
+
+    def load(self):
+        """Loads every indexed row in the local DB, one query per model
+
+        :return: self
+        """
+        for model in INDEXED_MODELS:
+            # Contacts only imported from HighRise have no `cc_id`
+            self._store(
+                model,
+                model.objects.filter(cc_id__isnull=False)
+                .values_list(*self._value_fields(model))
+            )
+        return self
+
+    def load_ids(self, model, cc_ids):
+        """Loads the rows of `model` with the given ids, one query per chunk
+
+        :param model: One of `INDEXED_MODELS`
+        :param cc_ids: (iterable) ConstantContact ids of `model`
+        :return: self
+        """
+        keys = sorted({self._key(model, cc_id) for cc_id in cc_ids})
+        for i in range(0, len(keys), self.chunk_size):
+            self._store(
+                model,
+                model.objects.filter(
+                    cc_id__in=keys[i:i + self.chunk_size]
+                ).values_list(*self._value_fields(model))
+            )
+        return self
+
+    def load_for_contacts(self, contacts, cclists=()):
+        """Loads only the rows that harvested objects could collide with
+
+        Meant for incremental runs, where the harvest is a small slice of a
+        large local DB.
+
+        :param contacts: (list of dict) ConstantContact contact JSON
+        :param cclists: (list of dict) ConstantContact list JSON
+        :return: self
+        """
+        ids = {model: set() for model in INDEXED_MODELS}
+        for contact in contacts:
+            ids[Contact].add(contact.get('id'))
+            for address in contact.get('addresses') or ():
+                ids[Address].add(address.get('id'))
+            for email in contact.get('email_addresses') or ():
+                ids[EmailAddress].add(email.get('id'))
+            for note in contact.get('notes') or ():
+                ids[Note].add(note.get('id'))
+            for xcclist in contact.get('lists') or ():
+                ids[ConstantContactList].add(xcclist.get('id'))
+        for cclist in cclists:
+            ids[ConstantContactList].add(cclist.get('id'))
+        for model, cc_ids in ids.items():
+            self.load_ids(model, cc_ids)
+        return self
+
+    def contact(self, cc_id):
+        """Returns (pk, cc_modified_date, fingerprint) for a contact, or
+        None"""
+        return self._maps[Contact].get(self._key(Contact, cc_id))
+
+    def pk(self, model, cc_id):
+        """Returns the local primary key of `model` with `cc_id`, or None"""
+        entry = self._maps[model].get(self._key(model, cc_id))
+        if model is Contact and entry:
+            return entry[0]
+        return entry
+
+    def __contains__(self, model_n_cc_id):
+        model, cc_id = model_n_cc_id
+        return self._key(model, cc_id) in self._maps[model]
+
+    def add(self, model, cc_id, pk, modified_date=None, fingerprint=None):
+        """Records a row that was just inserted into (or found in) the DB"""
+        key = self._key(model, cc_id)
+        ccmap = self._maps[model]
+        if self._undo:
+            self._undo[-1].append((ccmap, key, ccmap.get(key, _MISSING)))
+        ccmap[key] = (pk, modified_date, fingerprint) if model is Contact\
+            else pk
+
+    def begin(self):
+        """Starts recording `add`s, so they can be undone with `rollback`
+
+        Should be paired with the DB transaction (or savepoint) the rows are
+        inserted in; like those, calls may be nested.
+        """
+        self._undo.append([])
+
+    def commit(self):
+        """Keeps every `add` since the last `begin`, unless an enclosing
+        `begin` is rolled back later"""
+        undo = self._undo.pop() if self._undo else []
+        if self._undo:
+            self._undo[-1].extend(undo)
+
+    def rollback(self):
+        """Forgets every `add` since the last `begin`"""
+        undo = self._undo.pop() if self._undo else []
+        for ccmap, key, previous in reversed(undo):
+            if previous is _MISSING:
+                ccmap.pop(key, None)
+            else:
+                ccmap[key] = previous
+
+    def __len__(self):
+        return sum(len(ccmap) for ccmap in self._maps.values())
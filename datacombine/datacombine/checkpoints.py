@@ -0,0 +1,162 @@
+import glob
+import hashlib
+import json
+import os
+import re
+
+from cryptography.fernet import InvalidToken
+
+CHECKPOINT_PREFIX = "harvest"
+
+
+class HarvestCheckpoint():
+    def __init__(self, directory, api_uri, params, fernet=None):
+        """Append-only record of the pages fetched by one harvest
+
+        Every page is written as one JSON line holding the URI it was
+        fetched from, its `next_link` and the raw contacts, and is flushed
+        and fsync'd before the harvest moves on; the last complete line is
+        the committed cursor. A harvest that dies halfway can continue from
+        that cursor, and already-fetched pages can be replayed without
+        calling the API again.
+
+        One file is kept per endpoint and status, named after a hash of the
+        harvest parameters (the API key is left out), so a checkpoint is
+        only resumed by the same harvest that wrote it.
+
+        The pages hold contacts' personal details, so the file is only
+        readable by its owner, and with a `fernet` every line is encrypted.
+        Clear the checkpoint once the harvest has been combined.
+
+        :param directory: (str) Directory the checkpoint file lives in;
+            created, owner only, if missing
+        :param api_uri: (str) The API endpoint being harvested
+        :param params: (dict) Parameters of the initial request
+        :param fernet: (`Fernet`) Encrypts and decrypts each line
+        """
+        self.api_uri = api_uri
+        self.params = {k: v for k, v in params.items() if k != 'api_key'}
+        self.directory = directory
+        self._fernet = fernet
+        self.path = os.path.join(
+            directory,
+            f"{self._prefix(api_uri, self.params.get('status'))}-"
+            f"{self._digest(api_uri, self.params)}.jsonl"
+        )
+
+    @staticmethod
+    def _prefix(api_uri, status):
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', api_uri).strip('_')
+        return f"{CHECKPOINT_PREFIX}-{slug}-{status or 'ALL'}"
+
+    @staticmethod
+    def _digest(api_uri, params):
+        key = json.dumps([api_uri, params], sort_keys=True, default=str)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+    @classmethod
+    def latest(cls, directory, api_uri, status='ALL', fernet=None):
+        """Returns the most recently written checkpoint for an endpoint and
+        status, or None
+
+        Lets a caller which derives its parameters from the local DB (see
+        `DataCombine.update_local_db_caches`) resume with the parameters the
+        interrupted harvest actually used.
+        """
+        paths = glob.glob(
+            os.path.join(directory, f"{cls._prefix(api_uri, status)}-*.jsonl")
+        )
+        for path in sorted(paths, key=os.path.getmtime, reverse=True):
+            header = cls._read_header(path, fernet)
+            if header and header.get('api_uri') == api_uri:
+                return cls(directory, api_uri, header['params'], fernet)
+        return None
+
+    @staticmethod
+    def _decode(line, fernet):
+        if fernet is not None:
+            try:
+                line = fernet.decrypt(line.strip().encode('ascii'))
+            except (InvalidToken, UnicodeEncodeError):
+                raise ValueError("Not a checkpoint line for this key")
+        return json.loads(line)
+
+    @classmethod
+    def _read_header(cls, path, fernet=None):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls._decode(f.readline(), fernet)
+        except (OSError, ValueError):
+            return None
+
+    def _records(self):
+        try:
+            f = open(self.path, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return
+        with f:
+            f.readline()  # Header
+            for line in f:
+                try:
+                    yield self._decode(line, self._fernet)
+                except ValueError:
+                    # Torn final line from a crash mid-write; not committed
+                    return
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def start(self):
+        """Discards any earlier checkpoint for this endpoint and status and
+        begins a new one"""
+        self.clear()
+        self._append({'api_uri': self.api_uri, 'params': self.params})
+
+    def clear(self):
+        """Removes every checkpoint file for this endpoint and status"""
+        prefix = self._prefix(self.api_uri, self.params.get('status'))
+        for path in glob.glob(
+                os.path.join(self.directory, f"{prefix}-*.jsonl")):
+            os.remove(path)
+
+    def _append(self, record):
+        line = json.dumps(record)
+        if self._fernet is not None:
+            line = self._fernet.encrypt(line.encode('utf-8')).decode('ascii')
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        with open(fd, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def record_page(self, uri, results, next_link):
+        """Commits one fetched page
+
+        :param uri: (str) URI the page was fetched from
+        :param results: (list of dict) Raw contacts in the page
+        :param next_link: (str / False) Cursor of the following page
+        :return: None
+        """
+        self._append(
+            {'uri': uri, 'next_link': next_link, 'results': results}
+        )
+
+    def pages(self):
+        """Replays the committed pages, without calling the API
+
+        :return: Generator of (list of dict), the contacts in each page
+        """
+        for record in self._records():
+            yield record['results']
+
+    def next_uri(self):
+        """Returns the URI to continue from: the harvest's first URI if no
+        page was committed, or False if the harvest already finished"""
+        next_uri = self.api_uri
+        for record in self._records():
+            next_uri = record['next_link']
+        return next_uri
+
+    def is_complete(self):
+        return self.exists() and self.next_uri() is False
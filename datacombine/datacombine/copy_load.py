@@ -0,0 +1,90 @@
+from .bulk_combine import (
+    BulkCombiner,
+    PHONE_FIELDS,
+    m2m_through
+)
+from .bulk_sql import copy_objects, reserve_pks
+from .phone_cache import PHONE_CACHE
+from .models import Phone
+
+DEFAULT_COPY_BATCH_SIZE = 5000
+
+
+class CopyLoader(BulkCombiner):
+    def __init__(self, dcombine, batch_size=DEFAULT_COPY_BATCH_SIZE,
+                 index=None):
+        """Loads contacts into an *empty* postgres DB with `COPY FROM STDIN`
+
+        Works like `BulkCombiner` (and builds exactly the same rows), but
+        each model and M2M table is streamed in with one `COPY` per batch,
+        in dependency order, with primary keys reserved up front from the
+        tables' own sequences (see `bulk_sql.reserve_pks`). `COPY` has no
+        conflict handling, which is why the DB must start without contacts;
+        phones are deduplicated here across the whole load instead.
+
+        :param dcombine: (`DataCombine`) See `BulkCombiner`
+        :param batch_size: (int) Contacts per batch (and per `COPY`)
+        :param index: (`cc_index.CCIdIndex`) See `BulkCombiner`
+        """
+        super().__init__(dcombine, batch_size=batch_size, index=index)
+        self._phone_pks = dict()
+        self._batch_phone_pks = dict()
+
+    def _write(self, model, objs, with_pks=False):
+        # Every table has a serial key, `with_pks` or not, and COPY won't
+        # fill it in
+        if not objs:
+            return
+        for obj, pk in zip(objs, reserve_pks(model, len(objs))):
+            obj.pk = pk
+        copy_objects(model, objs)
+
+    def combine_batch(self, contacts):
+        self._batch_phone_pks = dict()
+        return super().combine_batch(contacts)
+
+    def _reconcile_phones(self, pending):
+        new_keys = {
+            key for pc in pending for _, key in pc.phones
+        }.difference(self._phone_pks)
+        if new_keys:
+            # Contacts that fell back to `_combine_contact_safely` inserted
+            # their phones without us; they're the only ones already there
+            by_phone_key = {Phone.make_key(*key): key for key in new_keys}
+            for phone_key, pk in Phone.objects.filter(
+                    phone_key__in=list(by_phone_key)
+            ).values_list('phone_key', 'pk'):
+                key = by_phone_key[phone_key]
+                self._phone_pks[key] = pk
+                new_keys.discard(key)
+        phones = [
+            Phone(area_code=ac, number=num, extension=ext,
+                  phone_key=Phone.make_key(ac, num, ext))
+            for ac, num, ext in sorted(
+                new_keys, key=lambda key: Phone.make_key(*key)
+            )
+        ]
+        self._write(Phone, phones)
+        self._batch_phone_pks = {ph.key: ph.pk for ph in phones}
+        pks = dict(self._phone_pks)
+        pks.update(self._batch_phone_pks)
+
+        for phfld in PHONE_FIELDS:
+            through, src, tgt = m2m_through(phfld)
+            links = {
+                (pc.pk, pks[key])
+                for pc in pending for fld, key in pc.phones if fld == phfld
+            }
+            self._write(through, [
+                through(**{src: cpk, tgt: ppk}) for cpk, ppk in sorted(links)
+            ])
+
+    def _note_committed(self, pending):
+        # A rolled back batch must not leave its phones behind
+        super()._note_committed(pending)
+        self._phone_pks.update(self._batch_phone_pks)
+        PHONE_CACHE.put_on_commit({
+            Phone.make_key(*key): pk
+            for key, pk in self._batch_phone_pks.items()
+        })
+        self._batch_phone_pks = dict()
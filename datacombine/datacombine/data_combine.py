@@ -1,15 +1,26 @@
 import ciso8601
+from collections import Counter
+from concurrent.futures import (
+    FIRST_EXCEPTION,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait
+)
 import datetime
 from dateutil import parser
 import json
 import logging
+import multiprocessing
 import os
+import queue
+import threading
+import zlib
 
-import requests
 from cryptography.fernet import Fernet
 from django.core.exceptions import FieldError
 from django.db.utils import DataError
-from django.db import transaction, IntegrityError
+from django.db import connection, connections, transaction, IntegrityError
+from django.db.models import Case, CharField, Value, When
 from .models import (
     Contact,
     Phone,
@@ -22,8 +33,39 @@ from .models import (
 )
 from profilestats import profile
 
+from .cc_client import ConstantContactClient
+from .bulk_combine import (
+    BulkCombiner,
+    NON_PHONE_OR_CCLIST_M2M,
+    PHONE_FIELDS,
+    chunked
+)
+from .cc_index import CCIdIndex
+from .copy_load import CopyLoader, DEFAULT_COPY_BATCH_SIZE
+from .highrise_import import DEFAULT_IMPORT_BATCH_SIZE, HighRiseImporter
+from .checkpoints import HarvestCheckpoint
+from .mappers import (
+    CONTACT_MAPPER,
+    CONTACT_UPDATE_FIELDS,
+    MAPPERS,
+    ModelMapper,
+    convert_choice_to_field
+)
+from .phone_cache import PHONE_CACHE
+from .progress import ConsoleSink, ProgressReporter, STAGES
+from .snapshot_store import SnapshotStore
+from .snapshots import (
+    CCLIST,
+    CONTACT,
+    KEEP_LOCAL,
+    SnapshotChain,
+    iter_records,
+    merge_objects,
+    read_snapshot,
+    write_snapshot
+)
+from .transactions import TransactionPolicy
 from .settings import BASE_DIR
-from .utils import updt
 
 API_KEY = None
 AUTH_KEY = None
@@ -34,9 +76,24 @@ try:
 except ImportError:
     pass
 
-BASE_URI = 'https://api.constantcontact.com'
+# Key for encrypted snapshots, from `Fernet.generate_key()`
+SNAPSHOT_KEY = None
+try:
+    from .secret_settings import SNAPSHOT_KEY
+except ImportError:
+    pass
+
 HTTP_FAIL_THRESHOLD = 400
 HERE = os.path.join(BASE_DIR, "datacombine")
+PIPELINE_POLL_SECONDS = 0.5
+SNAPSHOT_MANIFEST = os.path.join(HERE, "yaya_cc.manifest.json")
+# Harvest checkpoints hold raw contacts, so they're kept apart from the logs
+CHECKPOINT_DIR = os.path.join(HERE, "checkpoints")
+DEFAULT_SNAPSHOT_CHUNK_SIZE = 500
+CONTACT_STATUSES = (
+    'ACTIVE', 'UNCONFIRMED', 'OPTOUT', 'REMOVED', 'NON_SUBSCRIBER'
+)
+_END_OF_PAGES = object()
 
 
 class CombineException(BaseException):
@@ -48,14 +105,15 @@ class CombineException(BaseException):
 class DataCombine():
     def __init__(self, api_key=API_KEY, auth_key=AUTH_KEY,
                  loglvl=logging.ERROR, logger_name=__name__,
-                 logfile='dcombine.log'):
+                 logfile='dcombine.log', client=None,
+                 transaction_policy=None, snapshot_key=SNAPSHOT_KEY):
         """Manages relationship between the local DB and ConstantContact API
 
         Uses the optional file `secret_settings.py` to set the default API_KEY,
-        AUTH_KEY. Some methods require the postgres password, which can also be
-        in this file. The `secret_settings.py` is not maintained in the github
-        repo, for obvious security reasons, and must be in the same package
-        as `data_combine.py`.
+        AUTH_KEY and SNAPSHOT_KEY. Some methods require the postgres
+        password, which can also be in this file. The `secret_settings.py`
+        is not maintained in the github repo, for obvious security reasons,
+        and must be in the same package as `data_combine.py`.
 
         :param api_key: (str) ConstantContact developer API key
         :param auth_key: (str) ConstantContact account authorization key
@@ -63,20 +121,38 @@ class DataCombine():
             threshold
         :param logger_name: (str) Name of the logger used
         :param logfile: (str) Name of the logfile
+        :param client: (ConstantContactClient) Client for the ConstantContact
+            API; by default one is made from `api_key` and `auth_key`
+        :param transaction_policy: (`transactions.TransactionPolicy`) How
+            contacts combined one at a time are grouped into transactions
+        :param snapshot_key: (str / bytes) Fernet key that snapshots are
+            encrypted with and decrypted by (see `dump_snapshot`)
         """
         self.api_key = api_key
         self.token = auth_key
         # Check for log directory
-        logdir = os.path.join(HERE, "logs")
-        if not os.path.isdir(logdir):
-            os.mkdir(logdir)
+        self.logdir = os.path.join(HERE, "logs")
+        if not os.path.isdir(self.logdir):
+            os.mkdir(self.logdir)
+        self.logfile = logfile
+        self.checkpointdir = CHECKPOINT_DIR
+        # Checkpoints written by this instance's harvests, until combined
+        self._checkpoints = []
         self._setup_logger(loglvl, logger_name, logfile)
         self.headers = {'Authorization': f'Bearer {self.token}'}
+        self.client = client or ConstantContactClient(
+            self.api_key, self.token, logger=self.logger
+        )
         self.contacts = []
         self.cclists = []
         self.highrise_contacts_json = dict()
         self.bad_phone_nums = dict()
         self.bad_m2m = dict()
+        self.cc_index = None
+        self.counts = Counter()
+        self.load_summary = None
+        self.transaction_policy = transaction_policy or TransactionPolicy()
+        self.fernet = Fernet(snapshot_key) if snapshot_key else None
 
     def _setup_logger(self, lvl, logger, logfile="dcombine.log",
                       max_bytes=1000000, backup_count=5):
@@ -103,9 +179,7 @@ class DataCombine():
         )
         return None
 
-    def _harvest_contact_page(self, params, api_url):
-        url = f"{BASE_URI}{api_url}"
-
+    def _fetch_contact_page(self, params, api_url):
         # Parameters should only be required on the initial GET request
         params = {
             'api_key': self.api_key
@@ -116,28 +190,134 @@ class DataCombine():
             self._limit = limit
 
         # GET them contacts
-        r = requests.get(url, params=params, headers=self.headers)
-        self.logger.debug(f"Getting '{self._limit}' contacts from {url}.")
+        r = self.client.get(api_url, params=params)
+        self.logger.debug(
+            f"Getting '{self._limit}' contacts from {api_url} took "
+            f"{r.elapsed.total_seconds()} seconds."
+        )
 
-        # In case of UH-OH!
+        # In case of UH-OH! The client has already retried what it could, and
+        # a harvest missing its remaining pages mustn't pass for a whole one
         if r.status_code >= HTTP_FAIL_THRESHOLD:
-            return self._report_cc_api_request_fail(r)
+            self._report_cc_api_request_fail(r)
+            raise CombineException(
+                f"Harvest failed at '{api_url}' with {r.status_code}: "
+                f"{r.reason}"
+            )
 
         # Pick them tasty contacts
         rjson = r.json()
-        self.contacts.extend(rjson['results'])
 
         # Get next_link or signal end
         if "next_link" in rjson['meta']['pagination']:
             next_link = rjson['meta']['pagination']['next_link']
             self.logger.debug(f"Found next link to harvest: '{next_link}'")
-            return next_link
         else: # DONE!
+            next_link = False
             self.logger.debug("No more contacts to harvest.")
-            return False
+        return rjson['results'], next_link
+
+    def iter_contact_pages(self, params, api_uri='/v2/contacts',
+                           checkpoint=None, resume=False):
+        """Walks the `next_link`s of a contact harvest, one page at a time
+
+        :param params: (dict) Parameters of the initial request (see
+            `_contact_harvest_params`)
+        :param api_uri: (str) The API endpoint for ConstantContact contacts
+        :param checkpoint: (HarvestCheckpoint) If given, every page is
+            committed to it before being yielded
+        :param resume: (bool) Replay the pages already in `checkpoint` and
+            continue from its cursor, instead of starting a new checkpoint
+        :return: Generator of (list of dict), the contacts in each page.
+            Raises `CombineException` if a page can't be fetched, leaving
+            `checkpoint` to resume from
+        """
+        next_page = api_uri
+        if checkpoint is not None:
+            if resume and checkpoint.exists():
+                yield from checkpoint.pages()
+                next_page = checkpoint.next_uri()
+                self.logger.info(
+                    f"Replayed checkpoint '{checkpoint.path}'; "
+                    + (f"resuming from '{next_page}'." if next_page
+                       else "harvest was already complete.")
+                )
+            else:
+                checkpoint.start()
+
+        while next_page:
+            page = self._fetch_contact_page(params, next_page)
+            if page is None:
+                raise CombineException(
+                    f"Harvest of '{api_uri}' stopped at '{next_page}'"
+                )
+            results, next_link = page
+            if checkpoint is not None:
+                checkpoint.record_page(next_page, results, next_link)
+            yield results
+            next_page = next_link
+
+    def contact_checkpoint(self, status='ALL', limit='500',
+                           modified_since=None, api_uri='/v2/contacts'):
+        """Returns the `HarvestCheckpoint` a contact harvest with these
+        parameters writes to (see `harvest_contacts`)"""
+        return HarvestCheckpoint(
+            self.checkpointdir, api_uri,
+            self._contact_harvest_params(status, limit, modified_since),
+            self.fernet
+        )
+
+    def _harvest_checkpoint(self, api_uri, params, checkpoint=True):
+        # The checkpoint a harvest writes to, or None; remembered so that
+        # `clear_harvest_checkpoints` can remove it once combined
+        if not checkpoint:
+            return None
+        if self.fernet is None:
+            self.logger.warning(
+                "No SNAPSHOT_KEY is set; harvest checkpoints in "
+                f"'{self.checkpointdir}' are not encrypted"
+            )
+        cp = HarvestCheckpoint(self.checkpointdir, api_uri, params,
+                               self.fernet)
+        self._checkpoints.append(cp)
+        return cp
+
+    def clear_harvest_checkpoints(self):
+        """Removes the checkpoints of this instance's finished harvests
+
+        Called once what they harvested has been combined into the local DB;
+        a checkpoint is only needed to resume a harvest which didn't get
+        that far. The checkpoint of a harvest which never fetched its last
+        page is kept, however it ended, so it can still be resumed.
+        """
+        unfinished = []
+        for cp in self._checkpoints:
+            if cp.is_complete():
+                cp.clear()
+            else:
+                unfinished.append(cp)
+        self._checkpoints = unfinished
+
+    def _contact_harvest_params(self, status='ALL', limit='500',
+                                modified_since=None):
+        if limit and not type(limit) == str:
+            limit = str(limit)
+
+        params = {
+            'status': status,
+            'limit': limit,
+            'api_key': self.api_key,
+        }
+        if modified_since:
+            if not self._check_for_iso_8601_format(modified_since):
+                raise TypeError(f"'{modified_since}' is not in iso8601 format")
+            else:
+                params['modified_since'] = modified_since
+        return params
 
     def harvest_contacts(self, status='ALL', limit='500', modified_since=None,
-                         api_uri='/v2/contacts', delete_contacts=True):
+                         api_uri='/v2/contacts', delete_contacts=True,
+                         resume=False, checkpoint=False):
         """Downloads contacts from ConstantContact account
 
         :param status: (str): From one of UNCONFIRMED, ACTIVE, OPTOUT, REMOVED,
@@ -152,6 +332,16 @@ class DataCombine():
         :param api_uri: (str) The API endpoint for ConstantContact contacts
         :param delete_contacts: (bool) Delete any values currently in
             `self.contacts`
+        :param resume: (bool) Continue the last harvest with the same
+            parameters from its checkpointed cursor. Pages it already fetched
+            are replayed from the checkpoint rather than the API, so resuming
+            a finished harvest makes no requests at all. Implies
+            `checkpoint`.
+        :param checkpoint: (bool) Commit every page to a `HarvestCheckpoint`
+            under `CHECKPOINT_DIR` (encrypted with `self.fernet`, if there
+            is a key), so this harvest can be resumed. The checkpoint is
+            removed when the contacts are combined (see
+            `clear_harvest_checkpoints`).
         :return: None, contacts are saved in json formatted list in
             `self.contacts`
         """
@@ -163,22 +353,110 @@ class DataCombine():
                 "is False"
             )
 
-        if limit and not type(limit) == str:
-            limit = str(limit)
+        params = self._contact_harvest_params(status, limit, modified_since)
+        cp = self._harvest_checkpoint(api_uri, params, checkpoint or resume)
+        for results in self.iter_contact_pages(params, api_uri, cp, resume):
+            self.contacts.extend(results)
+        self.logger.info(
+            f"Harvested '{len(self.contacts)}' contacts; API client stats: "
+            f"{self.client.stats.summary()}"
+        )
 
-        params = {
-            'status': status,
-            'limit': limit,
-            'api_key': self.api_key,
-        }
-        if modified_since:
-            if not self._check_for_iso_8601_format(modified_since):
-                raise TypeError(f"'{modified_since}' is not in iso8601 format")
-            else:
-                params['modified_since'] = modified_since
-        next_page = api_uri
-        while next_page:
-            next_page = self._harvest_contact_page(params, next_page)
+    def _harvest_contact_shard(self, status, limit, modified_since, api_uri,
+                               resume, checkpoint):
+        params = self._contact_harvest_params(status, limit, modified_since)
+        cp = self._harvest_checkpoint(api_uri, params, checkpoint or resume)
+        contacts = []
+        for results in self.iter_contact_pages(params, api_uri, cp, resume):
+            contacts.extend(results)
+        self.logger.debug(f"Harvested '{len(contacts)}' {status} contacts.")
+        return contacts
+
+    @staticmethod
+    def _newest_by_id(contacts):
+        # A contact whose status changes mid-harvest can show up in two
+        # shards; keep whichever copy was modified last
+        newest = dict()
+        for contact in contacts:
+            seen = newest.get(contact['id'])
+            if seen is None or ciso8601.parse_datetime(
+                    contact['modified_date']
+            ) > ciso8601.parse_datetime(seen['modified_date']):
+                newest[contact['id']] = contact
+        return list(newest.values())
+
+    def harvest_contacts_parallel(self, statuses=CONTACT_STATUSES,
+                                  limit='500', modified_since=None,
+                                  api_uri='/v2/contacts', delete_contacts=True,
+                                  resume=False, max_workers=None,
+                                  checkpoint=False):
+        """Downloads contacts with one concurrent harvest per status
+
+        A single harvest is a chain of `next_link` cursors and so strictly
+        sequential; harvesting each status separately gives independent
+        chains which run side by side on a thread pool. Every shard shares
+        `self.client`, so together they stay within its rate limit, and each
+        can be checkpointed on its own (see `harvest_contacts`). The results
+        are merged, keeping the most recently modified copy of any contact
+        seen in more than one shard.
+
+        :param statuses: (iterable of str) Statuses to harvest, one shard each
+        :param limit: (str / int) See `harvest_contacts`
+        :param modified_since: (datetime) See `harvest_contacts`
+        :param api_uri: (str) The API endpoint for ConstantContact contacts
+        :param delete_contacts: (bool) See `harvest_contacts`
+        :param resume: (bool) See `harvest_contacts`; applies to each shard
+        :param max_workers: (int, default: one per status) Threads harvesting
+            at once
+        :param checkpoint: (bool) See `harvest_contacts`; applies to each
+            shard
+        :return: None, contacts are saved in json formatted list in
+            `self.contacts`
+        """
+        if delete_contacts:
+            self.contacts = []
+        else:
+            raise CombineException(
+                "Contacts already exist and 'delete_contacts' parameter "
+                "is False"
+            )
+
+        statuses = list(statuses)
+        begin_time = datetime.datetime.now()
+        with ThreadPoolExecutor(
+                max_workers=max_workers or len(statuses)
+        ) as pool:
+            shards = [
+                pool.submit(self._harvest_contact_shard, status, limit,
+                            modified_since, api_uri, resume, checkpoint)
+                for status in statuses
+            ]
+            done, pending = wait(shards, return_when=FIRST_EXCEPTION)
+            failed = [
+                (status, shard.exception())
+                for status, shard in zip(statuses, shards)
+                if shard in done and shard.exception() is not None
+            ]
+            if failed:
+                # What the other shards harvested is no harvest of every
+                # status; don't start any more of them, and raise
+                for shard in pending:
+                    shard.cancel()
+                self.logger.error(
+                    "Harvesting contacts failed for status(es) "
+                    f"{', '.join(status for status, _ in failed)}"
+                )
+                raise failed[0][1]
+            harvested = [c for shard in shards for c in shard.result()]
+        self.contacts = self._newest_by_id(harvested)
+
+        total_time = (datetime.datetime.now() - begin_time).total_seconds()
+        self.logger.info(
+            f"Harvested '{len(self.contacts)}' contacts "
+            f"({len(harvested) - len(self.contacts)} duplicates dropped) from "
+            f"{len(statuses)} shards in {total_time} seconds; API client "
+            f"stats: {self.client.stats.summary()}"
+        )
 
     def _check_for_iso_8601_format(self, dt):
         return bool(ciso8601.parse_datetime(dt))
@@ -205,8 +483,6 @@ class DataCombine():
         params = {
             'api_key': self.api_key,
         }
-        url = f"{BASE_URI}{api_uri}"
-
         if modified_since:
             if not self._check_for_iso_8601_format(modified_since):
                 raise TypeError(f"'{modified_since}' is not in iso8601 format")
@@ -214,7 +490,7 @@ class DataCombine():
                 params['modified_since'] = modified_since
 
         # GET dem lists!
-        r = requests.get(url, params=params, headers=self.headers)
+        r = self.client.get(api_uri, params=params)
         self.logger.debug(f"Making list request: {r}")
 
         # In case of UH-OH!
@@ -228,8 +504,11 @@ class DataCombine():
         )
 
     def _get_most_recent_datetime(self, cls_obj, param):
-        # Order in decreasing order so first is now last, and last is now first
-        by_most_recent = cls_obj.objects.order_by('-'+param)
+        # Order in decreasing order so first is now last, and last is now
+        # first.
+        # NULLs (e.g. contacts only imported from HighRise) would sort first.
+        by_most_recent = cls_obj.objects.filter(**{f"{param}__isnull": False})\
+            .order_by('-'+param)
         if not by_most_recent:
             return None
         mrdt = getattr(by_most_recent.first(), param)
@@ -238,13 +517,22 @@ class DataCombine():
         else:
             return None
 
-    def update_local_db_caches(self):
+    def update_local_db_caches(self, resume=False, snapshot=None,
+                               checkpoint=False):
         """Finds the most recent lists and contacts, and downloads any new ones
 
         Works primarly through the `harvest` functions, and will delete any
         contacts or lists in their respective variables, and overwrite them
         with new lists and contacts.
 
+        :param resume: (bool) Resume the last contact harvest's checkpoint,
+            with the `modified_since` it was started with, rather than start
+            over from the most recent contact in the DB (which a partial
+            combine may already have moved)
+        :param snapshot: (str) Path of a `snapshots.SnapshotChain` manifest
+            (e.g. `SNAPSHOT_MANIFEST`). If given, what was harvested is added
+            to the chain as a delta, rather than dumping every contact again.
+        :param checkpoint: (bool) See `harvest_contacts`
         :return: None. Overwrites `self.contacts` and `self.cclists` with
             new contacts and lists, respectively.
         """
@@ -254,159 +542,402 @@ class DataCombine():
         most_recent_contact_dt = self._get_most_recent_datetime(
             Contact, 'cc_modified_date'
         )
+        if resume:
+            cp = HarvestCheckpoint.latest(
+                self.checkpointdir, '/v2/contacts', fernet=self.fernet
+            )
+            if cp is not None:
+                most_recent_contact_dt = cp.params.get('modified_since')
 
         # Begin the harvesting!!!
         self.harvest_lists(modified_since=most_recent_list_dt)
-        self.harvest_contacts(modified_since=most_recent_contact_dt)
+        self.harvest_contacts(
+            modified_since=most_recent_contact_dt, resume=resume,
+            checkpoint=checkpoint
+        )
 
         self.logger.info(
             "Harvested Constant Contact lists from "
             f"{most_recent_list_dt} and harvested Constant Contact"
             f" Contacts from {most_recent_contact_dt}."
         )
+        if snapshot:
+            written = self.snapshot_chain(snapshot).append_delta(
+                iter_records(self.contacts, self.cclists),
+                modified_since=most_recent_contact_dt
+            )
+            self.logger.debug(f"Added '{written}' records to '{snapshot}'")
 
-    def combine_and_update_new_entries(self):
+    def combine_and_update_new_entries(self, resume=False, snapshot=None,
+                                       checkpoint=False):
         """Updates local db caches and combines them into the db
 
         Note: "db caches" are defined as `self.cclists` and `self.contacts`
 
+        :param resume: (bool) See `update_local_db_caches`
+        :param snapshot: (str) See `update_local_db_caches`
+        :param checkpoint: (bool) See `update_local_db_caches`. The contact
+            checkpoint is removed once everything has been combined.
         :return: None
         """
         # Get all updated lists and contacts / HARVEST
-        self.update_local_db_caches()
+        self.update_local_db_caches(
+            resume=resume, snapshot=snapshot, checkpoint=checkpoint
+        )
 
         # Update databases / COMBINE
         for cclist in self.cclists:
             self.combine_cclist_json_into_db(cclist)
-        self.combine_contacts_into_db()
+        for _ in self.combine_contacts_into_db():
+            pass
+
+    @staticmethod
+    def iter_highrise_contact_stash(jfname="yaya.jsonl"):
+        """Reads HighRise contacts that have been converted to json, one at a
+        time
+
+        The stash is JSON Lines, one person per line, as written by
+        `HighRiseDataMiner.write_stash`; only one person is in memory at a
+        time. A stash in the old format (a single JSON object of every
+        person) is read whole, then yielded the same way.
+
+        :param jfname: (str) Filename of HighRise stash
+        :return: Generator of (str, dict): name of the exported file the
+            person was mined from, and what they mined to
+        """
+        with open(jfname, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if set(record) != {'file', 'data'}:
+                    # The old format: file name -> data
+                    yield from record.items()
+                    continue
+                yield record['file'], record['data']
 
-    def read_from_highrise_contact_stash(self, jfname="yaya.json"):
+    def read_from_highrise_contact_stash(self, jfname="yaya.jsonl"):
         """Reads HighRise contacts that have been converted to json
 
+        Holds every person in memory; prefer `iter_highrise_contact_stash`.
+
         :param jfname: (str) Filename of HighRise stash
         :return: Populates `self.highrise_contacts_json` with HighRise contacts
         """
-        with open(jfname, 'r') as f:
-            self.highrise_contacts_json = json.loads(f.read())
+        self.highrise_contacts_json = dict(
+            self.iter_highrise_contact_stash(jfname)
+        )
+
+    def import_highrise_stash(self, jfname="yaya.jsonl",
+                              batch_size=DEFAULT_IMPORT_BATCH_SIZE):
+        """Imports HighRise contacts into the local DB
+
+        Each person is matched to an existing contact by email or phone and
+        their notes, tags and background attached to it, or made into a new
+        contact; see `highrise_import.HighRiseImporter`. The stash is read
+        one person at a time, and written a batch at a time.
+
+        :param jfname: (str) Filename of HighRise stash
+        :param batch_size: (int) People per batch (and transaction)
+        :return: (int) Number of people read from the stash. How many were
+            matched, inserted and skipped is in `self.counts`.
+        """
+        begin_time = datetime.datetime.now()
+        self.counts = Counter()
+        self.transaction_policy.reset()
+        importer = HighRiseImporter(self, batch_size)
+        imported = sum(importer.import_people(
+            self.iter_highrise_contact_stash(jfname)
+        ))
+        total_time = (datetime.datetime.now() - begin_time).total_seconds()
+        self.logger.info(
+            f"Imported '{imported}' HighRise people in {total_time // 60} "
+            f"minutes and {total_time % 60} seconds. Outcomes: "
+            f"{dict(self.counts)}. "
+            f"Commit latency: {self.transaction_policy.summary()}"
+        )
+        return imported
+
+    def _read_snapshot_objects(self, jfname):
+        return self._collect_records(read_snapshot(jfname, self.fernet))
+
+    @staticmethod
+    def _collect_records(records):
+        # Collects snapshot records into contacts, lists and remediation
+        # entries (keyed as in `to_remidate`)
+        objects = {
+            'contacts': [],
+            'cclists': [],
+            'to_remidate': {'bad_phone_nums': dict(), 'bad_m2m': dict()}
+        }
+        for kind, obj in records:
+            if kind == CONTACT:
+                objects['contacts'].append(obj)
+            elif kind == CCLIST:
+                objects['cclists'].append(obj)
+            else:
+                objects['to_remidate'][kind][obj['id']] = obj['entries']
+        return objects
 
     def read_constantcontact_objects_from_json(
             self,
             jfname=os.path.join(HERE, "yaya_cc.json"),
             override_contacts=True,
-            override_lists=True
+            override_lists=True,
+            merge_policy=KEEP_LOCAL
     ):
         """Read previously collected ConstantContact objects from JSON file
 
-        :param jfname: (str) Path to json file with ConstantContact data
+        :param jfname: (str) Path to json file with ConstantContact data, or
+            to a JSON Lines snapshot (see `dump_snapshot`), which is
+            decrypted with `self.fernet` if it's encrypted
         :param override_contacts: (bool) Replace `self.contact` with contacts
             in json file
         :param override_lists: (bool) Replace `self.cclist` with lists from
             json file
+        :param merge_policy: (str) When not overriding, which of two objects
+            with the same id is kept; see `snapshots.merge_objects`
+        :return: None
+        """
+        data = self._read_snapshot_objects(jfname)
+        if hasattr(self, 'contacts'):
+            if override_contacts:
+                self.logger.debug("Overriding contacts...")
+                self.contacts = data['contacts']
+            else:
+                self.logger.info(f"'{len(self.contacts)}' already found, "
+                                 f"not overriding. Merging with contacts.")
+                self._update_ccobj("contacts", data['contacts'], merge_policy)
+        if hasattr(self, 'cclists'):
+            if override_lists:
+                self.logger.debug("Overriding lists...")
+                self.cclists = data['cclists']
+            else:
+                self.logger.info(f"'{len(self.cclists)}' already found, "
+                                 f"not overriding. Merging with lists.")
+                self._update_ccobj("cclists", data['cclists'], merge_policy)
+        self.bad_phone_nums = data['to_remidate']['bad_phone_nums']
+        self.bad_m2m = data['to_remidate']['bad_m2m']
+
+    def _update_ccobj(self, field, new_ccobj, policy=KEEP_LOCAL):
+        """Merges ConstantContact objects into `self.<field>` by id
+
+        :param field: (str) 'contacts' or 'cclists'
+        :param new_ccobj: (list of dict) Objects to merge in
+        :param policy: (str) See `snapshots.merge_objects`
         :return: None
         """
-        with open(jfname, 'r') as jf:
-            data = json.loads(jf.read())
-            if hasattr(self, 'contacts'):
-                if override_contacts:
-                    self.logger.debug("Overriding contacts...")
-                    self.contacts = data['contacts']
-                else:
-                    self.logger.info(f"'{len(self.contacts)}' already found, "
-                                     f"not overriding. Merging with contacts.")
-                    self._update_ccobj("contacts", data['contacts'])
-            if hasattr(self, 'cclists'):
-                if override_lists:
-                    self.logger.debug("Overriding lists...")
-                    self.cclists = data['cclists']
-                else:
-                    self.logger.info(f"'{len(self.cclists)}' already found, "
-                                     f"not overriding. Merging with lists.")
-                    self._update_ccobj("cclists", data['cclists'])
-            remed = data.get('to_remidate')
-            if remed:
-                self.bad_phone_nums = remed.get('bad_phone_nums')
-                self.bad_m2m = remed.get('bad_m2m')
-
-    def _prep_objects_to_dump(self, data):
-        add_contacts = []
-        add_lists = []
-        fields = [
-            (add_contacts, 'contacts'),
-            (add_lists, 'cclists'),
-        ]
-
-        # Check if record exists in contacts and cclists
-        # If so, don't re-add it
-        for dumps, field in fields:
-            for self_field in getattr(self, field):
-                if any([x['id'] == self_field.get('id')\
-                        for x in data.get(field)]):
-                    continue
-                else:
-                    dumps.append(self_field)
-        return (add_contacts, add_lists)
-
-    def _update_ccobj(self, field, new_ccobj):
-        obj_ids = [obj.get('id') for obj in getattr(self, field)]
         if hasattr(self, field):
-            # Grab that field in the ccobj
-            ccobj = getattr(self, field) #<- updates (adds to) this field
-            for obj in new_ccobj:
-                if obj.get('id') in obj_ids:
-                    continue
-                else:
-                    ccobj.append(obj)
+            setattr(self, field, merge_objects(
+                getattr(self, field), new_ccobj, policy
+            ))
 
     def dump_constantcontact_objects_from_json(
             self,
             jfname=os.path.join(HERE, "yaya_cc.json"),
             override_json=True,
-            encrypt=True
+            encrypt=True,
+            merge_policy=KEEP_LOCAL
     ):
         """Dump ConstantContact objects into a JSON formatted file
 
         :param jfname: (str) Path to JSON file
-        :param override_json: (bool) If file exists at `jfname`, delete?
+        :param override_json: (bool) If file exists at `jfname`, delete? If
+            not, its objects are merged into `self.contacts` and
+            `self.cclists` first
+        :param encrypt: (bool) Unused: this format is always plaintext. Use
+            `dump_snapshot` for encrypted snapshots.
+        :param merge_policy: (str) When merging, which of two objects with
+            the same id is kept; see `snapshots.merge_objects`
         :return: None, but there should be data in the file at `jfname`
         """
-        mode = 'w' if not override_json else 'w+'
-        data = dict()
-        with open(jfname, mode) as jf:
-            if mode == 'w+': # Read and write
+        if not override_json and os.path.exists(jfname):
+            if os.stat(jfname).st_size == 0:
+                msg = f"File '{jfname}' is 0 bytes...writing to it"
+                if logging.INFO >= self.logger.level:
+                    print(msg)
+                self.logger.info(msg)
+            else:
+                self.logger.debug("Preparing to dump objects...")
                 try:
-                    self.logger.debug("Preparing to dump objects...")
-                    data = json.load(jf)
-                    contacts, cclists = self._prep_objects_to_dump(data)
-                except json.JSONDecodeError as jde:
-                    fileinfo = os.stat(jfname)
-                    if fileinfo.st_size == 0:
-                        msg = f"File '{jfname}' is 0 bytes...writing to it"
-                        if logging.INFO >= self.logger.level:
-                            print(msg)
-                        self.logger.info(msg)
-                    else:
-                        self.logger.exception(
-                            f"Could not read JSON file {jfname}. "
-                            f"No objects dumped"
-                        )
-                        raise jde
-                    contacts, cclists = (dict(), dict())
-                self._update_ccobj('contacts', contacts)
-                self._update_ccobj('cclists', cclists)
-            data = {
-                'contacts': self.contacts,
-                'cclists': self.cclists,
-                'to_remidate': {
-                    'bad_phone_numbers': dict(),
-                    'bad_m2m': dict()
-                }
+                    data = self._read_snapshot_objects(jfname)
+                except json.JSONDecodeError:
+                    self.logger.exception(
+                        f"Could not read JSON file {jfname}. "
+                        f"No objects dumped"
+                    )
+                    raise
+                self._update_ccobj('contacts', data['contacts'], merge_policy)
+                self._update_ccobj('cclists', data['cclists'], merge_policy)
+        data = {
+            'contacts': self.contacts,
+            'cclists': self.cclists,
+            'to_remidate': {
+                'bad_phone_nums': getattr(self, 'bad_phone_nums', dict()),
+                'bad_m2m': getattr(self, 'bad_m2m', dict())
             }
-            if hasattr(self, 'bad_phone_numbers'):
-                data['to_remidate']['bad_phone_nums'] = self.bad_phone_nums
-            if hasattr(self, 'bad_m2m'):
-                data['to_remidate']['bad_m2m'] = self.bad_m2m
+        }
+        # Write beside the snapshot and swap it in, so a failed dump never
+        # leaves a truncated file behind
+        tmpname = f"{jfname}.tmp"
+        with open(tmpname, 'w') as jf:
             json.dump(data, jf)
-            self.logger.debug("Objects dumped successfully")
+        os.replace(tmpname, jfname)
+        self.logger.debug("Objects dumped successfully")
+
+    def _snapshot_fernet(self, encrypt):
+        if encrypt and self.fernet is None:
+            self.logger.warning(
+                "No SNAPSHOT_KEY in secret_settings; writing the snapshot "
+                "unencrypted"
+            )
+        return self.fernet if encrypt else None
+
+    def dump_snapshot(self, jfname=os.path.join(HERE, "yaya_cc.jsonl.gz"),
+                      encrypt=True):
+        """Dumps lists, contacts and remediation entries to a JSON Lines
+        snapshot (see `snapshots.iter_write_snapshot`)
+
+        :param jfname: (str) Path of the snapshot
+        :param encrypt: (bool) Encrypt the snapshot, a chunk at a time, with
+            `self.fernet`. Without a key it is written unencrypted, with a
+            warning.
+        :return: (int) Number of records written
+        """
+        written = write_snapshot(jfname, iter_records(
+            self.contacts, self.cclists, self.bad_phone_nums, self.bad_m2m
+        ), self._snapshot_fernet(encrypt))
+        self.logger.debug(f"Dumped '{written}' records to '{jfname}'")
+        return written
+
+    def harvest_contacts_to_snapshot(
+            self, jfname=os.path.join(HERE, "yaya_cc.jsonl.gz"),
+            status='ALL', limit='500', modified_since=None,
+            api_uri='/v2/contacts', resume=False, encrypt=True,
+            checkpoint=False
+    ):
+        """Harvests contacts straight into a JSON Lines snapshot
+
+        Each page is written out as it arrives, after `self.cclists`, so
+        unlike `harvest_contacts` the contacts are *not* kept in
+        `self.contacts`. Pages can be checkpointed as in `harvest_contacts`;
+        the checkpoint is removed when the snapshot is combined (see
+        `combine_snapshot_into_db`).
+
+        :param jfname: (str) Path of the snapshot
+        :param status: (str) See `harvest_contacts`
+        :param limit: (str / int) See `harvest_contacts`
+        :param modified_since: (datetime) See `harvest_contacts`
+        :param api_uri: (str) The API endpoint for ConstantContact contacts
+        :param resume: (bool) See `harvest_contacts`
+        :param encrypt: (bool) See `dump_snapshot`
+        :param checkpoint: (bool) See `harvest_contacts`
+        :return: (int) Number of records written
+        """
+        params = self._contact_harvest_params(status, limit, modified_since)
+        cp = self._harvest_checkpoint(api_uri, params, checkpoint or resume)
+        contacts = (
+            contact
+            for page in self.iter_contact_pages(params, api_uri, cp, resume)
+            for contact in page
+        )
+        written = write_snapshot(
+            jfname, iter_records(contacts, self.cclists),
+            self._snapshot_fernet(encrypt)
+        )
+        self.logger.info(
+            f"Harvested '{written - len(self.cclists)}' contacts into "
+            f"'{jfname}'; API client stats: {self.client.stats.summary()}"
+        )
+        return written
+
+    def snapshot_chain(self, manifest=SNAPSHOT_MANIFEST):
+        """Returns the `snapshots.SnapshotChain` at `manifest`, encrypted with
+        `self.fernet` if there is a key"""
+        return SnapshotChain(manifest, self.fernet)
+
+    def read_snapshot_chain(self, manifest=SNAPSHOT_MANIFEST):
+        """Reads the latest state of a snapshot chain into `self.contacts`,
+        `self.cclists`, `self.bad_phone_nums` and `self.bad_m2m`
+
+        :param manifest: (str) Path of the chain's manifest
+        :return: None
+        """
+        data = self._collect_records(self.snapshot_chain(manifest).read())
+        self.contacts = data['contacts']
+        self.cclists = data['cclists']
+        self.bad_phone_nums = data['to_remidate']['bad_phone_nums']
+        self.bad_m2m = data['to_remidate']['bad_m2m']
+
+    def dump_snapshot_store(self,
+                            jfname=os.path.join(HERE, "yaya_cc.store"),
+                            encrypt=True):
+        """Dumps lists, contacts and remediation entries to a
+        `snapshot_store.SnapshotStore`, for `load_contacts_from_store`
+
+        :param jfname: (str) Path of the store's data file; the index is
+            written beside it
+        :param encrypt: (bool) See `dump_snapshot`; here each record is
+            encrypted on its own
+        :return: (int) Number of records written
+        """
+        written = SnapshotStore.write(jfname, iter_records(
+            self.contacts, self.cclists, self.bad_phone_nums, self.bad_m2m
+        ), self._snapshot_fernet(encrypt))
+        self.logger.debug(f"Stored '{written}' records in '{jfname}'")
+        return written
+
+    def load_contacts_from_store(self, cc_ids,
+                                 jfname=os.path.join(HERE, "yaya_cc.store"),
+                                 override_contacts=True):
+        """Loads some contacts, and the lists they belong to, from a store
+
+        Only the requested contacts are read and deserialized, so this is
+        cheap however big the store is.
+
+        :param cc_ids: (iterable of str / int) ConstantContact ids of the
+            contacts to load
+        :param jfname: (str) Path of the store's data file
+        :param override_contacts: (bool) Replace `self.contacts` and
+            `self.cclists`, rather than merging into them (keeping the local
+            copies)
+        :return: (list of dict) The contacts found
+        """
+        cc_ids = list(cc_ids)
+        with SnapshotStore(jfname, self.fernet) as store:
+            contacts = store.get_many(cc_ids)
+            list_ids = {
+                xcclist.get('id')
+                for contact in contacts
+                for xcclist in contact.get('lists') or ()
+            }
+            cclists = store.get_many(sorted(list_ids), kind=CCLIST)
+        if len(contacts) < len(cc_ids):
+            self.logger.warning(
+                f"'{len(cc_ids) - len(contacts)}' of the requested contacts "
+                f"are not in '{jfname}'"
+            )
+        if override_contacts:
+            self.contacts = contacts
+            self.cclists = cclists
+        else:
+            self._update_ccobj('contacts', contacts)
+            self._update_ccobj('cclists', cclists)
+        return contacts
+
+    def recombine_contacts_from_store(
+            self, cc_ids, jfname=os.path.join(HERE, "yaya_cc.store"),
+            **kwargs
+    ):
+        """Combines some contacts from a store into the local DB again
+
+        :param cc_ids: (iterable of str / int) See `load_contacts_from_store`
+        :param jfname: (str) Path of the store's data file
+        :param kwargs: Passed to `combine_contacts_into_db`
+        :return: None, but should update local DB
+        """
+        self.load_contacts_from_store(cc_ids, jfname)
+        yield from self.combine_contacts_into_db(**kwargs)
 
     @classmethod
     def get_init_values_for_model(_, cls):
@@ -419,44 +950,25 @@ class DataCombine():
         return [f.name for f in cls._meta.get_fields() if not f.is_relation
                 and f.name != 'id']
 
-    @staticmethod
-    def convert_choice_to_field(choice):
-        """Makes choice a field by changing the text
-
-        :param choice: Entry to make a field
-        :return: (str) `choice` made uppercase and replacing spaces with '_'
-        """
-        return choice.upper().replace(' ', '_')
+    convert_choice_to_field = staticmethod(convert_choice_to_field)
 
     @classmethod
-    def _setup_model_object(_, cls, attrs):
-        kwargs = {}
-        for fld in cls._meta.get_fields():
-            if fld.name == 'id' or fld.many_to_many:
-                continue
-            elif fld.name.startswith("cc_"):
-                if fld.name == "cc_id":
-                    # If object already exists in DB, return None
-                    if cls.objects.filter(cc_id=attrs[fld.name[3:]]):
-                        return
-                kwargs[fld.name] = attrs[fld.name[3:]]
-            elif hasattr(fld, 'choices') and fld.choices:
-                # Map uppercase field names to DB 2-letter codes
-                chmap = {
-                    DataCombine.convert_choice_to_field(ch[1]): ch[0]\
-                    for ch in fld.choices
-                }
-                try:
-                    kwargs[fld.name] = chmap[attrs[fld.name]]
-                except KeyError:
-                    kwargs[fld.name] = None
-            else:
-                try:
-                    kwargs[fld.name] = attrs[fld.name]
-                except KeyError:
-                    kwargs[fld.name] = None
-        # Return a new model object
-        return cls(**kwargs)
+    def _setup_model_object(_, cls, attrs, index=None):
+        # If object already exists in DB, return None
+        if index is not None:
+            if (cls, attrs['id']) in index:
+                return
+        elif cls.objects.filter(cc_id=attrs['id']):
+            return
+        return DataCombine._build_model_object(cls, attrs)
+
+    @staticmethod
+    def _build_model_object(cls, attrs):
+        # Fields are mapped by the plan compiled for `cls` (see `mappers`)
+        mapper = MAPPERS.get(cls)
+        if mapper is None:
+            mapper = MAPPERS[cls] = ModelMapper(cls)
+        return mapper.build(attrs)
 
     @transaction.atomic
     def combine_cclist_json_into_db(self, cclist_json):
@@ -495,44 +1007,29 @@ class DataCombine():
                     f", {ccl.cc_id} and {l.cc_id}."
                 )
         ccl.save()
+        if self.cc_index is not None:
+            self.cc_index.add(ConstantContactList, ccl.cc_id, ccl.pk)
         return None
 
-    @transaction.atomic
-    def _initial_contact_setup_from_json(self, contact):
-        try:
-            cf = DataCombine.get_init_values_for_model(Contact)
-            fields = dict()
-            # Set up fields for Contact
-            for x in cf:
-                try:
-                    if not x.startswith('cc_'):
-                        fields[x] = contact.get(x)
-                    else:
-                        fields[x] = contact.get(x[3:])
-                except KeyError as ke:
-                    key = ke.args[0]
-                    if Contact._meta.get_field(key).null:
-                        fields[x] = ""
-                    else:
-                        raise ke
-            # Initialize new Contact object
-            newContact = Contact(**fields)
-            newContact.status = Contact.convert_status_str_to_code(
-                newContact.status
-            )
-            newContact.save()
-            return newContact
-        except KeyError as ke:
-            key = ke.args[0]
-            self.logger.error(
-                f"Encountered a KeyError on setting "
-                f"'_initial_contact_setup_from_json', there is no key "
-                f"'{key}' in contact: {contact}"
+    def _initial_contact_setup_from_json(self, contact, fingerprint=None):
+        newContact = self._contact_from_json(contact, fingerprint)
+        newContact.save()
+        if self.cc_index is not None:
+            self.cc_index.add(
+                Contact, newContact.cc_id, newContact.pk,
+                parser.parse(contact.get("modified_date")),
+                newContact.fingerprint
             )
-            raise
+        return newContact
 
-    @transaction.atomic
-    def combine_phone_number_into_db(self, phone_num, newContact, phfld):
+    def _contact_from_json(self, contact, fingerprint=None):
+        newContact = CONTACT_MAPPER.build(contact)
+        newContact.fingerprint = fingerprint\
+            or Contact.make_fingerprint(contact)
+        return newContact
+
+    def combine_phone_number_into_db(self, phone_num, newContact, phfld,
+                                     replace=False):
         """Initialize a `models.Phone` from a sting and save to local DB
 
         :param phone_num: (str) A sting representing a phone number
@@ -541,49 +1038,59 @@ class DataCombine():
         :param phfld: (`django.db.models.fields.related.ManyToManyField`) The
             field (home_phone, cell_phone, work_phone, or fax) that the
             `phone_num` string will be added to in `newContact`
+        :param replace: (bool) Drop whatever else `phfld` holds, as when
+            updating a contact; an empty or bad `phone_num` empties it
         :return: None, but a new Phone object should be added to the local DB
         """
-        if not phone_num:
-            return
-        ph = Phone()
+        phone_pks = []
         try:
-            ph.create_from_str(phone_num)
-        except FieldError:
-            raise FieldError(phone_num, newContact, phfld)
+            if not phone_num:
+                return
+            ph = Phone()
+            try:
+                ph.create_from_str(phone_num)
+            except FieldError:
+                raise FieldError(phone_num, newContact, phfld)
 
-        if ph == None:
-            self.logger.info(f"phone_num='{phone_num}' produces None")
-            return
+            if ph == None:
+                self.logger.info(f"phone_num='{phone_num}' produces None")
+                return
 
-        ph_in_db = Phone.is_phone_in_db(ph)
-        phobj = getattr(newContact, phfld)
-        if ph_in_db:
-            self.logger.debug(
-                f"Phone number '{ph}' is already in database"
-            )
-            phobj.add(ph_in_db.first())
-        else:
-            ph.save()
-            phobj.add(ph)
+            # Looks up (or inserts) the phone through the process-wide cache
+            phone_pks.append(PHONE_CACHE.pks_for([ph.key])[ph.key])
+        finally:
+            if replace:
+                getattr(newContact, phfld).set(phone_pks)
+            elif phone_pks:
+                getattr(newContact, phfld).add(*phone_pks)
 
-    @transaction.atomic
-    def _combine_m2m_field_into_db(self, cls_obj, m2mattrs, newContact, m2m):
+    def _combine_m2m_field_into_db(self, cls_obj, m2mattrs, newContact, m2m,
+                                   update=False):
         m2mobj = DataCombine._setup_model_object(
-            cls_obj, m2mattrs
+            cls_obj, m2mattrs, index=self.cc_index
         )
-        if m2mobj:
-            try:
-                m2mobj.save()
-            except DataError as de:
-                too_long = "value too long for type character varying"
-                if de.args[0].__contains__(too_long):
-                    for key, val in m2mattrs.items():
-                        cf = cls_obj._meta.get_field(key)
-                        if not val or not cf.max_length:
-                            continue
-                        if len(val) > cf.max_length:
-                            de.args = (cls_obj, key, val)
-                            raise de
+        existing_pk = None
+        if m2mobj is None and update and self.cc_index is not None:
+            existing_pk = self.cc_index.pk(cls_obj, m2mattrs['id'])
+        if existing_pk is not None:
+            # Still the updated contact's, so bring it up to date and keep it
+            m2mobj = DataCombine._build_model_object(cls_obj, m2mattrs)
+            m2mobj.pk = existing_pk
+            m2mobj.save()
+            getattr(newContact, m2m).add(m2mobj)
+        elif m2mobj:
+            # Checked here rather than left to the DB, as a failed INSERT
+            # would abort the contact's whole savepoint
+            if BulkCombiner._has_too_long_field(m2mobj):
+                for key, val in m2mattrs.items():
+                    cf = cls_obj._meta.get_field(key)
+                    if not val or not cf.max_length:
+                        continue
+                    if len(val) > cf.max_length:
+                        raise DataError(cls_obj, key, val)
+            m2mobj.save()
+            if self.cc_index is not None:
+                self.cc_index.add(cls_obj, m2mobj.cc_id, m2mobj.pk)
             ncontact_m2mfield = getattr(newContact, m2m)
             ncontact_m2mfield.add(m2mobj)
         else:
@@ -593,19 +1100,27 @@ class DataCombine():
             )
         return newContact
 
-    @transaction.atomic
-    def _combine_notes_into_db(self, notes, newContact):
+    def _combine_notes_into_db(self, notes, newContact, update=False):
         for note in notes:
-            newNote = DataCombine._setup_model_object(Note, note)
-            if newNote:
+            newNote = DataCombine._setup_model_object(
+                Note, note, index=self.cc_index
+            )
+            if newNote is None and update and self.cc_index is not None:
+                note_pk = self.cc_index.pk(Note, note['id'])
+                if note_pk is not None:
+                    newNote = DataCombine._build_model_object(Note, note)
+                    newNote.pk = note_pk
+                    newNote.contact = newContact
+                    newNote.save()
+            elif newNote:
                 newNote.contact = newContact
                 newNote.save()
+                if self.cc_index is not None:
+                    self.cc_index.add(Note, newNote.cc_id, newNote.pk)
 
-    @transaction.atomic
     def _save_ustat_object(self, ustat_object):
         ustat_object.save()
 
-    @transaction.atomic
     def save_for_remediation(self, contact, json_entry):
         """Make a new `models.RequiringRemediation` object and save to local DB
 
@@ -617,30 +1132,274 @@ class DataCombine():
         rr.save()
 
     def _save_ustat_objects(self, contact, newContact, updating):
+        # List pk -> status; a list named twice keeps its last status
+        statuses = dict()
         for xcclist in contact.get('lists'):
-            listobj = ConstantContactList.objects.filter(
-                cc_id=xcclist['id']
-            )
             liststat = "HI" if xcclist.get('status').startswith('H') \
                 else "AC"
-            ustat_obj = UserStatusOnCCList(
-                cclist=listobj.first(), user=newContact, status=liststat
+            if self.cc_index is not None:
+                cclist_pk = self.cc_index.pk(
+                    ConstantContactList, xcclist['id']
+                )
+            else:
+                cclist_pk = ConstantContactList.objects.filter(
+                    cc_id=xcclist['id']
+                ).values_list('pk', flat=True).first()
+            statuses[cclist_pk] = liststat
+
+        if updating:
+            # Keep one row per list still named, with its status brought up
+            # to date, and drop the rest
+            stale = []
+            for ustat in UserStatusOnCCList.objects.filter(
+                    user=newContact).order_by('pk'):
+                liststat = statuses.pop(ustat.cclist_id, None)
+                if liststat is None:
+                    stale.append(ustat.pk)
+                elif ustat.status != liststat:
+                    ustat.status = liststat
+                    self._save_ustat_object(ustat)
+            if stale:
+                UserStatusOnCCList.objects.filter(pk__in=stale).delete()
+
+        for cclist_pk, liststat in statuses.items():
+            self._save_ustat_object(UserStatusOnCCList(
+                cclist_id=cclist_pk, user=newContact, status=liststat
+            ))
+
+    def load_cc_index(self, full=False):
+        """Builds `self.cc_index`, used by combining to find existing objects
+
+        :param full: (bool) If True, index every contact, address, email
+            address, note and list in the local DB. Otherwise only the ids
+            found in `self.contacts` and `self.cclists` are looked up, one
+            `IN` query per chunk of ids, which is far cheaper for incremental
+            harvests against a large local DB.
+        :return: (`cc_index.CCIdIndex`) The new index
+        """
+        if full:
+            self.cc_index = CCIdIndex().load()
+        else:
+            self.cc_index = CCIdIndex().load_for_contacts(
+                self.contacts, self.cclists
             )
-            if updating:
-                con = newContact.cc_lists.filter(cc_id=xcclist['id']).first()
-                if con.status != liststat:
-                    con.status = liststat
-                    con.update()
-                return
-            self._save_ustat_object(ustat_obj)
+        self.logger.debug(f"Indexed '{len(self.cc_index)}' local objects")
+        return self.cc_index
+
+    def _iter_combine(self, contacts, batch_size=None, combiner=BulkCombiner):
+        # Yields the number of contacts finished at each step; expects
+        # `self.cc_index` to cover `contacts`
+        if batch_size:
+            combiner = combiner(
+                self, batch_size=batch_size, index=self.cc_index
+            )
+            yield from combiner.combine(contacts)
+        else:
+            policy = self.transaction_policy
+            for group in chunked(enumerate(contacts),
+                                 policy.contacts_per_transaction):
+                counts = Counter(self.counts)
+                self.cc_index.begin()
+                try:
+                    with policy.transaction():
+                        for c_i, contact in group:
+                            self._combine_contact_safely(contact, c_i)
+                except Exception:
+                    self.cc_index.rollback()
+                    self.counts.clear()
+                    self.counts.update(counts)
+                    self.counts['errored'] += len(group)
+                    self.logger.exception(
+                        f"Committing a group of {len(group)} contacts "
+                        "failed...skipping them"
+                    )
+                except BaseException:
+                    self.cc_index.rollback()
+                    raise
+                else:
+                    self.cc_index.commit()
+                yield len(group)
 
-    def _continue_combine(self, count):
-        # Update progress bar
-        updt(len(self.contacts), count)
-        return count+1
+    @staticmethod
+    def _contact_unchanged(contact_in_db, contact, fingerprint):
+        """Whether a contact already in the local DB can be skipped
+
+        :param contact_in_db: (tuple) Its `cc_index.CCIdIndex.contact` entry
+        :param contact: (dict) ConstantContact contact JSON
+        :param fingerprint: (str) `models.Contact.make_fingerprint(contact)`
+        :return: (bool) True if nothing about the contact changed
+        """
+        _, modified_date, stored = contact_in_db
+        if stored is not None:
+            return stored == fingerprint
+        # Combined before fingerprints were stored; the date is all there is
+        return modified_date == parser.parse(contact.get("modified_date"))
+
+    def backfill_fingerprints(self, fingerprints, index=None):
+        """Stores the fingerprints of unchanged contacts which have none
+
+        Contacts combined before `models.Contact.fingerprint` existed get one
+        the first time they are skipped, in a single query per call, so they
+        are compared by fingerprint from then on.
+
+        :param fingerprints: (dict) Contact cc_id -> (pk, fingerprint)
+        :param index: (`cc_index.CCIdIndex`, default: `self.cc_index`) Index
+            to record the fingerprints in
+        :return: None
+        """
+        if not fingerprints:
+            return
+        Contact.objects.filter(
+            pk__in=[pk for pk, _ in fingerprints.values()]
+        ).update(fingerprint=Case(
+            *[When(pk=pk, then=Value(fp))
+              for pk, fp in fingerprints.values()],
+            output_field=CharField()
+        ))
+        index = index if index is not None else self.cc_index
+        if index is not None:
+            for cc_id, (pk, fp) in fingerprints.items():
+                _, modified_date, _ = index.contact(cc_id)
+                index.add(Contact, cc_id, pk, modified_date, fp)
+
+    def _combine_contact(self, contact):
+        newContact = None
+        bad_m2m_entry = None
+        bad_phone_entry = None
+        updatingContact = False
+
+        # Check if Contact is already in DB (see `load_cc_index`), and act
+        # appropriately
+        fingerprint = Contact.make_fingerprint(contact)
+        contact_in_db = self.cc_index.contact(contact.get("id"))
+        if contact_in_db:
+            pk, _, stored = contact_in_db
+            if self._contact_unchanged(contact_in_db, contact, fingerprint):
+                if stored is None:
+                    self.backfill_fingerprints(
+                        {contact.get("id"): (pk, fingerprint)}
+                    )
+                return 'skipped'
+            else:
+                # Overwrite the row with what ConstantContact sent now. It is
+                # written once, by the save below; until then it stands in
+                # for the row as if loaded from the DB, so its m2m fields
+                # can be set
+                newContact = self._contact_from_json(contact, fingerprint)
+                newContact.pk = pk
+                newContact._state.adding = False
+                newContact._state.db = connection.alias
+                updatingContact = True
+                outcome = 'updated'
+        else:
+            newContact = self._initial_contact_setup_from_json(
+                contact, fingerprint
+            )
+            outcome = 'inserted'
+
+        # Setup and save connections from this contact to various lists
+        # (ie. `models.UserStatusOnCCList` objects)
+        self._save_ustat_objects(contact, newContact, updatingContact)
+
+        # Setup and combine phone numbers for contact
+        for phfld in PHONE_FIELDS:
+            try:
+                self.combine_phone_number_into_db(
+                    contact.get(phfld), newContact, phfld,
+                    replace=updatingContact
+                )
+            except FieldError as fe:
+                bad_phone_entry = {phfld:contact.get(phfld)}
+
+        # Setup and combine many to many fields for contact
+        for cls_obj, m2m in NON_PHONE_OR_CCLIST_M2M:
+            kept = []
+            for m2mattrs in contact.get(m2m):
+                try:
+                    newContact = self._combine_m2m_field_into_db(
+                        cls_obj, m2mattrs, newContact, m2m,
+                        update=updatingContact
+                    )
+                    kept.append(m2mattrs.get('id'))
+                except DataError:
+                    bad_m2m_entry = {newContact.cc_id: m2mattrs}
+            if updatingContact:
+                # Whatever the contact no longer lists goes
+                ncontact_m2mfield = getattr(newContact, m2m)
+                ncontact_m2mfield.remove(
+                    *ncontact_m2mfield.exclude(cc_id__in=kept)
+                )
+
+        # Set up and save notes about contact
+        self._combine_notes_into_db(
+            contact.get('notes'), newContact, update=updatingContact
+        )
+
+        # Save new contact to database
+        newContact.save(
+            update_fields=CONTACT_UPDATE_FIELDS if updatingContact else None
+        )
+        if updatingContact and self.cc_index is not None:
+            self.cc_index.add(
+                Contact, newContact.cc_id, newContact.pk,
+                parser.parse(contact.get("modified_date")), fingerprint
+            )
+
+        # Setup and save any entries which will need to be remediated
+        # by a human operator
+        if bad_m2m_entry:
+            self.bad_m2m.setdefault(newContact.cc_id, [])\
+                .append(bad_m2m_entry)
+            self.save_for_remediation(newContact, bad_m2m_entry)
+
+        if bad_phone_entry:
+            self.bad_phone_nums.setdefault(newContact.cc_id, [])\
+                .append(bad_phone_entry)
+            self.save_for_remediation(newContact, bad_phone_entry)
+
+        if bad_m2m_entry or bad_phone_entry:
+            self.counts['remediated'] += 1
+        return outcome
+
+    def _combine_contact_safely(self, contact, c_i=None):
+        c_i = contact.get('id') if c_i is None else c_i
+        outcome = 'errored'
+        # A contact that fails is rolled back alone, index entries and all
+        if self.cc_index is not None:
+            self.cc_index.begin()
+        try:
+            with self.transaction_policy.savepoint():
+                outcome = self._combine_contact(contact)
+        except DataError as de:
+            if len(de.args) == 3:
+                self.logger.error(
+                    "For class object "
+                    f"{de.args[0]}.{de.args[1]}={de.args[2]}. Is too long."
+                )
+            else:
+                self.logger.error(
+                    f"Data error on contact #{c_i} {de.args[0]}"
+                )
+        except FieldError:
+             self.logger.warning(
+                f"Field error on contact #{c_i} {contact}"
+                "...skipping..."
+            )
+        except Exception: # Keep calm, fuck this, and carry on
+            self.logger.exception(f"Exception on contact #{c_i}...skipping...")
+        finally:
+            if self.cc_index is not None:
+                if outcome == 'errored':
+                    self.cc_index.rollback()
+                else:
+                    self.cc_index.commit()
+            self.counts[outcome] += 1
 
     #@profile(print_stats=10, dump_stats=True, profile_filename="p3.out")
-    def combine_contacts_into_db(self, update_web_interface=False):
+    def combine_contacts_into_db(self, update_web_interface=False,
+                                 batch_size=None, full_index=False,
+                                 reporter=None, combiner=BulkCombiner,
+                                 workers=None):
         """Adds all contacts and lists available to `self` to local DB
 
         This is the core of the "combining" process. After lists and contacts
@@ -653,135 +1412,507 @@ class DataCombine():
             a dictonary object with 'processed' and 'total' keys, matched to
             the number of Contact iterations completed and the number of
             Contact objects yet to be added (there usually are far fewer lists
-            than contacts, so these aren't included)
-
-            If not true, calls `utils.updt` to fulfill the same purpose as
-            updating the web interface, but to the console instead
+            than contacts, so these aren't included), along with the rest of
+            `ProgressReporter.payload`. One is generated whenever `reporter`
+            says progress is due, and once more at the end.
+
+            If not true, `progress.ConsoleSink` calls `utils.updt` to fulfill
+            the same purpose as updating the web interface, but to the
+            console instead
+        :param batch_size: (int, default: None) If given, contacts are combined
+            `batch_size` at a time, with one `bulk_create` per model and M2M
+            table for each batch (see `bulk_combine.BulkCombiner`). Progress is
+            then advanced once per batch. If None, each contact is saved
+            one at a time.
+        :param full_index: (bool) Passed to `load_cc_index` as `full`; the
+            index is built once, before any list or contact is combined
+        :param reporter: (`progress.ProgressReporter`) Decides how often
+            progress is reported (at most once a second by default) and
+            computes the rate, ETA and per-stage counts (`self.counts`) sent
+            with it; its `total` and `counts` are set here
+        :param combiner: (class) `BulkCombiner` or a subclass, used when
+            `batch_size` is given
+        :param workers: (int) If more than 1, contacts are split into this
+            many shards by a hash of their id (see `shard_contacts`) and each
+            shard is combined in its own process, with its own DB connection.
+            Lists are combined first, here. Their remediation entries and
+            counts are merged into `self`'s, and progress is reported as the
+            workers make it. Must not be called inside a transaction.
         :return: None, but should update local DB
         """
         begin_time = datetime.datetime.now()
-        processed = 0
 
         if not hasattr(self, 'contacts'):
             raise AttributeError("No contacts found")
         elif not hasattr(self, 'cclists'):
             raise AttributeError("No constant contact list found")
 
-        # These are all the UserStatusOnCCList objects which
-        # Need to be saved when the user has been entered into the database
-        ustat_objects = []
+        self.counts = Counter()
+        self.transaction_policy.reset()
+        if reporter is None:
+            reporter = ProgressReporter(
+                sink=None if update_web_interface else ConsoleSink()
+            )
+        reporter.total = len(self.contacts)
+        reporter.counts = self.counts
+
+        self.load_cc_index(full=full_index)
         for cclist in self.cclists:
             self.combine_cclist_json_into_db(cclist)
-        for c_i, contact in enumerate(self.contacts):
-            try:
-                newContact = None
-                bad_m2m_entry = None
-                bad_phone_entry = None
-                updatingContact = False
-
-                # Check if Contact is already in DB, and act appropriately
-                contact_in_db = Contact.objects.filter(cc_id=contact.get("id"))
-                if contact_in_db:
-                    contact_in_db = contact_in_db.first()
-                    contact_date = parser.parse(contact.get("modified_date"))
-                    if contact_in_db.cc_modified_date == contact_date:
-                        continue
-                    else:
-                        newContact = contact_in_db
-                        del contact_in_db
-                else:
-                    newContact = self._initial_contact_setup_from_json(contact)
-
-                non_phone_or_cclist_m2m = [
-                    (Address, "addresses"),
-                    (EmailAddress, "email_addresses"),
-                ]
-
-                # Setup and save connections from this contact to various lists
-                # (ie. `models.UserStatusOnCCList` objects)
-                self._save_ustat_objects(contact, newContact, updatingContact)
-
-                # Setup and combine phone numbers for contact
-                phone_fields = [
-                    'home_phone',
-                    'work_phone',
-                    'cell_phone',
-                    'fax'
-                ]
-                for phfld in phone_fields:
-                    try:
-                        self.combine_phone_number_into_db(
-                            contact.get(phfld), newContact, phfld
-                        )
-                    except FieldError as fe:
-                        bad_phone_entry = {phfld:contact.get(phfld)}
-
-                # Setup and combine many to many fields for contact
-                for cls_obj, m2m in non_phone_or_cclist_m2m:
-                    for m2mattrs in contact.get(m2m):
-                        try:
-                            newContact = self._combine_m2m_field_into_db(
-                                cls_obj, m2mattrs, newContact, m2m
-                            )
-                        except DataError:
-                            bad_m2m_entry = {newContact.cc_id: m2mattrs}
-
-                # Set up and save notes about contact
-                self._combine_notes_into_db(contact.get('notes'), newContact)
-
-                # Save new contact to database
-                newContact.save()
-
-                # Setup and save any entries which will need to be remediated
-                # by a human operator
-                if bad_m2m_entry:
-                    self.bad_m2m.setdefault(newContact.cc_id, [])\
-                        .append(bad_m2m_entry)
-                    self.save_for_remediation(newContact, bad_m2m_entry)
-
-                if bad_phone_entry:
-                    self.bad_phone_nums.setdefault(newContact.cc_id, [])\
-                        .append(bad_phone_entry)
-                    self.save_for_remediation(newContact, bad_phone_entry)
-
-            except KeyboardInterrupt:
-                self.logger.info("Interrupt signal received...quitting.")
-                return
-            except DataError as de:
-                if len(de.args) == 3:
-                    self.logger.error(
-                        "For class object "
-                        f"{de.args[0]}.{de.args[1]}={de.args[2]}. Is too long."
+        if workers and workers > 1:
+            combined = self._iter_combine_sharded(
+                workers, batch_size, full_index, combiner
+            )
+        else:
+            combined = self._iter_combine(self.contacts, batch_size, combiner)
+        try:
+            for done in combined:
+                # Update dem progress trackers
+                progress = reporter.advance(done)
+                if progress is not None and update_web_interface:
+                    yield progress
+        except KeyboardInterrupt:
+            self.logger.info("Interrupt signal received...quitting.")
+            return
+        self.clear_harvest_checkpoints()
+
+        # Note time taken to complete, for log
+        end_time = datetime.datetime.now()
+        total_time = (end_time - begin_time).total_seconds()
+        progress = reporter.report()
+        if update_web_interface:
+            yield progress
+        self.logger.info(
+            f"Combined time to process '{reporter.processed}' contacts: "
+            f"{total_time // 60} minutes and {total_time % 60} seconds. "
+            f"Outcomes: {dict(self.counts)}. "
+            f"Commit latency: {self.transaction_policy.summary()}"
+         )
+
+    @staticmethod
+    def shard_contacts(contacts, shards):
+        """Splits contacts into `shards` lists by a hash of their id
+
+        Every copy of a contact lands in the same shard, so no two shards
+        write the same contact.
+
+        :param contacts: (list of dict) ConstantContact contact JSON
+        :param shards: (int) Number of shards
+        :return: (list of list) The contacts of each shard, in their order
+        """
+        sharded = [[] for _ in range(shards)]
+        for contact in contacts:
+            key = str(contact.get('id')).encode('utf-8')
+            sharded[zlib.crc32(key) % shards].append(contact)
+        return sharded
+
+    def _merge_bad_entries(self, result):
+        for field in ('bad_phone_nums', 'bad_m2m'):
+            for cc_id, entries in result[field].items():
+                getattr(self, field).setdefault(cc_id, []).extend(entries)
+
+    def _iter_combine_sharded(self, workers, batch_size, full_index,
+                              combiner):
+        # Yields the number of contacts finished, as the workers report them
+        if connection.in_atomic_block:
+            raise CombineException(
+                "Workers can't see an uncommitted transaction; combine with "
+                "workers outside of one"
+            )
+        shards = [
+            shard for shard in self.shard_contacts(self.contacts, workers)
+            if shard
+        ]
+        done = [0] * len(shards)
+        shard_counts = [Counter() for _ in shards]
+
+        def merge_counts():
+            self.counts.clear()
+            for counts in shard_counts:
+                self.counts.update(counts)
+
+        # The workers are forked, and must not share this connection
+        connections.close_all()
+        with multiprocessing.Manager() as manager,\
+                ProcessPoolExecutor(max_workers=workers) as pool:
+            progress = manager.Queue()
+            futures = [
+                pool.submit(
+                    _combine_shard, n, shard, progress, batch_size,
+                    full_index, combiner, self.logger.level, self.logfile,
+                    self.transaction_policy.contacts_per_transaction
+                )
+                for n, shard in enumerate(shards)
+            ]
+            running = set(futures)
+            while running or not progress.empty():
+                try:
+                    n, processed, counts = progress.get(
+                        timeout=PIPELINE_POLL_SECONDS
                     )
+                except queue.Empty:
+                    running = {f for f in running if not f.done()}
+                    continue
+                shard_counts[n] = Counter(counts)
+                merge_counts()
+                newly_done = processed - done[n]
+                done[n] = processed
+                yield newly_done
+
+            for n, future in enumerate(futures):
+                try:
+                    result = future.result()
+                except Exception:
+                    self.logger.exception(
+                        f"Combining shard {n} of {len(shards)} failed"
+                    )
+                    shard_counts[n]['errored'] += len(shards[n]) - done[n]
                 else:
-                    self.logger.error(
-                        f"Data error on contact #{c_i} {de.args[0]}"
+                    shard_counts[n] = Counter(result['counts'])
+                    self._merge_bad_entries(result)
+                merge_counts()
+                remaining = len(shards[n]) - done[n]
+                if remaining:
+                    done[n] = len(shards[n])
+                    yield remaining
+
+    def _combine_snapshot_chunk(self, contacts, batch_size, reporter):
+        # A fresh index per chunk: everything before it has been committed,
+        # so the DB already knows about it
+        reporter.total += len(contacts)
+        self.cc_index = CCIdIndex().load_for_contacts(contacts)
+        progress = None
+        for done in self._iter_combine(contacts, batch_size):
+            progress = reporter.advance(done)
+        return progress
+
+    def combine_snapshot_into_db(
+            self, jfname=os.path.join(HERE, "yaya_cc.jsonl.gz"),
+            chunk_size=DEFAULT_SNAPSHOT_CHUNK_SIZE, batch_size=None,
+            update_web_interface=False, reporter=None
+    ):
+        """Combines a snapshot into the local DB while reading it
+
+        Lists are combined as they are read (they come first), then contacts
+        `chunk_size` at a time, so no more than one chunk of contacts is held
+        in memory, and neither `self.contacts` nor `self.cclists` is used.
+        Remediation entries in the snapshot are added to `self.bad_phone_nums`
+        and `self.bad_m2m`.
+
+        :param jfname: (str) Path of a JSON Lines snapshot (decrypted with
+            `self.fernet` if it's encrypted), or of a legacy JSON dump (which
+            is loaded whole)
+        :param chunk_size: (int) Contacts read before combining them
+        :param batch_size: (int) See `combine_contacts_into_db`
+        :param update_web_interface: (bool) If true, yields progress (see
+            `combine_contacts_into_db`) after each chunk; its 'total' is the
+            number of contacts read so far
+        :param reporter: (`progress.ProgressReporter`) See
+            `combine_contacts_into_db`
+        :return: None, but should update local DB
+        """
+        begin_time = datetime.datetime.now()
+        self.cc_index = CCIdIndex()
+        self.counts = Counter()
+        self.transaction_policy.reset()
+        if reporter is None:
+            reporter = ProgressReporter(
+                sink=None if update_web_interface else ConsoleSink()
+            )
+        reporter.total = 0
+        reporter.counts = self.counts
+
+        contacts = []
+        try:
+            for kind, obj in read_snapshot(jfname, self.fernet):
+                if kind == CCLIST:
+                    self.cc_index.load_for_contacts([], [obj])
+                    self.combine_cclist_json_into_db(obj)
+                elif kind == CONTACT:
+                    contacts.append(obj)
+                    if len(contacts) < chunk_size:
+                        continue
+                    progress = self._combine_snapshot_chunk(
+                        contacts, batch_size, reporter
                     )
-            except FieldError:
-                 self.logger.warning(
-                    f"Field error on contact #{c_i} {contact} for {phfld}"
-                    "...skipping..."
-                )
-            except: # Keep calm, fuck this, and carry on
-                self.logger.exception(f"Exception on contact #{c_i}...skipping...")
-            finally: # Update dem progress trackers
-                if update_web_interface:
-                    yield {'processed': processed, 'total': len(self.contacts)}
-                    processed += 1
+                    contacts = []
+                    if progress is not None and update_web_interface:
+                        yield progress
                 else:
-                    processed = self._continue_combine(processed)
+                    # Remediation kinds are named after their attributes
+                    getattr(self, kind)[obj['id']] = obj['entries']
+            if contacts:
+                self._combine_snapshot_chunk(contacts, batch_size, reporter)
+        except KeyboardInterrupt:
+            self.logger.info("Interrupt signal received...quitting.")
+            return
 
-        # Note time taken to complete, for log
-        end_time = datetime.datetime.now()
-        total_time = (end_time - begin_time).total_seconds()
+        self.clear_harvest_checkpoints()
+        total_time = (datetime.datetime.now() - begin_time).total_seconds()
+        progress = reporter.report()
         if update_web_interface:
-            yield {'processed': len(self.contacts), 'total': len(self.contacts)}
+            yield progress
+        self.logger.info(
+            f"Combined '{reporter.processed}' contacts from '{jfname}' in "
+            f"{total_time // 60} minutes and {total_time % 60} seconds. "
+            f"Outcomes: {dict(self.counts)}. "
+            f"Commit latency: {self.transaction_policy.summary()}"
+        )
+
+    def initial_load_contacts(self, update_web_interface=False,
+                              batch_size=DEFAULT_COPY_BATCH_SIZE,
+                              reporter=None):
+        """Loads `self.cclists` and `self.contacts` into an empty postgres DB
+
+        The first-run fast path: rather than the ORM, every contact, phone,
+        email, address, note, list membership and M2M link row is streamed
+        in with `COPY FROM STDIN` (see `copy_load.CopyLoader`). Otherwise it
+        behaves like `combine_contacts_into_db`, and ends by comparing what
+        was loaded with the harvested JSON (see `check_initial_load`); the
+        result is kept in `self.load_summary`.
+
+        :param update_web_interface: (bool) See `combine_contacts_into_db`
+        :param batch_size: (int) Contacts per `COPY` of each table
+        :param reporter: (`progress.ProgressReporter`) See
+            `combine_contacts_into_db`
+        :return: None, but should fill the local DB
+        """
+        if connection.vendor != 'postgresql':
+            raise CombineException(
+                f"Initial loads need postgres, not '{connection.vendor}'"
+            )
+        if Contact.objects.exists():
+            raise CombineException(
+                "Initial loads need a DB without contacts; combine instead"
+            )
+        yield from self.combine_contacts_into_db(
+            update_web_interface=update_web_interface, batch_size=batch_size,
+            full_index=True, reporter=reporter, combiner=CopyLoader
+        )
+        self.load_summary = self.check_initial_load()
+
+    def _expected_rows(self):
+        # What the harvested JSON should turn into, mirroring the checks the
+        # combiners make before writing anything
+        ids = {
+            model: set() for model in (Contact, Address, EmailAddress, Note)
+        }
+        phones = set()
+        memberships = set()
+        for contact in self.contacts:
+            ids[Contact].add(int(contact.get('id')))
+            for cls_obj, m2m in NON_PHONE_OR_CCLIST_M2M:
+                for m2mattrs in contact.get(m2m) or ():
+                    m2mobj = self._build_model_object(cls_obj, m2mattrs)
+                    if not BulkCombiner._has_too_long_field(m2mobj):
+                        ids[cls_obj].add(m2mattrs.get('id'))
+            for note in contact.get('notes') or ():
+                ids[Note].add(note.get('id'))
+            for xcclist in contact.get('lists') or ():
+                memberships.add((contact.get('id'), xcclist.get('id')))
+            for phfld in PHONE_FIELDS:
+                if not contact.get(phfld):
+                    continue
+                ph = Phone()
+                try:
+                    ph.create_from_str(contact.get(phfld))
+                except FieldError:
+                    continue
+                # Numbers that parse to nothing aren't stored as phones
+                if any(ph.key):
+                    phones.add(ph.key)
+        expected = {model: len(model_ids) for model, model_ids in ids.items()}
+        expected[Phone] = len(phones)
+        expected[UserStatusOnCCList] = len(memberships)
+        return expected
+
+    def check_initial_load(self):
+        """Compares the rows in the local DB with the harvested JSON
+
+        :return: (dict) For each model, the number of rows 'expected' from
+            `self.contacts` and 'loaded' into the DB, plus 'consistent',
+            True when they all agree, and 'remediations', the number of
+            entries left for a human operator
+        """
+        summary = {'consistent': True}
+        for model, expected in self._expected_rows().items():
+            loaded = model.objects.count()
+            summary[model.__name__] = {'expected': expected, 'loaded': loaded}
+            if loaded != expected:
+                summary['consistent'] = False
+                self.logger.error(
+                    f"Initial load has {loaded} {model.__name__} rows, but "
+                    f"the harvest holds {expected}"
+                )
+        summary['remediations'] = RequiringRemediation.objects.count()
+        self.logger.info(f"Initial load summary: {summary}")
+        return summary
+
+    def _produce_contact_pages(self, params, api_uri, pages, stop,
+                               checkpoint=None, resume=False):
+        # Runs in the producer thread: only HTTP, never the DB
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=PIPELINE_POLL_SECONDS)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        # Whatever stops the harvest early (`CombineException` included, which
+        # isn't an `Exception`) is handed to the consumer to re-raise; only
+        # a harvest which reached its last page ends with `_END_OF_PAGES`
+        try:
+            for page in self.iter_contact_pages(params, api_uri, checkpoint,
+                                                resume):
+                if not put(page):
+                    return
+        except BaseException as e:
+            put(e)
         else:
-            updt(len(self.contacts), len(self.contacts))
+            put(_END_OF_PAGES)
+
+    def harvest_and_combine_contacts(self, status='ALL', limit='500',
+                                     modified_since=None,
+                                     api_uri='/v2/contacts', queue_size=4,
+                                     batch_size=None,
+                                     update_web_interface=False,
+                                     resume=False, reporter=None,
+                                     checkpoint=False):
+        """Harvests contacts and combines them into the DB as pages arrive
+
+        A producer thread walks the harvest's `next_link`s and pushes each
+        page of contacts onto a bounded queue, while this generator combines
+        the pages as they come off it. Network and DB time overlap, and no
+        more than `queue_size` pages are ever held in memory, so unlike
+        `harvest_contacts` followed by `combine_contacts_into_db` the
+        contacts are *not* kept in `self.contacts`. Lists are not harvested
+        here; `self.cclists` is combined before any contact, as usual.
+
+        :param status: (str) See `harvest_contacts`
+        :param limit: (str / int) See `harvest_contacts`
+        :param modified_since: (datetime) See `harvest_contacts`
+        :param api_uri: (str) The API endpoint for ConstantContact contacts
+        :param queue_size: (int) Most pages waiting to be combined before the
+            producer blocks
+        :param batch_size: (int) See `combine_contacts_into_db`
+        :param update_web_interface: (bool) If true, yields a dictionary
+            after each page with 'processed' (contacts combined), 'total'
+            (contacts harvested so far), 'pages' (pages combined) and
+            'harvest_done' (whether the last page has been fetched), along
+            with the rest of `ProgressReporter.payload`. If not true, the
+            console progress bar is updated instead.
+        :param resume: (bool) See `harvest_contacts`
+        :param reporter: (`progress.ProgressReporter`) See
+            `combine_contacts_into_db`; progress is always due at the end of
+            a page, since its `total` is the number harvested so far
+        :param checkpoint: (bool) See `harvest_contacts`; the checkpoint is
+            removed once every page has been combined
+        :return: None, but should update local DB
+        """
+        begin_time = datetime.datetime.now()
+        params = self._contact_harvest_params(status, limit, modified_since)
+        self.cc_index = CCIdIndex().load_for_contacts([], self.cclists)
+        for cclist in self.cclists:
+            self.combine_cclist_json_into_db(cclist)
+
+        pages = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+        producer = threading.Thread(
+            target=self._produce_contact_pages,
+            args=(params, api_uri, pages, stop,
+                  self._harvest_checkpoint(api_uri, params,
+                                           checkpoint or resume),
+                  resume),
+            daemon=True
+        )
+        producer.start()
+        self.counts = Counter()
+        self.transaction_policy.reset()
+        if reporter is None:
+            reporter = ProgressReporter(
+                sink=None if update_web_interface else ConsoleSink()
+            )
+        reporter.total = 0
+        reporter.counts = self.counts
+        npages = 0
+        try:
+            while True:
+                page = pages.get()
+                if page is _END_OF_PAGES:
+                    break
+                elif isinstance(page, BaseException):
+                    raise page
+                npages += 1
+                reporter.total += len(page)
+                self.cc_index.load_for_contacts(page)
+                progress = None
+                for done in self._iter_combine(page, batch_size):
+                    progress = reporter.advance(done)
+                self.logger.debug(
+                    f"Combined page {npages}; {reporter.processed} contacts "
+                    "so far"
+                )
+                if progress is not None and update_web_interface:
+                    progress['pages'] = npages
+                    progress['harvest_done'] = not producer.is_alive()\
+                        and pages.empty()
+                    yield progress
+        except KeyboardInterrupt:
+            self.logger.info("Interrupt signal received...quitting.")
+            return
+        finally:
+            stop.set()
+            producer.join()
+
+        self.clear_harvest_checkpoints()
+        total_time = (datetime.datetime.now() - begin_time).total_seconds()
+        progress = reporter.report()
+        if update_web_interface:
+            progress['pages'] = npages
+            progress['harvest_done'] = True
+            yield progress
         self.logger.info(
-            f"Combined time to process '{processed}' contacts: "
-            f"{total_time // 60} minutes and {total_time % 60} seconds."
-         )
+            f"Harvested and combined '{reporter.processed}' contacts from "
+            f"{npages} pages in {total_time // 60} minutes and "
+            f"{total_time % 60} seconds. Outcomes: {dict(self.counts)}. "
+            f"Commit latency: {self.transaction_policy.summary()}"
+        )
+
+
+def _combine_shard(shard_no, contacts, progress, batch_size, full_index,
+                   combiner, loglvl, logfile, contacts_per_transaction):
+    """Combines one shard of contacts, in a worker process
+
+    See `DataCombine.combine_contacts_into_db`'s `workers`. Progress is put
+    on the `progress` queue as (shard_no, processed, per-stage counts).
+
+    :return: (dict) The shard's 'counts', 'bad_phone_nums' and 'bad_m2m'
+    """
+    name, ext = os.path.splitext(logfile)
+    dc = DataCombine(
+        loglvl=loglvl, logger_name=f"{__name__}-shard{shard_no}",
+        logfile=f"{name}-shard{shard_no}{ext}",
+        transaction_policy=TransactionPolicy(contacts_per_transaction)
+    )
+    dc.contacts = contacts
+    try:
+        for payload in dc.combine_contacts_into_db(
+                update_web_interface=True, batch_size=batch_size,
+                full_index=full_index, combiner=combiner):
+            progress.put((
+                shard_no, payload['processed'],
+                {stage: payload[stage] for stage in STAGES}
+            ))
+    finally:
+        connections.close_all()
+    return {
+        'counts': dict(dc.counts),
+        'bad_phone_nums': dc.bad_phone_nums,
+        'bad_m2m': dc.bad_m2m
+    }
+
 
 if __name__ == '__main__':
     dc = DataCombine()
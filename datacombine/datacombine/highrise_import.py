@@ -0,0 +1,480 @@
+import datetime
+from dateutil import parser
+import re
+
+from django.core.exceptions import FieldError
+from django.db.models import Case, CharField, Value, When
+from django.utils import timezone
+from .bulk_combine import BulkCombiner, PHONE_FIELDS, chunked, m2m_through
+from .bulk_sql import upsert_objects
+from .phone_cache import PHONE_CACHE
+from .models import (
+    Contact,
+    EmailAddress,
+    HighRiseProfile,
+    Note,
+    Phone,
+    NON_SUBSCRIBER,
+    NO_CONFIRMATION_REQUIRED
+)
+
+DEFAULT_IMPORT_BATCH_SIZE = 500
+HIGHRISE_SOURCE = "HighRise"
+# Prefix of the `cc_id` of rows made from HighRise, so they can't collide
+# with ConstantContact's
+HIGHRISE_ID_PREFIX = "highrise-"
+# HighRise doesn't say what kind of phone a number is
+HIGHRISE_PHONE_FIELD = 'work_phone'
+_NOTE_KEY_RE = re.compile(r"^note_(\d+)$")
+_MISSING = object()
+# How HighRise writes when a note was written, e.g. "March 1, 2017 10:00"
+WRITTEN_ON_FORMAT = "%B %d, %Y %H:%M"
+
+
+def normalize_email(email):
+    """Returns the form emails are matched in, or None if it isn't one"""
+    email = (email or '').strip().strip('"').lower()
+    return email if '@' in email else None
+
+
+def normalize_phone(phone_num):
+    """Returns the (area_code, number, extension) phones are matched by
+
+    :param phone_num: (str) Phone number as written in HighRise
+    :return: (tuple) See `Phone.key`, or None if it isn't a phone number
+    """
+    ph = Phone()
+    try:
+        ph.create_from_str(phone_num or '')
+    except FieldError:
+        return None
+    # What `ph == None` checks, without building a second Phone
+    return ph.key if any(ph.key) else None
+
+
+def _clean(val):
+    # The miner keeps list markers and line ends; e.g. '- Donor\n'
+    if not isinstance(val, str):
+        return None
+    val = val.strip()
+    if val.startswith("- "):
+        val = val[2:].strip()
+    return val or None
+
+
+def _parse_written_on(written_on):
+    written_on = (_clean(written_on) or '').strip('"')
+    try:
+        written = datetime.datetime.strptime(written_on, WRITTEN_ON_FORMAT)
+    except ValueError:
+        # Much slower, so only for dates not in HighRise's usual format
+        try:
+            written = parser.parse(written_on)
+        except (ValueError, OverflowError):
+            return None
+    if timezone.is_naive(written):
+        written = timezone.make_aware(written)
+    return written
+
+
+class HighRisePerson():
+    def __init__(self, finame, data):
+        """What one person mined from a HighRise export imports as
+
+        See `hrminer.HighRiseDataMiner.mine_file` for `data`.
+
+        :param finame: (str) Name of the file the person was mined from
+        :param data: (dict) What the person mined to
+        """
+        self.finame = finame
+        self.highrise_id = _clean(str(data.get('pid') or ''))
+        self.name = _clean(data.get('name'))
+        company = {
+            _clean(key): _clean(val)
+            for key, val in (data.get('Company') or dict()).items()
+        }
+        self.company_name = company.get('Name')
+        self.job_title = company.get('Title')
+        self.tags = [
+            tag for tag in map(_clean, data.get('tags') or ()) if tag
+        ]
+        self.background = _clean(data.get('background'))
+
+        contact = data.get('contact') or dict()
+        self.emails = []
+        for email in contact.get('Email_addresses') or ():
+            email = normalize_email(email)
+            if email and email not in self.emails:
+                self.emails.append(email)
+        self.phones = []
+        for phone_num in contact.get('Phone_numbers') or ():
+            key = normalize_phone(phone_num)
+            if key and key not in self.phones:
+                self.phones.append(key)
+
+        self.notes = []
+        for key, note in data.items():
+            note_id = _NOTE_KEY_RE.match(key)
+            if not note_id or not isinstance(note, dict):
+                continue
+            body = note.get('body') or ''
+            # The miner can run the fields after About into the body
+            body = body.split("- Body:", 1)[-1]
+            self.notes.append((
+                note_id.group(1),
+                _parse_written_on(note.get('written_on')),
+                "\n".join(line.strip() for line in body.strip().splitlines())
+            ))
+
+        # Local contact the person is imported into, once known
+        self.contact_pk = None
+        # Earlier person in the same batch, sharing an email or phone
+        self.same_as = None
+        # Whether `contact_pk` was made for the person
+        self.created = False
+
+    @property
+    def first_name(self):
+        return (self.name or '').partition(' ')[0][:50] or None
+
+    @property
+    def last_name(self):
+        return (self.name or '').partition(' ')[2].strip()[:50] or None
+
+
+class ContactMatchIndex():
+    def __init__(self):
+        """In-memory map of normalized emails, phones and HighRise ids to
+        local contacts
+
+        Loaded up front with one query per table, so matching a person
+        costs dict lookups only, however many people are imported. Keys
+        are `normalize_email`, `Phone.phone_key` and `Contact.highrise_id`;
+        where several contacts share a key, the oldest wins.
+
+        Like `cc_index.CCIdIndex`, `add`s can be undone alongside the
+        transaction they were made in; see `begin`.
+        """
+        self._by_highrise = dict()
+        self._by_email = dict()
+        self._by_phone = dict()
+        # One undo log per open `begin`, innermost last
+        self._undo = []
+
+    def load(self):
+        """Loads every contact's emails, phones and HighRise id
+
+        :return: self
+        """
+        self._by_highrise.update(
+            Contact.objects.filter(highrise_id__isnull=False)
+            .values_list('highrise_id', 'pk')
+        )
+        through, src, tgt = m2m_through('email_addresses')
+        rows = through.objects.order_by(src).values_list(
+            src, f"{tgt[:-len('_id')]}__email_address"
+        )
+        for pk, email in rows:
+            email = normalize_email(email)
+            if email:
+                self._by_email.setdefault(email, pk)
+        for phfld in PHONE_FIELDS:
+            through, src, tgt = m2m_through(phfld)
+            rows = through.objects.order_by(src).values_list(
+                src, f"{tgt[:-len('_id')]}__phone_key"
+            )
+            for pk, phone_key in rows:
+                self._by_phone.setdefault(phone_key, pk)
+        return self
+
+    def match(self, person):
+        """Returns who `person` is, by HighRise id, then email, then phone
+
+        :param person: (`HighRisePerson`)
+        :return: (int) Local contact pk, (`HighRisePerson`) an unmatched
+            person `add`ed earlier, or None
+        """
+        found = self._by_highrise.get(person.highrise_id)
+        if found is not None:
+            return found
+        for email in person.emails:
+            found = self._by_email.get(email)
+            if found is not None:
+                return found
+        for key in person.phones:
+            found = self._by_phone.get(Phone.make_key(*key))
+            if found is not None:
+                return found
+        return None
+
+    def add(self, person, owner):
+        """Points `person`'s keys at `owner`, unless they're already taken
+        by someone else
+
+        :param person: (`HighRisePerson`)
+        :param owner: (int) Local contact pk, or (`HighRisePerson`) the
+            person, until their contact is created
+        """
+        keyed = [(self._by_highrise, person.highrise_id)]
+        keyed.extend((self._by_email, email) for email in person.emails)
+        keyed.extend(
+            (self._by_phone, Phone.make_key(*key)) for key in person.phones
+        )
+        for keys, key in keyed:
+            previous = keys.get(key, _MISSING)
+            if previous is _MISSING or previous is person:
+                if self._undo:
+                    self._undo[-1].append((keys, key, previous))
+                keys[key] = owner
+
+    def begin(self):
+        """Starts recording `add`s, so they can be undone with `rollback`
+
+        Should be paired with the DB transaction (or savepoint) the people
+        are imported in; like those, calls may be nested.
+        """
+        self._undo.append([])
+
+    def commit(self):
+        """Keeps every `add` since the last `begin`, unless an enclosing
+        `begin` is rolled back later"""
+        undo = self._undo.pop() if self._undo else []
+        if self._undo:
+            self._undo[-1].extend(undo)
+
+    def rollback(self):
+        """Forgets every `add` since the last `begin`"""
+        undo = self._undo.pop() if self._undo else []
+        for keys, key, previous in reversed(undo):
+            if previous is _MISSING:
+                keys.pop(key, None)
+            else:
+                keys[key] = previous
+
+
+class HighRiseImporter():
+    def __init__(self, dcombine, batch_size=DEFAULT_IMPORT_BATCH_SIZE,
+                 index=None):
+        """Imports mined HighRise people into the local DB a batch at a time
+
+        Each person is matched to a local contact by HighRise id (from an
+        earlier import), email, or phone (see `ContactMatchIndex`). Matched
+        contacts get the person's HighRise id if they have none yet; people
+        who match no one become new contacts, with their name, company,
+        emails and phones. Either way, the person's tags and background are
+        kept in the contact's `HighRiseProfile`, and their notes become the
+        contact's `Note`s. Importing the same people again updates those
+        rather than duplicating them.
+
+        Every model is written with a handful of statements per batch, and
+        nothing is queried per person. Should anything go wrong with a
+        batch, it is rolled back and its people imported one at a time, each
+        in its own savepoint, so one bad person can't sink the rest; those
+        that still fail are counted as 'highrise_errored'.
+
+        :param dcombine: (`DataCombine`) Owner of the logger, the counts and
+            the transaction policy
+        :param batch_size: (int) Number of people written per batch
+        :param index: (`ContactMatchIndex`) Preloaded index; a fresh one is
+            loaded from the DB if None
+        """
+        self.dc = dcombine
+        self.logger = dcombine.logger
+        self.batch_size = batch_size
+        self.index = index if index is not None else ContactMatchIndex().load()
+
+    def import_people(self, people):
+        """Imports `people`, yielding the size of each finished batch
+
+        :param people: (iterable of (str, dict)) File name and mined data of
+            each person, e.g. `DataCombine.iter_highrise_contact_stash`
+        :return: Generator of (int), the number of people in each batch
+        """
+        policy = self.dc.transaction_policy
+        for batch in chunked(people, self.batch_size):
+            self.index.begin()
+            try:
+                with policy.transaction():
+                    imported = self.import_batch(batch)
+            except Exception:
+                self.index.rollback()
+                self.logger.exception(
+                    f"HighRise import failed on a batch of {len(batch)} "
+                    "people...falling back to importing one at a time"
+                )
+                with policy.transaction():
+                    for item in batch:
+                        self._import_one(item)
+            except BaseException:
+                self.index.rollback()
+                raise
+            else:
+                self.index.commit()
+                self._note_committed(batch, imported)
+            yield len(batch)
+
+    def _import_one(self, item):
+        self.index.begin()
+        try:
+            with self.dc.transaction_policy.savepoint():
+                imported = self.import_batch([item])
+        except Exception:
+            self.index.rollback()
+            self.dc.counts['highrise_errored'] += 1
+            self.logger.exception(
+                f"Could not import the HighRise person in '{item[0]}'"
+            )
+        except BaseException:
+            self.index.rollback()
+            raise
+        else:
+            self.index.commit()
+            self._note_committed([item], imported)
+
+    def _note_committed(self, batch, people):
+        # Only once the people are committed, or a fallback would count twice
+        self.dc.counts['highrise_skipped'] += len(batch) - len(people)
+        for person in people:
+            self.dc.counts[
+                'highrise_inserted' if person.created else 'highrise_matched'
+            ] += 1
+
+    def import_batch(self, batch):
+        """Writes one batch of people to the local DB
+
+        Counts nothing, and leaves `self.index` to the caller to commit or
+        roll back with the transaction; see `import_people`.
+
+        :param batch: (list of (str, dict)) See `import_people`
+        :return: (list of `HighRisePerson`) The people imported
+        """
+        people = []
+        for finame, data in batch:
+            person = HighRisePerson(finame, data)
+            if not person.highrise_id:
+                self.logger.warning(f"No HighRise id in '{finame}'...skipping")
+                continue
+            people.append(person)
+
+        new = []
+        for person in people:
+            found = self.index.match(person)
+            if found is None:
+                new.append(person)
+                self.index.add(person, person)
+            elif isinstance(found, HighRisePerson):
+                person.same_as = found
+                self.index.add(person, found)
+            else:
+                person.contact_pk = found
+                self.index.add(person, found)
+        self._insert_new_contacts(new)
+        for person in people:
+            if person.same_as is not None:
+                person.contact_pk = person.same_as.contact_pk
+        self._link_highrise_ids(people)
+        self._upsert_profiles(people)
+        self._upsert_notes(people)
+        return people
+
+    def _insert_new_contacts(self, new):
+        if not new:
+            return
+        now = timezone.now()
+        objs = [
+            Contact(
+                highrise_id=person.highrise_id,
+                first_name=person.first_name,
+                last_name=person.last_name,
+                company_name=(person.company_name or '')[:100] or None,
+                job_title=(person.job_title or '')[:50] or None,
+                source=HIGHRISE_SOURCE,
+                created_date=now
+            ) for person in new
+        ]
+        Contact.objects.bulk_create(objs)
+        BulkCombiner._assign_pks(Contact, objs, 'highrise_id')
+        for person, obj in zip(new, objs):
+            person.contact_pk = obj.pk
+            person.created = True
+            self.index.add(person, obj.pk)
+
+        emails = []
+        owners = []
+        for person in new:
+            for i, email in enumerate(person.emails):
+                emails.append(EmailAddress(
+                    cc_id=f"{HIGHRISE_ID_PREFIX}{person.highrise_id}-{i}",
+                    email_address=email,
+                    status=NON_SUBSCRIBER,
+                    confirm_status=NO_CONFIRMATION_REQUIRED
+                ))
+                owners.append(person.contact_pk)
+        if emails:
+            EmailAddress.objects.bulk_create(emails)
+            BulkCombiner._assign_pks(EmailAddress, emails)
+            through, src, tgt = m2m_through('email_addresses')
+            through.objects.bulk_create([
+                through(**{src: pk, tgt: email.pk})
+                for pk, email in zip(owners, emails)
+            ])
+
+        keys = {key for person in new for key in person.phones}
+        if keys:
+            pks = PHONE_CACHE.pks_for(keys)
+            through, src, tgt = m2m_through(HIGHRISE_PHONE_FIELD)
+            through.objects.bulk_create([
+                through(**{src: person.contact_pk, tgt: pks[key]})
+                for person in new for key in person.phones
+            ])
+
+    @staticmethod
+    def _link_highrise_ids(people):
+        # Matched contacts without a HighRise id take their person's, in one
+        # statement; a contact matched by several people keeps the first.
+        # New contacts were created with theirs.
+        link = dict()
+        for person in people:
+            if not person.created and person.same_as is None:
+                link.setdefault(person.contact_pk, person.highrise_id)
+        if not link:
+            return
+        Contact.objects.filter(
+            pk__in=list(link), highrise_id__isnull=True
+        ).update(highrise_id=Case(
+            *[When(pk=pk, then=Value(hid)) for pk, hid in link.items()],
+            output_field=CharField()
+        ))
+
+    def _upsert_profiles(self, people):
+        profiles = dict()
+        for person in people:
+            profile = profiles.get(person.contact_pk)
+            if profile is None:
+                profiles[person.contact_pk] = HighRiseProfile(
+                    contact_id=person.contact_pk, tags=list(person.tags),
+                    background=person.background
+                )
+                continue
+            # More than one person for the contact; keep what they all said
+            profile.tags.extend(
+                tag for tag in person.tags if tag not in profile.tags
+            )
+            if person.background and person.background != profile.background:
+                profile.background = "\n\n".join(
+                    filter(None, (profile.background, person.background))
+                )
+        upsert_objects(HighRiseProfile, list(profiles.values()), ['contact'])
+
+    def _upsert_notes(self, people):
+        now = timezone.now()
+        notes = dict()
+        for person in people:
+            for note_id, written, text in person.notes:
+                cc_id = f"{HIGHRISE_ID_PREFIX}{note_id}"
+                notes[cc_id] = Note(
+                    cc_id=cc_id, note=text, contact_id=person.contact_pk,
+                    created_date=written or now,
+                    modified_date=written or now
+                )
+        upsert_objects(Note, list(notes.values()), ['cc_id'])
@@ -1,9 +1,15 @@
 #!/usr/bin/env python
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import hashlib
 import json
 import logging
 import os
 import re
+import sqlite3
 import sys
+import tempfile
+import time
+import traceback
 
 from IPython import embed
 import pandas as pd
@@ -20,9 +26,123 @@ emailre = re.compile(r"\s+\- Email_addresses\s*\n\s+\-\s*\n\s+\-\s+([\w.-]+@[\w.
                      re.IGNORECASE)
 addressre = re.compile("\s+\- Addresses\s*\n\s+\-\s*\n\s+\-\s+\"([\,\t \w]+)\"")
 phonenumre = re.compile("\s+\- Phone_numbers\s*\n\s+\-\s*\n\s+\-\s+([\(\)\t \w\-]+)\n")
+# Precompiled for the single-pass parser (see `parse_export`)
+NOTE_RE = re.compile(
+    r"\- (?P<note_type>Note|Comment|Task recording|Email) (?P<note_id>[0-9]+):"
+)
+FIELD_RE = re.compile(r"\- (\w+):")
+SUBFIELD_RE = re.compile(
+    r"(?P<field>[ \t\w\-]+):"
+    r"(?P<field_data>[\s\w\&\.\-\\\/\(\)\'\"\!\,\;\#\@\+]+)"
+)
+CONTACT_FIELD_RE = re.compile(r"    - (\w+)")
+CONTACT_DATA_RE = re.compile(r"^\s+\- ([ A-Za-z0-9@\"\,\-\.\(\)]+)$")
+_MISSING = object()
+_SYNCED = object()
+# Bump whenever what the miner produces changes, so that cached results
+# (see `MiningCache`) are mined again
+MINER_VERSION = 1
+IN_FLIGHT_PER_WORKER = 4
 #notesre = re.compile("\- Note (?P<note_id>[0-9]+):\s*\-\s+Author:(?P<author>[ \w\&\.\-\\\/\(\)\'\"\!\,\;\#\@\+]+)\s*\-\s+Written: \"([A-Za-z0-9\,\: ]+)\"\s*\-\s+About: (?P<about>[ \w\&\.\-\\\/\(\)\'\"\!\,\;\#\@\+]+)\s*\-\s+Body: (.*\n.*))")
 
 
+def _split_lines(text):
+    # Like repeated `readline()`s on a text file: split on newlines only,
+    # keeping them
+    lines = text.split('\n')
+    last = lines.pop()
+    lines = [line + '\n' for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+
+class MiningCache():
+    def __init__(self, path, version=MINER_VERSION):
+        """Persistent results of mining HighRise exports, kept in SQLite
+
+        One row per file: its absolute path, size, mtime, SHA-1 and what it
+        mined to, along with the miner version that mined it. Rows from any
+        other version are dropped on open.
+
+        A file whose size and mtime match its row is taken from the cache
+        without being opened. A file whose size or mtime changed is read
+        and hashed, and only mined again if its content hash changed too.
+
+        :param path: (str) Path of the SQLite database; created if missing
+        :param version: (int) Miner version the results are for
+        """
+        self.path = path
+        self.version = version
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS mined ("
+                "path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                "mtime_ns INTEGER NOT NULL, sha1 TEXT NOT NULL, "
+                "version INTEGER NOT NULL, data TEXT NOT NULL)"
+            )
+            self._db.execute(
+                "DELETE FROM mined WHERE version != ?", (version,)
+            )
+
+    def lookup(self, path):
+        """Returns the cached row for a file, or None
+
+        :param path: (str) Path of the file
+        :return: (dict) 'size', 'mtime_ns', 'sha1' and 'data' (JSON text)
+        """
+        row = self._db.execute(
+            "SELECT size, mtime_ns, sha1, data FROM mined WHERE path = ?",
+            (os.path.abspath(path),)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('size', 'mtime_ns', 'sha1', 'data'), row))
+
+    def store(self, path, size, mtime_ns, sha1, data):
+        """Caches what a file mined to
+
+        :param path: (str) Path of the file
+        :param size: (int) Size of the file, in bytes
+        :param mtime_ns: (int) Modification time of the file, in ns
+        :param sha1: (str) Hex SHA-1 of the file's content
+        :param data: (dict / str) Mined data, or its JSON text
+        """
+        if not isinstance(data, str):
+            data = json.dumps(data)
+        self._db.execute(
+            "INSERT OR REPLACE INTO mined VALUES (?, ?, ?, ?, ?, ?)",
+            (os.path.abspath(path), size, mtime_ns, sha1, self.version, data)
+        )
+
+    def prune(self, directory, finames):
+        """Forgets the files in `directory` that aren't among `finames`"""
+        keep = {os.path.abspath(os.path.join(directory, f)) for f in finames}
+        prefix = os.path.join(os.path.abspath(directory), '')
+        stale = [
+            (path,) for path, in self._db.execute(
+                "SELECT path FROM mined WHERE substr(path, 1, ?) = ?",
+                (len(prefix), prefix)
+            )
+            if path not in keep and os.path.dirname(path) == prefix[:-1]
+        ]
+        self._db.executemany("DELETE FROM mined WHERE path = ?", stale)
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 class HighRiseDataMiner():
     def __init__(self, pwdir):
         self.pwdir = pwdir
@@ -38,8 +158,15 @@ class HighRiseDataMiner():
             "(?P<field_data>[\s\w\&\.\-\\\/\(\)\'\"\!\,\;\#\@\+]+)"
         )
 
+    def get_txt_file_names(self):
+        """Returns the names of the exported files in `self.pwdir`, sorted"""
+        return sorted(
+            finame for finame in os.listdir(self.pwdir)
+            if os.path.isfile(os.path.join(self.pwdir, finame))
+        )
+
     def get_txt_files(self):
-        for finame in os.listdir(self.pwdir):
+        for finame in self.get_txt_file_names():
             pth = os.path.join(self.pwdir, finame)
             with open(pth, 'r') as fi:
                 yield (finame, fi)
@@ -51,14 +178,169 @@ class HighRiseDataMiner():
         else:
             return -1
 
-    def mine_directory(self, target_dir=None):
+    def iter_mine_directory(self, target_dir=None, workers=None, cache=None):
+        """Mines every file in the directory, yielding each as it finishes
+
+        Each file is opened at most once. A file that fails to mine is
+        reported with its error instead of aborting the rest.
+
+        :param target_dir: (str) Directory to mine instead of `self.pwdir`
+        :param workers: (int) If more than 1, files are mined in a pool of
+            this many processes and yielded in the order they finish, rather
+            than in name order
+        :param cache: (`MiningCache`) If given, files it already has are
+            yielded from it first, only new and changed files are mined, and
+            what they mine to is added to it. Files no longer in the
+            directory are dropped from it.
+        :return: Generator of (dict) per file: 'file' (name), 'data' (see
+            `mine_file`, None on error), 'seconds' taken, 'error' (the
+            formatted traceback, or None) and 'cached' (whether 'data' came
+            from `cache`)
+        """
         if target_dir:
             self.pwdir = target_dir
+        finames = self.get_txt_file_names()
+        known = dict()
+        if cache is not None:
+            cache.prune(self.pwdir, finames)
+            todo = []
+            for finame in finames:
+                row = cache.lookup(os.path.join(self.pwdir, finame))
+                if row is None:
+                    todo.append(finame)
+                    continue
+                st = os.stat(os.path.join(self.pwdir, finame))
+                if (st.st_size, st.st_mtime_ns) ==\
+                        (row['size'], row['mtime_ns']):
+                    yield self._log_result(
+                        _cached_result(finame, row['data'])
+                    )
+                else:
+                    known[finame] = row
+                    todo.append(finame)
+            finames = todo
+
+        try:
+            if workers and workers > 1:
+                # Only a few files per worker are in flight at a time, so
+                # results are held no longer than it takes to yield them
+                todo = iter(finames)
+                pending = set()
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    while True:
+                        for finame in todo:
+                            pending.add(pool.submit(
+                                _mine_path, self.pwdir, finame,
+                                known_sha1=known.get(finame, {}).get('sha1')
+                            ))
+                            if len(pending) >= workers * IN_FLIGHT_PER_WORKER:
+                                break
+                        if not pending:
+                            break
+                        done, pending = wait(
+                            pending, return_when=FIRST_COMPLETED
+                        )
+                        for future in done:
+                            yield self._log_result(self._cache_result(
+                                cache, future.result(), known
+                            ))
+            else:
+                for finame in finames:
+                    result = _mine_path(
+                        self.pwdir, finame, self,
+                        known.get(finame, {}).get('sha1')
+                    )
+                    yield self._log_result(
+                        self._cache_result(cache, result, known)
+                    )
+        finally:
+            if cache is not None:
+                cache.commit()
+
+    def _cache_result(self, cache, result, known):
+        stat = result.pop('stat')
+        if cache is None or result['error']:
+            return result
+        path = os.path.join(self.pwdir, result['file'])
+        if result['data'] is None:
+            # Touched but unchanged: `_mine_path` didn't mine it again
+            row = known[result['file']]
+            cache.store(path, *stat, row['data'])
+            return dict(
+                _cached_result(result['file'], row['data']),
+                seconds=result['seconds']
+            )
+        cache.store(path, *stat, result['data'])
+        return result
+
+    def _log_result(self, result):
+        if result['error']:
+            self.logger.error(
+                f"Could not mine '{result['file']}':\n{result['error']}"
+            )
+        elif result['cached']:
+            self.logger.debug(f"'{result['file']}' was unchanged; cached")
+        else:
+            self.logger.debug(
+                f"Mined '{result['file']}' in {result['seconds']:.4f}s"
+            )
+        return result
+
+    def mine_directory(self, target_dir=None, workers=None, cache=None):
+        """Mines every file in the directory; see `iter_mine_directory`
+
+        :return: (dict) File name -> mined data, for the files mined
+            successfully. The errors of the rest are kept in `self.errors`,
+            and every file's time in `self.timings`.
+        """
         results = {}
-        for finame, fi in self.get_txt_files():
-            results.update({finame : self.mine_file(fi, finame)})
+        self.errors = {}
+        self.timings = {}
+        for result in self.iter_mine_directory(target_dir, workers, cache):
+            self.timings[result['file']] = result['seconds']
+            if result['error']:
+                self.errors[result['file']] = result['error']
+            else:
+                results[result['file']] = result['data']
         return results
 
+    def write_stash(self, ofname, target_dir=None, workers=None, cache=None):
+        """Mines every file in the directory into a JSON Lines stash
+
+        Each person is written as soon as their file is mined, as one line
+        of `{"file": <name>, "data": <mined data>}`, so memory doesn't grow
+        with the size of the export. The stash is written beside `ofname`
+        and moved into place when done. See `iter_mine_directory` for the
+        arguments, and `DataCombine.iter_highrise_contact_stash` to read it.
+
+        :param ofname: (str) Path of the stash
+        :return: (int) Number of people written. The errors of files that
+            failed are kept in `self.errors`, and every file's time in
+            `self.timings`.
+        """
+        self.errors = {}
+        self.timings = {}
+        written = 0
+        tmpname = f"{ofname}.tmp"
+        try:
+            with open(tmpname, 'w', encoding='utf-8') as f:
+                for result in self.iter_mine_directory(
+                        target_dir, workers, cache):
+                    self.timings[result['file']] = result['seconds']
+                    if result['error']:
+                        self.errors[result['file']] = result['error']
+                        continue
+                    f.write(json.dumps(
+                        {'file': result['file'], 'data': result['data']}
+                    ))
+                    f.write('\n')
+                    written += 1
+            os.replace(tmpname, ofname)
+        finally:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+        return written
+
     def _get_id_n_name_field(self, sre, field, data, finame):
         if sre:
             data[field] = sre.group(1)
@@ -90,21 +372,176 @@ class HighRiseDataMiner():
             return tags
 
     def mine_file(self, fi, finame):
+        """Mines one exported person
+
+        :param fi: Text file opened on the export, read from where it is
+        :param finame: (str) Name of the file, for logging
+        :return: (dict) 'pid', 'name', 'tags' and whatever else the file has;
+            see `parse_export`
+        """
+        return self.parse_export(fi.read(), finame)
+
+    def parse_export(self, text, finame):
+        """Mines one exported person from the text of its file
+
+        A single forward pass over the lines, as a small state machine: each
+        section's parser starts at the current line and hands back the first
+        line it didn't use, so nothing is read twice and nothing seeks back.
+        Produces exactly what `mine_file_readline` does for the same file.
+
+        :param text: (str) Contents of the export
+        :param finame: (str) Name of the file, for logging
+        :return: (dict) See `mine_file`
+        """
+        lines = _split_lines(text)
+        end = len(lines)
         data = {}
-        fieldre = re.compile("\-+ +(?P<field>\w+): ")
-        with open(os.path.join(self.pwdir, finame)) as f:
-            f.readline()
-            sre_id = idre.search(f.readline())
-            sre_name = namere.search(f.readline())
-            data.update(self._get_id_n_name_field(sre_id, 'pid', data, finame))
-            data.update(
-                self._get_id_n_name_field(sre_name, 'name', data, finame)
-            )
-            tags = self._mine_tags(f, finame)
-            data.update({'tags': tags})
-            for field in self._mine_file_body(f, finame):
-                data.update(field)
+        data.update(self._get_id_n_name_field(
+            idre.search(lines[1]) if end > 1 else None, 'pid', data, finame
+        ))
+        data.update(self._get_id_n_name_field(
+            namere.search(lines[2]) if end > 2 else None, 'name', data, finame
+        ))
 
+        i = 3
+        tags = []
+        if i < end and lines[i].startswith("  Tags:"):
+            i += 1
+            while i < end and not lines[i].startswith("-"):
+                tags.append(lines[i][4:])
+                i += 1
+        data['tags'] = tags
+
+        # The readline miner copies its sections into `data` after each one
+        # but a background, so a background with nothing after it never
+        # arrives; `unsynced` is what 'background' was at the last copy
+        body = {}
+        unsynced = _SYNCED
+        txt = " "
+        while txt:
+            txt = lines[i] if i < end else ''
+            i += 1
+            note = NOTE_RE.search(txt)
+            if note:
+                key = f"note_{note.group('note_id').strip()}"
+                body[key] = {'type': note.group('note_type').strip()}
+                fields, i = self._parse_note(lines, i)
+                body[key].update(fields)
+            elif txt.startswith("- Contact: "):
+                body['contact'], i = self._parse_contact(lines, i)
+            elif txt.startswith("- Background:"):
+                start = i
+                while i < end and not lines[i].startswith("-"):
+                    i += 1
+                txt = lines[i] if i < end else ''
+                if unsynced is _SYNCED:
+                    unsynced = body.get('background', _MISSING)
+                body['background'] = ''.join(lines[start:i])
+                continue
+            else:
+                field = FIELD_RE.search(txt)
+                if field:
+                    field = field.group(1).strip()
+                    body[field], i, txt = self._parse_field(
+                        lines, i, field, finame
+                    )
+                elif not (txt.isspace() or len(txt) == 0):
+                    self.logger.warning(f"!Not sure what to do with "
+                                        f"'{txt}' in file' {finame}'!")
+            unsynced = _SYNCED
+
+        if unsynced is _MISSING:
+            del body['background']
+        elif unsynced is not _SYNCED:
+            body['background'] = unsynced
+        data.update(body)
+        return data
+
+    @staticmethod
+    def _parse_note(lines, i):
+        # Fixed lines, with a line to skip before each, then the body until
+        # the next section. Like the readline miner, the body starts from
+        # the 'About' line.
+        end = len(lines)
+        author, written_on, about = (
+            lines[j] if j < end else '' for j in (i + 1, i + 3, i + 5)
+        )
+        start = i = i + 7
+        while i < end and not lines[i].startswith("-"):
+            i += 1
+        return {
+            'author': author[12:],
+            'written_on': written_on[13:],
+            'about': about[11:],
+            'body': about[10:] + ''.join(lines[start:i])
+        }, i
+
+    @staticmethod
+    def _parse_contact(lines, i):
+        end = len(lines)
+        data = {}
+        # The first line is only looked at to see if the section is empty
+        if i >= end or lines[i].startswith("-"):
+            return data, i
+        i += 1
+        infield = None
+        while True:
+            txt = lines[i] if i < end else ''
+            if not infield:
+                s = CONTACT_FIELD_RE.search(txt)
+                if s:
+                    infield = s.group(1).strip()
+                    data[infield] = []
+            elif txt.startswith("  -"):
+                infield = None
+            else:
+                s = CONTACT_DATA_RE.search(txt)
+                if s:
+                    data[infield].append(s.group(1).strip())
+            if not txt or txt.startswith("-"):
+                return data, i
+            i += 1
+
+    def _parse_field(self, lines, i, field, finame):
+        # Returns the subfields, the first line not used and that line's text
+        end = len(lines)
+        subfields = {}
+        txt = lines[i] if i < end else ''
+        while txt:
+            txt = lines[i] if i < end else ''
+            if txt.startswith("-"):
+                break
+            i += 1
+            s = SUBFIELD_RE.search(txt)
+            if s:
+                subfields[s.group('field').strip()] =\
+                    s.group('field_data').strip()
+            else:
+                self.logger.warning(
+                    f"!Not sure what to do with '{txt}', "
+                    f"in '{field}' in file' {finame}'!"
+                )
+        return subfields, i, txt
+
+    def mine_file_readline(self, fi, finame):
+        """The original miner: reads the export a line at a time, seeking
+        back over lines it peeked at. Kept as the reference for
+        `parse_export` (see `benchmark_miners`).
+
+        :param fi: Text file opened on the export, read from where it is
+        :param finame: (str) Name of the file, for logging
+        :return: (dict) See `mine_file`
+        """
+        data = {}
+        fi.readline()
+        sre_id = idre.search(fi.readline())
+        sre_name = namere.search(fi.readline())
+        data.update(self._get_id_n_name_field(sre_id, 'pid', data, finame))
+        data.update(self._get_id_n_name_field(sre_name, 'name', data, finame))
+        tags = self._mine_tags(fi, finame)
+        data.update({'tags': tags})
+        for field in self._mine_file_body(fi, finame):
+            data.update(field)
         return data
 
     def _mine_file_body(self, f, finame):
@@ -222,11 +659,149 @@ class HighRiseDataMiner():
         return data
 
 
+def _cached_result(finame, data):
+    return {
+        'file': finame,
+        'data': json.loads(data),
+        'seconds': 0.0,
+        'error': None,
+        'cached': True
+    }
+
+
+def _mine_path(pwdir, finame, miner=None, known_sha1=None):
+    """Mines one file, timing it and capturing any error
+
+    Module level so that it can run in a worker process.
+
+    :param pwdir: (str) Directory the file is in
+    :param finame: (str) Name of the file
+    :param miner: (`HighRiseDataMiner`) Miner to use; a new one by default
+    :param known_sha1: (str) SHA-1 the file had when it was last mined; if
+        its content still has it, it isn't mined again and 'data' is None
+    :return: (dict) See `HighRiseDataMiner.iter_mine_directory`, plus
+        'stat': the file's (size, mtime_ns, sha1)
+    """
+    miner = miner or HighRiseDataMiner(pwdir)
+    start = time.perf_counter()
+    data, error, stat = None, None, None
+    try:
+        with open(os.path.join(pwdir, finame), 'rb') as fi:
+            st = os.fstat(fi.fileno())
+            raw = fi.read()
+        sha1 = hashlib.sha1(raw).hexdigest()
+        stat = (st.st_size, st.st_mtime_ns, sha1)
+        if sha1 != known_sha1:
+            # As a text mode read would: universal newlines
+            text = raw.decode('utf-8').replace('\r\n', '\n')\
+                .replace('\r', '\n')
+            data = miner.parse_export(text, finame)
+    except Exception:
+        error = traceback.format_exc()
+    return {
+        'file': finame,
+        'data': data,
+        'seconds': time.perf_counter() - start,
+        'error': error,
+        'cached': False,
+        'stat': stat
+    }
+
+
+def synthetic_export(pid, notes=10):
+    """Returns the text of a made-up HighRise export of one person, for
+    `benchmark_miners`"""
+    lines = [
+        "---",
+        f"- ID: {pid}",
+        f"- Name: Person {pid}",
+        "  Tags:",
+        "    - Donor",
+        "    - Volunteer",
+        "- Background: Met at the gala",
+        "  in Orlando, and again in Tampa",
+        "- Contact: ",
+        "  -",
+        "    - Email_addresses",
+        f"      - person{pid}@example.org",
+        f"      - person{pid}@work.example.org",
+        "  -",
+        "    - Phone_numbers",
+        "      - (407) 555-0100",
+        "  -",
+        "    - Addresses",
+        "      - \"1917 Petrograd Dr., Orlando, FL 32801\"",
+    ]
+    for n in range(notes):
+        lines += [
+            f"- Note {pid}{n:03d}:",
+            "  -",
+            "  - Author: Thomas",
+            "  -",
+            "  - Written: \"March 1, 2017 10:00\"",
+            "  -",
+            f"  - About: Person {pid}",
+            "  -",
+            "  - Body: Called back about the next event",
+            "    and left a message",
+            "    with the office.",
+        ]
+    lines += [
+        "- Company:",
+        "  - Name: Crimson Star",
+        "  - Title: Director",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def benchmark_miners(files=500, notes=10, clock=time.perf_counter):
+    """Times `parse_export` against `mine_file_readline` on a synthetic
+    corpus (see `synthetic_export`)
+
+    :param files: (int) Exports in the corpus
+    :param notes: (int) Notes per export
+    :param clock: (callable) Time source, in seconds
+    :return: (dict) 'files', 'readline_seconds', 'single_pass_seconds',
+        'speedup' and 'identical' (whether both mined the same data)
+    """
+    results = {}
+    seconds = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for pid in range(files):
+            with open(os.path.join(tmpdir, f"{pid}.txt"), 'w',
+                      encoding='utf-8') as f:
+                f.write(synthetic_export(pid, notes))
+        miner = HighRiseDataMiner(tmpdir)
+        finames = miner.get_txt_file_names()
+        for name, mine in (('readline', miner.mine_file_readline),
+                           ('single_pass', miner.mine_file)):
+            start = clock()
+            results[name] = []
+            for finame in finames:
+                with open(os.path.join(tmpdir, finame), 'r',
+                          encoding='utf-8') as fi:
+                    results[name].append(mine(fi, finame))
+            seconds[name] = clock() - start
+    return {
+        'files': files,
+        'readline_seconds': seconds['readline'],
+        'single_pass_seconds': seconds['single_pass'],
+        'speedup': seconds['readline'] / seconds['single_pass'],
+        'identical': results['readline'] == results['single_pass']
+    }
+
+
 if __name__ == '__main__':
     logging.basicConfig(filename='hrminer.log', level=logging.WARNING)
+    if sys.argv[1:] == ['--benchmark']:
+        print(benchmark_miners())
+        sys.exit()
     pth = os.getcwd() if len(sys.argv) == 1 else sys.argv[1]
-    ofname = 'yaya.json'
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    ofname = 'yaya.jsonl'
     hrminer = HighRiseDataMiner(pth)
-    data = hrminer.mine_directory()
-    with open(os.path.join(pth, '..', ofname), 'w') as f:
-        json.dump(data, f)
+    cachefname = os.path.join(pth, '..', 'hrminer_cache.sqlite3')
+    with MiningCache(cachefname) as cache:
+        hrminer.write_stash(
+            os.path.join(pth, '..', ofname), workers=workers, cache=cache
+        )
@@ -0,0 +1,128 @@
+import ciso8601
+
+from django.db import models
+
+from .models import (
+    Contact,
+    EmailAddress,
+    Note,
+    Address
+)
+
+
+def convert_choice_to_field(choice):
+    """Makes choice a field by changing the text
+
+    :param choice: Entry to make a field
+    :return: (str) `choice` made uppercase and replacing spaces with '_'
+    """
+    return choice.upper().replace(' ', '_')
+
+
+def choice_converter(fld):
+    """Returns a converter of ConstantContact choice names to `fld`'s codes
+
+    e.g. 'PERSONAL' -> 'PE'. Unknown names become None.
+    """
+    chmap = {convert_choice_to_field(name): code for code, name in fld.choices}
+    return lambda val: chmap.get(val) if isinstance(val, str) else None
+
+
+def parse_iso_8601(val):
+    """Parses an ISO-8601 string with `ciso8601`
+
+    Anything that isn't one is handed back as is, for the DB field to accept
+    or reject when saving.
+    """
+    if not isinstance(val, str):
+        return val
+    try:
+        return ciso8601.parse_datetime(val)
+    except ValueError:
+        return val
+
+
+class ModelMapper():
+    def __init__(self, model, strict=True, exclude=(), converters=None):
+        """Compiled mapping of ConstantContact JSON onto one model's fields
+
+        `model`'s fields are looked at once, here, and turned into a flat
+        plan of (json key, field attname, converter) tuples; mapping a JSON
+        dict is then a single pass over the plan. The JSON key of a `cc_`
+        field is its name without the prefix. Fields with choices convert
+        ConstantContact's names to the DB codes, and datetime fields parse
+        ISO-8601 strings.
+
+        :param model: Django model class to build
+        :param strict: (bool) Raise a KeyError if the JSON lacks a `cc_`
+            field, rather than leaving it None
+        :param exclude: (iterable of str) Names of fields not set from JSON
+        :param converters: (dict) Field name -> converter, replacing the one
+            the field would get
+        """
+        self.model = model
+        converters = converters or dict()
+        self.plan = []
+        self.required = set()
+        for fld in model._meta.concrete_fields:
+            if fld.primary_key or fld.is_relation or fld.name in exclude:
+                continue
+            key = fld.name[3:] if fld.name.startswith("cc_") else fld.name
+            if fld.name in converters:
+                converter = converters[fld.name]
+            elif fld.choices:
+                converter = choice_converter(fld)
+            elif isinstance(fld, models.DateTimeField):
+                converter = parse_iso_8601
+            else:
+                converter = None
+            if strict and fld.name.startswith("cc_"):
+                self.required.add(key)
+            self.plan.append((key, fld.attname, converter))
+
+    def kwargs(self, attrs):
+        """Maps one JSON dict to `model` keyword arguments
+
+        :param attrs: (dict) ConstantContact JSON of one object
+        :return: (dict) attname -> value
+        """
+        kwargs = dict()
+        for key, attname, converter in self.plan:
+            if key in self.required:
+                val = attrs[key]
+            else:
+                val = attrs.get(key)
+            kwargs[attname] = converter(val) if converter else val
+        return kwargs
+
+    def build(self, attrs):
+        """Returns an unsaved `model` instance for one JSON dict"""
+        return self.model(**self.kwargs(attrs))
+
+    def kwargs_list(self, batch):
+        """Maps a batch of JSON dicts; see `kwargs`
+
+        :param batch: (iterable of dict) ConstantContact JSON
+        :return: (list of dict) One kwargs dict per JSON dict
+        """
+        return [self.kwargs(attrs) for attrs in batch]
+
+    def build_many(self, batch):
+        """Returns unsaved `model` instances for a batch of JSON dicts, ready
+        for `bulk_create`"""
+        return [self.model(**kwargs) for kwargs in self.kwargs_list(batch)]
+
+
+CONTACT_MAPPER = ModelMapper(
+    Contact, strict=False, exclude=('fingerprint', 'highrise_id'),
+    converters={'status': Contact.convert_status_str_to_code}
+)
+# Columns overwritten when ConstantContact sends a changed contact; the rest
+# (e.g. `highrise_id`) are kept
+CONTACT_UPDATE_FIELDS = [
+    attname for _, attname, _ in CONTACT_MAPPER.plan
+] + ['fingerprint']
+MAPPERS = {
+    model: ModelMapper(model) for model in (Address, EmailAddress, Note)
+}
+MAPPERS[Contact] = CONTACT_MAPPER
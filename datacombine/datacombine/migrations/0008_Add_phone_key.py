@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+PHONE_FIELDS = ['home_phone', 'work_phone', 'cell_phone', 'fax']
+
+
+def make_key(area_code, number, extension):
+    return f"{area_code or ''}|{number or ''}|{extension or ''}"
+
+
+def fill_phone_keys(apps, schema_editor):
+    """Sets `phone_key` and merges phones that turn out to be duplicates
+
+    Every contact link to a duplicate is moved to the oldest phone with the
+    same key (unless the contact already links to it), then the duplicate
+    is deleted, so the unique constraint can be added (in the next migration,
+    as postgres won't alter a table with pending trigger events).
+    """
+    Phone = apps.get_model('datacombine', 'Phone')
+    Contact = apps.get_model('datacombine', 'Contact')
+    keep = {}
+    duplicates = {}
+    for phone in Phone.objects.order_by('pk'):
+        key = make_key(phone.area_code, phone.number, phone.extension)
+        if key in keep:
+            duplicates[phone.pk] = keep[key]
+            continue
+        keep[key] = phone.pk
+        phone.phone_key = key
+        phone.save(update_fields=['phone_key'])
+
+    for phfld in PHONE_FIELDS:
+        through = Contact._meta.get_field(phfld).remote_field.through
+        for dup_pk, keep_pk in duplicates.items():
+            linked = through.objects.filter(phone_id=keep_pk).values_list(
+                'contact_id', flat=True
+            )
+            through.objects.filter(
+                phone_id=dup_pk, contact_id__in=list(linked)
+            ).delete()
+            through.objects.filter(phone_id=dup_pk).update(phone_id=keep_pk)
+    Phone.objects.filter(pk__in=list(duplicates)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datacombine', '0007_Added_a_class_for_remediations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='phone',
+            name='phone_key',
+            field=models.CharField(max_length=19, null=True),
+        ),
+        migrations.RunPython(fill_phone_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datacombine', '0008_Add_phone_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='phone',
+            name='phone_key',
+            field=models.CharField(max_length=19, unique=True),
+        ),
+    ]
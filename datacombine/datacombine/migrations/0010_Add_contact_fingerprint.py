@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datacombine', '0009_Make_phone_key_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contact',
+            name='fingerprint',
+            field=models.CharField(max_length=40, null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datacombine', '0010_Add_contact_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='contact',
+            name='cc_id',
+            field=models.IntegerField(null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='contact',
+            name='cc_modified_date',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='contact',
+            name='highrise_id',
+            field=models.CharField(max_length=20, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name='HighRiseProfile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tags', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('background', models.TextField(null=True)),
+                ('contact', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='highrise_profile', to='datacombine.Contact')),
+            ],
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.contrib.postgres.fields import JSONField
 from django.db import models
 from django.core.exceptions import FieldError
+import hashlib
+import json
 import re
 
 
@@ -47,6 +49,8 @@ class Phone(models.Model):
     area_code = models.CharField(max_length=3, null=True)
     number = models.CharField(max_length=7)
     extension = models.CharField(max_length=7, null=True)
+    # Normalized "area_code|number|extension", so NULL parts still collide
+    phone_key = models.CharField(max_length=19, unique=True)
 
     def __str__(self):
         return "{0}{1}-{2}{3}".format(
@@ -66,13 +70,21 @@ class Phone(models.Model):
                self.number == other.number and\
                self.area_code == other.area_code
 
+    @staticmethod
+    def make_key(area_code, number, extension):
+        return f"{area_code or ''}|{number or ''}|{extension or ''}"
+
+    @property
+    def key(self):
+        return (self.area_code, self.number, self.extension)
+
+    def save(self, *args, **kwargs):
+        self.phone_key = Phone.make_key(*self.key)
+        super().save(*args, **kwargs)
+
     @classmethod
     def is_phone_in_db(cls, phobj):
-        return cls.objects.filter(
-            area_code=phobj.area_code,
-            number=phobj.number,
-            extension=phobj.extension
-        )
+        return cls.objects.filter(phone_key=cls.make_key(*phobj.key))
 
     def create_from_str(self, phone_num):
         nums = re.findall("([0-9]+)", phone_num)
@@ -216,14 +228,17 @@ class Contact(models.Model):
     first_name = models.CharField(max_length=50, null=True)
     middle_name = models.CharField(max_length=50, null=True)
     last_name = models.CharField(max_length=50, null=True)
-    cc_id = models.IntegerField(unique=True)
+    # Both NULL for contacts only HighRise knows about
+    cc_id = models.IntegerField(unique=True, null=True)
     cc_lists = models.ManyToManyField(ConstantContactList,
                                       through=UserStatusOnCCList)
-    cc_modified_date = models.DateTimeField()
+    cc_modified_date = models.DateTimeField(null=True)
+    highrise_id = models.CharField(max_length=20, unique=True, null=True)
     prefix_name = models.CharField(max_length=10, null=True)
     job_title = models.CharField(max_length=50, null=True)
     source = models.CharField(max_length=50, null=True)
     status = models.CharField(max_length=2, choices=STATUS_CHOICES, null=True)
+    fingerprint = models.CharField(max_length=40, null=True)
 
     def __str__(self):
         return "{0}{1}{2}".format(
@@ -232,6 +247,32 @@ class Contact(models.Model):
             self.last_name
         )
 
+    @staticmethod
+    def make_fingerprint(contact):
+        """Hashes a contact's ConstantContact JSON, nested objects and all
+
+        Keys are sorted, and so are lists of nested objects, so only an
+        actual change of the contact yields a different fingerprint, whether
+        or not ConstantContact bumped its `modified_date`.
+
+        :param contact: (dict) ConstantContact contact JSON
+        :return: (str) Hex SHA-1 of the normalized JSON
+        """
+        def normalize(val):
+            if isinstance(val, dict):
+                return {k: normalize(v) for k, v in val.items()}
+            if isinstance(val, list):
+                return sorted(
+                    (normalize(v) for v in val),
+                    key=lambda v: json.dumps(v, sort_keys=True, default=str)
+                )
+            return val
+        dump = json.dumps(
+            normalize(contact), sort_keys=True, separators=(',', ':'),
+            default=str
+        )
+        return hashlib.sha1(dump.encode('utf-8')).hexdigest()
+
     @staticmethod
     def convert_status_str_to_code(statstr):
         for code, stat in STATUS_CHOICES:
@@ -241,6 +282,15 @@ class Contact(models.Model):
                 return code
 
 
+class HighRiseProfile(models.Model):
+    contact = models.OneToOneField(Contact, related_name='highrise_profile')
+    tags = JSONField(default=list)
+    background = models.TextField(null=True)
+
+    def __str__(self):
+        return f"{self.contact.highrise_id}"
+
+
 class RequiringRemediation(models.Model):
     contact_pk = models.ForeignKey(Contact)
     fields = JSONField()
@@ -0,0 +1,117 @@
+from collections import OrderedDict
+import threading
+
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .bulk_sql import insert_ignoring_conflicts
+from .models import Phone
+
+DEFAULT_MAX_PHONES = 100000
+
+
+class PhoneCache():
+    def __init__(self, maxsize=DEFAULT_MAX_PHONES):
+        """Bounded LRU map of normalized phone keys to Phone primary keys
+
+        Keys are `Phone.phone_key` strings, built from (area_code, number,
+        extension) with `Phone.make_key`. Only phones whose rows are known
+        to be committed are cached (new ones are added through
+        `transaction.on_commit`), so a rolled back insert can never leave a
+        dangling primary key behind.
+
+        :param maxsize: (int) Most phones held before the least recently
+            used is evicted
+        """
+        self.maxsize = maxsize
+        self._pks = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, phone_key):
+        with self._lock:
+            pk = self._pks.get(phone_key)
+            if pk is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._pks.move_to_end(phone_key)
+            return pk
+
+    def put(self, phone_key, pk):
+        with self._lock:
+            self._pks[phone_key] = pk
+            self._pks.move_to_end(phone_key)
+            while len(self._pks) > self.maxsize:
+                self._pks.popitem(last=False)
+
+    def put_on_commit(self, pks):
+        """Caches `pks` (dict of phone_key -> pk) once the current
+        transaction commits; immediately if there is none"""
+        def put_all():
+            for phone_key, pk in pks.items():
+                self.put(phone_key, pk)
+        transaction.on_commit(put_all)
+
+    def evict(self, phone_key):
+        with self._lock:
+            self._pks.pop(phone_key, None)
+
+    def clear(self):
+        with self._lock:
+            self._pks.clear()
+
+    def __len__(self):
+        return len(self._pks)
+
+    def pks_for(self, keys):
+        """Returns the Phone pk for each key, inserting any missing phones
+
+        Cached keys cost nothing; the rest are inserted in bulk with
+        conflict-ignore semantics (so concurrent combines can't duplicate a
+        phone) and then read back with one query.
+
+        :param keys: (iterable of tuple) (area_code, number, extension)
+        :return: (dict) (area_code, number, extension) -> Phone pk
+        """
+        by_phone_key = {}
+        for key in keys:
+            by_phone_key.setdefault(Phone.make_key(*key), []).append(key)
+
+        found = {}
+        missing = []
+        for phone_key, (key, *_) in by_phone_key.items():
+            pk = self.get(phone_key)
+            if pk is None:
+                missing.append(Phone(
+                    area_code=key[0], number=key[1], extension=key[2],
+                    phone_key=phone_key
+                ))
+            else:
+                found[phone_key] = pk
+        if missing:
+            # Always in the same order, so concurrent combines inserting
+            # overlapping phones can't deadlock each other
+            missing.sort(key=lambda ph: ph.phone_key)
+            insert_ignoring_conflicts(Phone, missing, ['phone_key'])
+            in_db = dict(
+                Phone.objects.filter(
+                    phone_key__in=[ph.phone_key for ph in missing]
+                ).values_list('phone_key', 'pk')
+            )
+            self.put_on_commit(in_db)
+            found.update(in_db)
+        return {
+            key: found[phone_key]
+            for phone_key, same in by_phone_key.items() for key in same
+        }
+
+
+# Process-wide, shared by every DataCombine
+PHONE_CACHE = PhoneCache()
+
+
+@receiver(post_delete, sender=Phone)
+def _evict_deleted_phone(sender, instance, **kwargs):
+    PHONE_CACHE.evict(instance.phone_key)
@@ -0,0 +1,123 @@
+from collections import Counter
+import time
+
+from .utils import updt
+
+# Outcomes counted for every contact combined; see `DataCombine.counts`
+STAGES = ('inserted', 'updated', 'skipped', 'remediated', 'errored')
+DEFAULT_MIN_INTERVAL = 1.0
+
+
+class ProgressReporter():
+    def __init__(self, total=None, sink=None,
+                 min_interval=DEFAULT_MIN_INTERVAL, min_count=None,
+                 counts=None, clock=time.monotonic):
+        """Throttled, aggregated progress of a long running combine
+
+        Work is reported with `advance`, but a progress payload is only
+        produced (and handed to `sink`) once `min_interval` seconds or
+        `min_count` contacts have passed since the last one, and when the
+        work is finished. Redrawing a progress bar or writing a Celery state
+        for every single contact costs more than the contact itself.
+
+        :param total: (int) Number of contacts expected, if known
+        :param sink: (callable) Called with every payload produced, e.g. a
+            `ConsoleSink` or `CelerySink`
+        :param min_interval: (float) Least seconds between two payloads
+        :param min_count: (int) Contacts after which a payload is due, however
+            little time has passed. If None, only `min_interval` counts.
+        :param counts: (Counter) Per-stage counters to include (see `STAGES`);
+            read, never written, by the reporter
+        :param clock: (callable) Monotonic time source, in seconds
+        """
+        self.total = total
+        self.sink = sink
+        self.min_interval = min_interval
+        self.min_count = min_count
+        self.counts = counts if counts is not None else Counter()
+        self._clock = clock
+        self.processed = 0
+        self._start = clock()
+        self._last_time = self._start
+        self._last_processed = 0
+
+    def _due(self):
+        if self.total is not None and self.processed >= self.total:
+            return True
+        if self.min_count is not None\
+                and self.processed - self._last_processed >= self.min_count:
+            return True
+        return self._clock() - self._last_time >= self.min_interval
+
+    def advance(self, n=1):
+        """Records `n` more contacts done
+
+        :param n: (int) Contacts finished since the last call
+        :return: (dict) The payload, if one was due, otherwise None
+        """
+        self.processed += n
+        if self._due():
+            return self.report()
+        return None
+
+    def report(self):
+        """Produces a payload now, whether or not one is due
+
+        :return: (dict) See `payload`
+        """
+        payload = self.payload()
+        self._last_time = self._clock()
+        self._last_processed = self.processed
+        if self.sink is not None:
+            self.sink(payload)
+        return payload
+
+    def payload(self):
+        """Returns the current progress
+
+        :return: (dict) 'processed', 'total', 'process_percent',
+            'elapsed_seconds', 'contacts_per_second', 'eta_seconds' (None
+            while unknown) and one count per stage in `STAGES`
+        """
+        elapsed = self._clock() - self._start
+        rate = self.processed / elapsed if elapsed > 0 else None
+        eta = percent = None
+        if self.total:
+            percent = round((self.processed / self.total) * 100)
+            if rate:
+                eta = max(0, self.total - self.processed) / rate
+        payload = {
+            'processed': self.processed,
+            'total': self.total,
+            'process_percent': percent,
+            'elapsed_seconds': elapsed,
+            'contacts_per_second': rate,
+            'eta_seconds': eta,
+        }
+        payload.update((stage, self.counts[stage]) for stage in STAGES)
+        return payload
+
+
+class ConsoleSink():
+    """Draws progress payloads as a console progress bar (see `utils.updt`)"""
+    def __call__(self, payload):
+        if payload['total']:
+            updt(payload['total'], payload['processed'])
+
+
+class CelerySink():
+    def __init__(self, task, context=None, state='PROGRESS'):
+        """Publishes progress payloads as the state of a Celery task
+
+        :param task: Bound Celery task whose state is updated
+        :param context: (dict) Extra meta sent with every payload, which the
+            payload's keys are merged into
+        :param state: (str) Celery state to report
+        """
+        self.task = task
+        self.context = context if context is not None else dict()
+        self.state = state
+
+    def __call__(self, payload):
+        self.context.update(payload)
+        self.task.update_state(state=self.state, meta=self.context)
@@ -0,0 +1,237 @@
+from bisect import bisect_left
+import json
+import mmap
+import os
+import struct
+import zlib
+
+from .snapshots import CONTACT, RECORD_KINDS
+
+STORE_FORMAT = 'datacombine-store'
+STORE_VERSION = 1
+STORE_MAGIC = b'DCSTORE1\n'
+INDEX_SUFFIX = '.idx'
+# Offset and length of a record's blob, after its fixed-width key
+_LOCATION = struct.Struct('>QI')
+
+
+def _index_key(kind, cc_id):
+    return f"{kind}\t{cc_id}".encode('utf-8')
+
+
+class _SortedKeys():
+    # Sequence view of the keys in an index, for `bisect`
+    def __init__(self, index_map, start, key_width, count):
+        self._map = index_map
+        self._start = start
+        self.width = key_width
+        self._step = key_width + _LOCATION.size
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        pos = self._start + i * self._step
+        return self._map[pos:pos + self.width]
+
+    def location(self, i):
+        return _LOCATION.unpack_from(
+            self._map, self._start + i * self._step + self.width
+        )
+
+
+class SnapshotStore():
+    def __init__(self, path, fernet=None):
+        """Read-only snapshot with random access to its records by id
+
+        The data file at `path` holds every record as its own zlib-compressed
+        (and, if written with a key, Fernet-encrypted) JSON blob, one after
+        the other. The sidecar `<path>.idx` maps each record's kind and id to
+        the offset and length of its blob: after a JSON header line, it is an
+        array of fixed-width (key, offset, length) entries sorted by key.
+        Both files are `mmap`ed and an id is found by bisecting the index, so
+        opening the store costs the same however big it is, and fetching a
+        record reads and decodes that record only. See `write`.
+
+        :param path: (str) Path of the data file
+        :param fernet: (`Fernet`) Decrypts records, if the store is encrypted
+        """
+        self.path = path
+        self.index_path = f"{path}{INDEX_SUFFIX}"
+        self._fernet = fernet
+        self._files = []
+        try:
+            self._index_map = self._map_file(self.index_path)
+            header_end = self._index_map.find(b'\n') + 1
+            try:
+                header = json.loads(self._index_map[:header_end].decode())
+            except ValueError:
+                header = None
+            if not isinstance(header, dict)\
+                    or header.get('format') != STORE_FORMAT:
+                raise ValueError(f"'{self.index_path}' is not a store index")
+            if header.get('version', 0) > STORE_VERSION:
+                raise ValueError(
+                    f"'{self.index_path}' is a version {header['version']} "
+                    f"index; only up to version {STORE_VERSION} can be read"
+                )
+            self.encrypted = header.get('encrypted', False)
+            if self.encrypted and fernet is None:
+                raise ValueError(
+                    f"'{path}' is encrypted; a snapshot key is needed to "
+                    "read it"
+                )
+            self._counts = header['counts']
+            self._keys = _SortedKeys(
+                self._index_map, header_end, header['key_width'],
+                sum(self._counts.values())
+            )
+
+            self._map = self._map_file(path)
+            # The data file and index are swapped in one after the other;
+            # catch a pair that doesn't belong together
+            if len(self._map) != header['data_size']:
+                raise ValueError(
+                    f"'{self.index_path}' doesn't match '{path}'; rewrite "
+                    "the store"
+                )
+        except BaseException:
+            self.close()
+            raise
+
+    def _map_file(self, path):
+        f = open(path, 'rb')
+        self._files.append(f)
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def write(cls, path, records, fernet=None):
+        """Writes records to a store at `path` and its index
+
+        Both files are written beside their final names and moved into
+        place once `records` is exhausted. If an id appears twice for the
+        same kind, the index points to the last record.
+
+        :param path: (str) Path of the data file
+        :param records: (iterable of (kind, dict)) See `snapshots.iter_records`
+        :param fernet: (`Fernet`) If given, each record is encrypted
+        :return: (int) Number of records written
+        """
+        tmp_data = f"{path}.tmp"
+        tmp_index = f"{path}{INDEX_SUFFIX}.tmp"
+        entries = dict()
+        written = 0
+        try:
+            with open(tmp_data, 'wb') as f:
+                f.write(STORE_MAGIC)
+                offset = len(STORE_MAGIC)
+                for kind, obj in records:
+                    cc_id = str(obj['id'])
+                    if kind not in RECORD_KINDS:
+                        raise ValueError(f"Unknown store record type '{kind}'")
+                    if '\0' in cc_id:
+                        raise ValueError(f"Can't index the id {cc_id!r}")
+                    blob = zlib.compress(json.dumps(obj).encode('utf-8'))
+                    if fernet is not None:
+                        blob = fernet.encrypt(blob)
+                    f.write(blob)
+                    entries[_index_key(kind, cc_id)] = (
+                        kind, offset, len(blob)
+                    )
+                    offset += len(blob)
+                    written += 1
+            # Keys are padded with NULs, which sort before anything else
+            key_width = max(map(len, entries), default=0)
+            counts = {kind: 0 for kind in RECORD_KINDS}
+            for kind, _, _ in entries.values():
+                counts[kind] += 1
+            with open(tmp_index, 'wb') as f:
+                f.write(json.dumps({
+                    'format': STORE_FORMAT,
+                    'version': STORE_VERSION,
+                    'encrypted': fernet is not None,
+                    'data_size': offset,
+                    'key_width': key_width,
+                    'counts': counts
+                }).encode('utf-8') + b'\n')
+                for key in sorted(entries):
+                    _, blob_offset, length = entries[key]
+                    f.write(key.ljust(key_width, b'\0'))
+                    f.write(_LOCATION.pack(blob_offset, length))
+            os.replace(tmp_data, path)
+            os.replace(tmp_index, f"{path}{INDEX_SUFFIX}")
+        finally:
+            for tmp in (tmp_data, tmp_index):
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        return written
+
+    def close(self):
+        for name in ('_map', '_index_map'):
+            if hasattr(self, name):
+                getattr(self, name).close()
+        for f in self._files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _find(self, cc_id, kind):
+        # Position of the record in the index, or None
+        key = _index_key(kind, cc_id).ljust(self._keys.width, b'\0')
+        if len(key) > self._keys.width:
+            return None
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return i
+        return None
+
+    def __len__(self):
+        return self._counts[CONTACT]
+
+    def __contains__(self, cc_id):
+        return self._find(str(cc_id), CONTACT) is not None
+
+    def ids(self, kind=CONTACT):
+        """Yields the ids of every record of `kind`, sorted as strings"""
+        prefix = _index_key(kind, '')
+        i = bisect_left(self._keys, prefix)
+        while i < len(self._keys) and self._keys[i].startswith(prefix):
+            yield self._keys[i][len(prefix):].rstrip(b'\0').decode('utf-8')
+            i += 1
+
+    def get(self, cc_id, kind=CONTACT):
+        """Returns one record
+
+        :param cc_id: (str / int) ConstantContact id of the record
+        :param kind: (str) One of `snapshots.RECORD_KINDS`
+        :return: (dict) The record, as it was written
+        :raises KeyError: If the store has no such record
+        """
+        i = self._find(str(cc_id), kind)
+        if i is None:
+            raise KeyError(cc_id)
+        offset, length = self._keys.location(i)
+        blob = self._map[offset:offset + length]
+        if self.encrypted:
+            blob = self._fernet.decrypt(blob)
+        return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+    def get_many(self, cc_ids, kind=CONTACT):
+        """Returns the records found among `cc_ids`, in the order given
+
+        :param cc_ids: (iterable of str / int) ConstantContact ids
+        :param kind: (str) One of `snapshots.RECORD_KINDS`
+        :return: (list of dict) The records; ids not in the store are skipped
+        """
+        records = []
+        for cc_id in cc_ids:
+            try:
+                records.append(self.get(cc_id, kind))
+            except KeyError:
+                continue
+        return records
@@ -0,0 +1,610 @@
+import ciso8601
+from contextlib import contextmanager
+import datetime
+import gzip
+import io
+import json
+import os
+import struct
+import tempfile
+import time
+
+from cryptography.fernet import Fernet
+
+SNAPSHOT_FORMAT = 'datacombine-snapshot'
+SNAPSHOT_VERSION = 1
+GZIP_MAGIC = b'\x1f\x8b'
+ENCRYPTED_MAGIC = b'DCSNAPENC1\n'
+DEFAULT_ENCRYPTION_CHUNK_SIZE = 1 << 18
+# Each encrypted chunk's plaintext starts with its index and a last-chunk
+# flag, so chunks that are dropped, reordered or appended are caught
+_CHUNK_HEADER = struct.Struct('>QB')
+_TOKEN_LENGTH = struct.Struct('>I')
+
+CCLIST = 'cclist'
+CONTACT = 'contact'
+BAD_PHONE_NUMS = 'bad_phone_nums'
+BAD_M2M = 'bad_m2m'
+RECORD_KINDS = (CCLIST, CONTACT, BAD_PHONE_NUMS, BAD_M2M)
+
+KEEP_NEWEST = 'newest'
+KEEP_LOCAL = 'local'
+KEEP_INCOMING = 'incoming'
+MERGE_POLICIES = (KEEP_NEWEST, KEEP_LOCAL, KEEP_INCOMING)
+
+
+def _modified(obj):
+    try:
+        return ciso8601.parse_datetime(obj['modified_date'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _incoming_wins(local, incoming, policy):
+    if policy == KEEP_INCOMING:
+        return True
+    if policy == KEEP_LOCAL:
+        return False
+    local_date, incoming_date = _modified(local), _modified(incoming)
+    # Ties, and objects without a usable date, stay as they are
+    return local_date is not None and incoming_date is not None\
+        and incoming_date > local_date
+
+
+def merge_objects(local, incoming, policy=KEEP_LOCAL):
+    """Merges two lists of ConstantContact objects (contacts or lists) by id
+
+    Runs in O(len(local) + len(incoming)): `local` is indexed by id once, and
+    every incoming object is then a dict lookup. The result keeps the order
+    of `local`, with the incoming objects it didn't have appended in their
+    own order.
+
+    :param local: (list of dict) Objects already held
+    :param incoming: (iterable of dict) Objects to merge in
+    :param policy: (str) Which object is kept when both have the same id:
+        `KEEP_NEWEST` (the later `modified_date`, or the local one on a tie),
+        `KEEP_LOCAL` or `KEEP_INCOMING`
+    :return: (list of dict) The merged objects
+    """
+    if policy not in MERGE_POLICIES:
+        raise ValueError(
+            f"Unknown merge policy '{policy}', use one of {MERGE_POLICIES}"
+        )
+    merged = list(local)
+    positions = {obj.get('id'): i for i, obj in enumerate(merged)}
+    for obj in incoming:
+        i = positions.get(obj.get('id'))
+        if i is None:
+            positions[obj.get('id')] = len(merged)
+            merged.append(obj)
+        elif _incoming_wins(merged[i], obj, policy):
+            merged[i] = obj
+    return merged
+
+
+def iter_records(contacts=(), cclists=(), bad_phone_nums=None, bad_m2m=None):
+    """Yields the records of a snapshot, lists first
+
+    Lists come before contacts so that a reader can combine them before any
+    contact that belongs to them. Each remediation record holds the entries
+    for one contact: {'id': cc_id, 'entries': [...]}.
+
+    :param contacts: (iterable of dict) ConstantContact contacts
+    :param cclists: (iterable of dict) ConstantContact lists
+    :param bad_phone_nums: (dict) cc_id -> entries, as in
+        `DataCombine.bad_phone_nums`
+    :param bad_m2m: (dict) cc_id -> entries, as in `DataCombine.bad_m2m`
+    :return: Generator of (kind, dict) tuples
+    """
+    for cclist in cclists:
+        yield CCLIST, cclist
+    for contact in contacts:
+        yield CONTACT, contact
+    for kind, remed in ((BAD_PHONE_NUMS, bad_phone_nums), (BAD_M2M, bad_m2m)):
+        for cc_id, entries in (remed or dict()).items():
+            yield kind, {'id': cc_id, 'entries': entries}
+
+
+class _EncryptedWriter():
+    def __init__(self, raw, fernet, chunk_size=DEFAULT_ENCRYPTION_CHUNK_SIZE):
+        """Binary sink that encrypts what's written to it in fixed-size chunks
+
+        Every `chunk_size` bytes become one Fernet token, written to `raw`
+        after its length, so no more than one chunk is held in memory. The
+        final (possibly short, possibly empty) chunk is written on `close`.
+
+        :param raw: Binary file to write the tokens to
+        :param fernet: (`Fernet`) Encrypts each chunk
+        :param chunk_size: (int) Plaintext bytes per chunk
+        """
+        self._raw = raw
+        self._fernet = fernet
+        self._chunk_size = chunk_size
+        self._buf = bytearray()
+        self._index = 0
+        raw.write(ENCRYPTED_MAGIC)
+
+    def _write_chunk(self, data, last):
+        token = self._fernet.encrypt(
+            _CHUNK_HEADER.pack(self._index, last) + data
+        )
+        self._raw.write(_TOKEN_LENGTH.pack(len(token)))
+        self._raw.write(token)
+        self._index += 1
+
+    def write(self, data):
+        self._buf.extend(data)
+        # Strictly more than a chunk, so that `close` always has one to mark
+        # as the last
+        while len(self._buf) > self._chunk_size:
+            self._write_chunk(bytes(self._buf[:self._chunk_size]), False)
+            del self._buf[:self._chunk_size]
+        return len(data)
+
+    def flush(self):
+        # A chunk can't be written before it's full
+        pass
+
+    def close(self):
+        self._write_chunk(bytes(self._buf), True)
+        self._buf = bytearray()
+
+
+class _DecryptedReader():
+    def __init__(self, raw, fernet):
+        """Binary source that decrypts an `_EncryptedWriter`'s chunks as they
+        are read
+
+        :param raw: Binary file positioned just after `ENCRYPTED_MAGIC`
+        :param fernet: (`Fernet`) Decrypts each chunk; a wrong key or a
+            tampered chunk raises `cryptography.fernet.InvalidToken`
+        """
+        self._raw = raw
+        self._fernet = fernet
+        self._buf = b''
+        self._pos = 0
+        self._index = 0
+        self._done = False
+
+    def _read_chunk(self):
+        length = self._raw.read(_TOKEN_LENGTH.size)
+        if not length and self._done:
+            return False
+        elif self._done:
+            raise ValueError(
+                "Encrypted snapshot has data after its last chunk"
+            )
+        elif len(length) < _TOKEN_LENGTH.size:
+            raise ValueError("Encrypted snapshot is truncated")
+        plain = self._fernet.decrypt(
+            self._raw.read(_TOKEN_LENGTH.unpack(length)[0])
+        )
+        index, last = _CHUNK_HEADER.unpack_from(plain)
+        if index != self._index:
+            raise ValueError(
+                f"Encrypted snapshot chunk {index} found where chunk "
+                f"{self._index} was expected"
+            )
+        self._index += 1
+        self._done = bool(last)
+        self._buf = plain[_CHUNK_HEADER.size:]
+        self._pos = 0
+        return True
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self._pos >= len(self._buf):
+                if not self._read_chunk():
+                    break
+                continue
+            end = len(self._buf) if size < 0\
+                else min(len(self._buf), self._pos + size)
+            parts.append(self._buf[self._pos:end])
+            if size > 0:
+                size -= end - self._pos
+            self._pos = end
+        return b''.join(parts)
+
+
+def is_encrypted(path):
+    """Whether the file at `path` is an encrypted snapshot"""
+    with open(path, 'rb') as f:
+        return f.read(len(ENCRYPTED_MAGIC)) == ENCRYPTED_MAGIC
+
+
+@contextmanager
+def _open_snapshot_for_write(path, fernet, chunk_size):
+    with open(path, 'wb') as raw:
+        sink = raw if fernet is None\
+            else _EncryptedWriter(raw, fernet, chunk_size)
+        with gzip.GzipFile(fileobj=sink, mode='wb') as gz,\
+                io.TextIOWrapper(gz, encoding='utf-8') as f:
+            yield f
+        if fernet is not None:
+            sink.close()
+
+
+@contextmanager
+def _open_snapshot_for_read(path, fernet):
+    with open(path, 'rb') as raw:
+        if raw.read(len(ENCRYPTED_MAGIC)) == ENCRYPTED_MAGIC:
+            if fernet is None:
+                raise ValueError(
+                    f"'{path}' is encrypted; a snapshot key is needed to "
+                    "read it"
+                )
+            source = _DecryptedReader(raw, fernet)
+        else:
+            raw.seek(0)
+            source = raw
+        with gzip.GzipFile(fileobj=source, mode='rb') as gz,\
+                io.TextIOWrapper(gz, encoding='utf-8') as f:
+            yield f
+
+
+def _snapshot_header():
+    return {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'created': datetime.datetime.utcnow().isoformat() + 'Z'
+    }
+
+
+def iter_write_snapshot(path, records, fernet=None,
+                        chunk_size=DEFAULT_ENCRYPTION_CHUNK_SIZE):
+    """Writes records to a snapshot at `path`, passing each one through
+
+    A snapshot is gzip-compressed JSON Lines: a header line, then one
+    {"type": kind, "data": obj} line per record. Records are written as they
+    are drawn from `records`, so a harvest can be dumped while it is being
+    combined, and no more than one record is ever held here. The file is
+    written beside `path` and only moved into place once `records` is
+    exhausted; closing this generator early leaves `path` untouched.
+
+    With `fernet`, the compressed stream is encrypted `chunk_size` bytes at
+    a time, each chunk its own Fernet token, so encrypting never needs more
+    than one chunk in memory either.
+
+    :param path: (str) Path of the snapshot
+    :param records: (iterable of (kind, dict)) See `iter_records`
+    :param fernet: (`Fernet`) If given, encrypts the snapshot
+    :param chunk_size: (int) Plaintext bytes per encrypted chunk
+    :return: Generator of the (kind, dict) records written
+    """
+    tmpname = f"{path}.tmp"
+    try:
+        with _open_snapshot_for_write(tmpname, fernet, chunk_size) as f:
+            f.write(json.dumps(_snapshot_header()) + '\n')
+            for kind, obj in records:
+                if kind not in RECORD_KINDS:
+                    raise ValueError(f"Unknown snapshot record type '{kind}'")
+                f.write(json.dumps({'type': kind, 'data': obj}) + '\n')
+                yield kind, obj
+        os.replace(tmpname, path)
+    finally:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+
+
+def write_snapshot(path, records, fernet=None,
+                   chunk_size=DEFAULT_ENCRYPTION_CHUNK_SIZE):
+    """Writes records to a snapshot at `path`; see `iter_write_snapshot`
+
+    :return: (int) Number of records written
+    """
+    return sum(1 for _ in iter_write_snapshot(
+        path, records, fernet, chunk_size
+    ))
+
+
+def is_snapshot(path):
+    """Whether the file at `path` is a JSON Lines snapshot, encrypted or not
+    (rather than a legacy single-JSON dump)"""
+    with open(path, 'rb') as f:
+        start = f.read(len(ENCRYPTED_MAGIC))
+    return start.startswith(GZIP_MAGIC) or start == ENCRYPTED_MAGIC
+
+
+def _read_legacy(path):
+    # The old format is one JSON document, so it can't be streamed
+    with open(path, 'r') as f:
+        data = json.load(f)
+    remed = data.get('to_remidate') or dict()
+    yield from iter_records(
+        data.get('contacts', []), data.get('cclists', []),
+        remed.get('bad_phone_nums'), remed.get('bad_m2m')
+    )
+
+
+def read_snapshot(path, fernet=None):
+    """Yields the records of the snapshot at `path`, one line at a time
+
+    Legacy single-JSON dumps (see
+    `DataCombine.dump_constantcontact_objects_from_json`) are read too, as
+    the same records, although they have to be loaded whole first.
+
+    :param path: (str) Path of the snapshot
+    :param fernet: (`Fernet`) Decrypts the snapshot, a chunk at a time, if
+        it is encrypted
+    :return: Generator of (kind, dict) tuples
+    """
+    if not is_snapshot(path):
+        yield from _read_legacy(path)
+        return
+    with _open_snapshot_for_read(path, fernet) as f:
+        header = json.loads(f.readline() or 'null')
+        if not isinstance(header, dict)\
+                or header.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(f"'{path}' is not a datacombine snapshot")
+        if header.get('version', 0) > SNAPSHOT_VERSION:
+            raise ValueError(
+                f"'{path}' is a version {header['version']} snapshot; only "
+                f"up to version {SNAPSHOT_VERSION} can be read"
+            )
+        for line in f:
+            record = json.loads(line)
+            yield record['type'], record['data']
+
+
+def benchmark_merge(sizes=(10000, 20000, 40000, 80000), policy=KEEP_NEWEST,
+                    clock=time.perf_counter):
+    """Times `merge_objects` on snapshots of growing size
+
+    Each run merges `size` incoming contacts, half of them already held, into
+    `size` local ones. With a linear merge the seconds per contact stay flat
+    as `size` grows.
+
+    :param sizes: (iterable of int) Contacts per side of each run
+    :param policy: (str) Merge policy used
+    :param clock: (callable) Time source, in seconds
+    :return: (list of dict) 'size', 'seconds' and 'seconds_per_contact' for
+        each run
+    """
+    results = []
+    for size in sizes:
+        local = [
+            {'id': str(i), 'modified_date': '2017-01-01T00:00:00.000Z'}
+            for i in range(size)
+        ]
+        incoming = [
+            {'id': str(i), 'modified_date': '2018-01-01T00:00:00.000Z'}
+            for i in range(size // 2, size + size // 2)
+        ]
+        start = clock()
+        merge_objects(local, incoming, policy)
+        seconds = clock() - start
+        results.append({
+            'size': size,
+            'seconds': seconds,
+            'seconds_per_contact': seconds / size
+        })
+    return results
+
+
+def _supersedes(old, new):
+    # A later record replaces an earlier one with the same id, unless both
+    # are dated and it is older
+    old_date, new_date = _modified(old), _modified(new)
+    return old_date is None or new_date is None or new_date >= old_date
+
+
+class SnapshotChain():
+    def __init__(self, manifest, fernet=None):
+        """A base snapshot and the delta snapshots harvested since
+
+        The manifest at `manifest` (JSON) names the base and, in order, each
+        delta with the `modified_since` its harvest started from. Snapshot
+        files live beside the manifest and are named after it. Deltas hold
+        only what was harvested since, so adding one costs no more than the
+        harvest itself; `read` gives the latest state and `compact` folds
+        the deltas into a new base.
+
+        :param manifest: (str) Path of the manifest; it needn't exist yet
+        :param fernet: (`Fernet`) Encrypts the snapshots written, and
+            decrypts those read (see `iter_write_snapshot`)
+        """
+        self.manifest = manifest
+        self.fernet = fernet
+        self.directory = os.path.dirname(os.path.abspath(manifest))
+        stem = os.path.basename(manifest)
+        self._stem = stem[:-len('.json')] if stem.endswith('.json') else stem
+        try:
+            with open(manifest, 'r', encoding='utf-8') as f:
+                self._state = json.load(f)
+        except FileNotFoundError:
+            self._state = {'base': None, 'deltas': [], 'generation': 0}
+
+    @property
+    def base(self):
+        """(str) Path of the base snapshot, or None"""
+        base = self._state['base']
+        return os.path.join(self.directory, base) if base else None
+
+    @property
+    def deltas(self):
+        """(list of dict) 'path' and 'modified_since' of each delta, oldest
+        first"""
+        return [
+            dict(delta, path=os.path.join(self.directory, delta['path']))
+            for delta in self._state['deltas']
+        ]
+
+    def _new_file(self, role):
+        self._state['generation'] += 1
+        return f"{self._stem}.{role}-{self._state['generation']}.jsonl.gz"
+
+    def _save(self):
+        tmpname = f"{self.manifest}.tmp"
+        with open(tmpname, 'w', encoding='utf-8') as f:
+            json.dump(self._state, f, indent=2)
+        os.replace(tmpname, self.manifest)
+
+    def _remove(self, names):
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def write_base(self, records):
+        """Replaces the whole chain with a new base snapshot
+
+        :param records: (iterable of (kind, dict)) See `iter_records`
+        :return: (int) Number of records written
+        """
+        name = self._new_file('base')
+        written = write_snapshot(
+            os.path.join(self.directory, name), records, self.fernet
+        )
+        stale = [self._state['base']] if self._state['base'] else []
+        stale += [delta['path'] for delta in self._state['deltas']]
+        self._state.update(base=name, deltas=[])
+        # Only once the manifest no longer names them
+        self._save()
+        self._remove(stale)
+        return written
+
+    def append_delta(self, records, modified_since=None):
+        """Adds a delta snapshot on top of the chain
+
+        The first snapshot of a chain becomes its base instead.
+
+        :param records: (iterable of (kind, dict)) The lists, contacts and
+            remediation entries harvested since `modified_since`
+        :param modified_since: (str) ISO-8601 start of the harvest
+        :return: (int) Number of records written
+        """
+        if self._state['base'] is None:
+            return self.write_base(records)
+        name = self._new_file('delta')
+        written = write_snapshot(
+            os.path.join(self.directory, name), records, self.fernet
+        )
+        self._state['deltas'].append(
+            {'path': name, 'modified_since': modified_since}
+        )
+        self._save()
+        return written
+
+    def read(self):
+        """Yields the latest record for every id, base and deltas merged
+
+        The deltas are read first, keeping the newest record per kind and id
+        by `modified_date` (or the later one, for undated records), and
+        the base is then streamed once. Each base record is replaced by any
+        newer delta record with the same id. Delta records the base lacks
+        follow the base records of their kind, so lists still come first.
+        Only the deltas are held in memory.
+
+        :return: Generator of (kind, dict) tuples
+        """
+        latest = {kind: dict() for kind in RECORD_KINDS}
+        for delta in self.deltas:
+            for kind, obj in read_snapshot(delta['path'], self.fernet):
+                held = latest[kind].get(obj.get('id'))
+                if held is None or _supersedes(held, obj):
+                    latest[kind][obj.get('id')] = obj
+
+        def unseen(kinds):
+            for kind in kinds:
+                for obj in latest[kind].values():
+                    yield kind, obj
+                latest[kind] = dict()
+
+        flushed = 0
+        if self.base is not None:
+            for kind, obj in read_snapshot(self.base, self.fernet):
+                # Kinds come in `RECORD_KINDS` order; once one is over, its
+                # new records go out before the next kind's
+                position = RECORD_KINDS.index(kind)
+                if position > flushed:
+                    yield from unseen(RECORD_KINDS[flushed:position])
+                    flushed = position
+                newer = latest[kind].pop(obj.get('id'), None)
+                if newer is not None and _supersedes(obj, newer):
+                    obj = newer
+                yield kind, obj
+        yield from unseen(RECORD_KINDS[flushed:])
+
+    def compact(self):
+        """Folds the deltas into a new base snapshot, and removes the old
+        files
+
+        :return: (int) Number of records in the new base, or None if there
+            were no deltas to fold
+        """
+        if not self._state['deltas']:
+            return None
+        name = self._new_file('base')
+        written = write_snapshot(
+            os.path.join(self.directory, name), self.read(), self.fernet
+        )
+        stale = [self._state['base']]
+        stale += [delta['path'] for delta in self._state['deltas']]
+        self._state.update(base=name, deltas=[])
+        self._save()
+        self._remove(stale)
+        return written
+
+
+def _benchmark_contact(n):
+    return {
+        'id': str(n),
+        'first_name': f"First{n}",
+        'last_name': f"Last{n}",
+        'status': 'ACTIVE',
+        'modified_date': '2017-01-01T00:00:00.000Z',
+        'email_addresses': [{
+            'id': f"{n:032x}",
+            'email_address': f"contact{n}@example.org",
+            'status': 'ACTIVE'
+        }],
+        'notes': [{'id': f"{n:032d}", 'note': 'lorem ipsum ' * 8}],
+    }
+
+
+def benchmark_snapshot_read(size=20000, fernet=None, clock=time.perf_counter):
+    """Times reading a snapshot of `size` contacts, plaintext and encrypted
+
+    :param size: (int) Contacts in each snapshot
+    :param fernet: (`Fernet`) Key to encrypt with; a new one by default
+    :param clock: (callable) Time source, in seconds
+    :return: (dict) 'plaintext' and 'encrypted', each a dict of 'bytes',
+        'seconds' and 'records_per_second', and 'slowdown', the encrypted
+        read time over the plaintext one
+    """
+    fernet = fernet or Fernet(Fernet.generate_key())
+    results = dict()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, key in (('plaintext', None), ('encrypted', fernet)):
+            path = os.path.join(tmpdir, f"{name}.jsonl.gz")
+            write_snapshot(path, iter_records(
+                _benchmark_contact(n) for n in range(size)
+            ), key)
+            start = clock()
+            read = sum(1 for _ in read_snapshot(path, key))
+            seconds = clock() - start
+            results[name] = {
+                'bytes': os.path.getsize(path),
+                'seconds': seconds,
+                'records_per_second': read / seconds if seconds else None
+            }
+    results['slowdown'] = results['encrypted']['seconds']\
+        / results['plaintext']['seconds']
+    return results
+
+
+if __name__ == '__main__':
+    for result in benchmark_merge():
+        print(
+            f"{result['size']:>8} contacts: {result['seconds']:.4f}s "
+            f"({result['seconds_per_contact'] * 1e6:.2f}us per contact)"
+        )
+    reads = benchmark_snapshot_read()
+    for name in ('plaintext', 'encrypted'):
+        print(
+            f"{name:>9} read: {reads[name]['seconds']:.4f}s, "
+            f"{reads[name]['bytes']} bytes, "
+            f"{reads[name]['records_per_second']:.0f} records/s"
+        )
+    print(f"Encrypted reads take {reads['slowdown']:.2f}x as long")
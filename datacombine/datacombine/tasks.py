@@ -1,18 +1,32 @@
-from celery import shared_task,current_task
+from celery import chord, shared_task, current_task
+from celery.result import AsyncResult
 
+import datetime
 import json
 import logging
 
+from django.db import connection
+
 from datacombine.data_combine import DataCombine
+from datacombine.models import Contact
+from datacombine.progress import CelerySink, ProgressReporter, STAGES
 from datacombine import settings
 
+# Contacts per `combine_chunk` task, and per bulk batch within one
+COMBINE_CHUNK_SIZE = 2000
+COMBINE_BATCH_SIZE = 250
 
-@shared_task
-def harvest():
+
+def _data_combine():
     if settings.DEBUG:
-        dc = DataCombine(loglvl=logging.DEBUG)
+        return DataCombine(loglvl=logging.DEBUG)
     else:
-        dc = DataCombine()
+        return DataCombine()
+
+
+@shared_task
+def harvest(chunk_size=COMBINE_CHUNK_SIZE):
+    dc = _data_combine()
     context = {
         'harvest_done': 0,
         'process_percent': 0
@@ -22,10 +36,133 @@ def harvest():
     dc.harvest_lists()
     dc.harvest_contacts()
 
+    # Lists go in first, so the chunks never race each other to insert one
+    for cclist in dc.cclists:
+        dc.combine_cclist_json_into_db(cclist)
+
     context['harvest_done'] = 1
-    current_task.update_state(state='PROGRESS', meta=context)
+    context['total'] = len(dc.contacts)
 
-    for prg in dc.combine_contacts_into_db(update_web_interface=True):
-        context['process_percent'] = round((prg['processed'] / prg['total']) * 100)
+    # First run: COPY everything into the empty DB from this one task
+    if connection.vendor == 'postgresql' and not Contact.objects.exists():
         current_task.update_state(state='PROGRESS', meta=context)
-    return
+        reporter = ProgressReporter(sink=CelerySink(current_task, context))
+        for _ in dc.initial_load_contacts(reporter=reporter):
+            pass
+        context['process_percent'] = None
+        context['summary'] = dc.load_summary
+        return context
+
+    chunks = [
+        dc.contacts[i:i + chunk_size]
+        for i in range(0, len(dc.contacts), chunk_size)
+    ]
+    if chunks:
+        combined = chord(
+            combine_chunk.s(chunk) for chunk in chunks
+        )(aggregate_combine.s())
+        # The chunk and callback ids let `combine_progress` follow the chord
+        # through this task's id alone
+        context['chunks'] = [r.id for r in combined.parent.results]
+        context['callback'] = combined.id
+    else:
+        context['process_percent'] = None
+    current_task.update_state(state='PROGRESS', meta=context)
+    return context
+
+
+@shared_task(bind=True)
+def combine_chunk(self, contacts, batch_size=COMBINE_BATCH_SIZE):
+    """Combines one chunk of harvested contacts into the local DB
+
+    :param contacts: (list of dict) ConstantContact contact JSON
+    :param batch_size: (int) See `DataCombine.combine_contacts_into_db`
+    :return: (dict) Counts, remediation entries and timing of the chunk
+    """
+    begin_time = datetime.datetime.now()
+    dc = _data_combine()
+    dc.contacts = contacts
+    # Throttled, so the broker sees about one state update a second
+    reporter = ProgressReporter(
+        sink=CelerySink(self) if self.request.id else None
+    )
+    for _ in dc.combine_contacts_into_db(batch_size=batch_size,
+                                         reporter=reporter):
+        pass
+    return {
+        'processed': len(contacts),
+        'total': len(contacts),
+        'seconds': (datetime.datetime.now() - begin_time).total_seconds(),
+        'counts': dict(dc.counts),
+        'bad_phone_nums': dc.bad_phone_nums,
+        'bad_m2m': dc.bad_m2m
+    }
+
+
+@shared_task
+def aggregate_combine(results):
+    """Chord callback folding the `combine_chunk` results into one summary
+
+    :param results: (list of dict) What each `combine_chunk` returned
+    :return: (dict) Totals, per-stage counts, merged remediation entries and
+        chunk timings
+    """
+    summary = {
+        'processed': 0,
+        'counts': {stage: 0 for stage in STAGES},
+        'chunks': len(results),
+        'chunk_seconds': [],
+        'bad_phone_nums': dict(),
+        'bad_m2m': dict()
+    }
+    for result in results:
+        summary['processed'] += result['processed']
+        for stage, count in result['counts'].items():
+            summary['counts'][stage] = summary['counts'].get(stage, 0) + count
+        summary['chunk_seconds'].append(result['seconds'])
+        for field in ('bad_phone_nums', 'bad_m2m'):
+            for cc_id, entries in result[field].items():
+                summary[field].setdefault(cc_id, []).extend(entries)
+    summary['slowest_chunk_seconds'] = max(summary['chunk_seconds'], default=0)
+    logging.getLogger(__name__).info(
+        f"Combined '{summary['processed']}' contacts in {len(results)} "
+        f"chunks; slowest took {summary['slowest_chunk_seconds']} seconds. "
+        f"Outcomes: {summary['counts']}"
+    )
+    return summary
+
+
+def combine_progress(job_id):
+    """Returns the progress of a `harvest` job, including its chord
+
+    The web interface only knows the `harvest` task's id. Once the harvest
+    is done its state names the `combine_chunk` tasks and the chord
+    callback, so their progress is summed into `process_percent`, which
+    becomes None when the callback has finished (with its summary under
+    'summary').
+
+    :param job_id: (str) Id of a `harvest` task
+    :return: (dict / str) Progress context, or the task state if there is
+        none yet
+    """
+    job = AsyncResult(job_id)
+    data = job.result or job.state
+    if not isinstance(data, dict) or 'chunks' not in data:
+        return data
+
+    data = dict(data)
+    callback = AsyncResult(data['callback'])
+    if callback.ready():
+        data['process_percent'] = None
+        summary = callback.result
+        data['summary'] = summary if isinstance(summary, dict)\
+            else str(summary)
+        return data
+
+    processed = 0
+    for chunk_id in data['chunks']:
+        info = AsyncResult(chunk_id).info
+        if isinstance(info, dict):
+            processed += info.get('processed', 0)
+    data['process_percent'] = round((processed / data['total']) * 100)
+    return data
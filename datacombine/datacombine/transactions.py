@@ -0,0 +1,79 @@
+from contextlib import contextmanager
+import sys
+import time
+
+from django.db import transaction
+
+DEFAULT_CONTACTS_PER_TRANSACTION = 100
+
+
+class TransactionPolicy():
+    def __init__(self,
+                 contacts_per_transaction=DEFAULT_CONTACTS_PER_TRANSACTION,
+                 clock=time.perf_counter):
+        """How combining contacts one at a time is split into transactions
+
+        Contacts are combined `contacts_per_transaction` at a time in a
+        single transaction, each inside its own savepoint, so a contact which
+        fails rolls back alone while the rest of its group commits together.
+        This replaces a transaction (and commit) per helper call.
+
+        How long committing takes is measured per stage: 'commit' for each
+        transaction, 'savepoint' for releasing each contact's savepoint. See
+        `summary`.
+
+        :param contacts_per_transaction: (int) Contacts per transaction; 1
+            gives every contact its own transaction
+        :param clock: (callable) Time source, in seconds
+        """
+        if contacts_per_transaction < 1:
+            raise ValueError("contacts_per_transaction must be at least 1")
+        self.contacts_per_transaction = contacts_per_transaction
+        self._clock = clock
+        self.reset()
+
+    def reset(self):
+        """Forgets the latencies measured so far"""
+        self._stages = dict()
+
+    def record(self, stage, seconds):
+        count, total, most = self._stages.get(stage, (0, 0.0, 0.0))
+        self._stages[stage] = (count + 1, total + seconds, max(most, seconds))
+
+    def summary(self):
+        """Returns the commit latencies measured, per stage
+
+        :return: (dict) stage -> dict of 'count', 'total_seconds',
+            'mean_seconds' and 'max_seconds'
+        """
+        return {
+            stage: {
+                'count': count,
+                'total_seconds': total,
+                'mean_seconds': total / count,
+                'max_seconds': most
+            }
+            for stage, (count, total, most) in self._stages.items()
+        }
+
+    @contextmanager
+    def _timed_atomic(self, stage):
+        block = transaction.atomic()
+        block.__enter__()
+        try:
+            yield
+        except BaseException:
+            if not block.__exit__(*sys.exc_info()):
+                raise
+        else:
+            start = self._clock()
+            block.__exit__(None, None, None)
+            self.record(stage, self._clock() - start)
+
+    def transaction(self):
+        """Context manager for one group of contacts (or one bulk batch)"""
+        return self._timed_atomic('commit')
+
+    def savepoint(self):
+        """Context manager for one contact within a `transaction`"""
+        return self._timed_atomic('savepoint')
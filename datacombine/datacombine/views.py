@@ -5,7 +5,6 @@ from django.contrib import messages
 from django.http import HttpResponse, HttpResponseRedirect
 
 import json
-from celery.result import AsyncResult
 
 from datacombine import models
 from datacombine.forms import HarvestForm
@@ -17,8 +16,7 @@ class CombineView(View):
         # self.combine_task_id = self.combine_contacts()
         if 'job' in request.GET:
             job_id = request.GET.get('job')
-            job = AsyncResult(job_id)
-            data = job.result or job.state
+            data = tasks.combine_progress(job_id)
             context = {
                 'data': data,
                 'task_id': job_id,
@@ -35,8 +33,7 @@ class CombineView(View):
         if request.is_ajax():
             if 'task_id' in request.POST.keys() and request.POST['task_id']:
                 task_id = request.POST['task_id']
-                task = AsyncResult(task_id)
-                data = task.result or task.state
+                data = tasks.combine_progress(task_id)
             else:
                 data = 'No task_id in the request'
         else:
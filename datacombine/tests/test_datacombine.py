@@ -1,6 +1,41 @@
-from django.test import TestCase
-from datacombine.data_combine import DataCombine
-from django.db import IntegrityError
+from celery.backends.cache import CacheBackend
+from cryptography.fernet import Fernet, InvalidToken
+from dateutil import parser
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from unittest import skipUnless
+from datacombine.cc_client import ConstantContactClient, TokenBucket
+from datacombine.cc_index import CCIdIndex
+from datacombine.data_combine import CombineException, DataCombine
+from datacombine.hrminer import (
+    benchmark_miners,
+    HighRiseDataMiner,
+    MiningCache,
+    synthetic_export
+)
+from datacombine.mappers import CONTACT_MAPPER, MAPPERS
+from datacombine.phone_cache import PhoneCache
+from datacombine.progress import ProgressReporter
+from datacombine.snapshot_store import SnapshotStore
+from datacombine.snapshots import (
+    BAD_M2M,
+    benchmark_merge,
+    benchmark_snapshot_read,
+    CCLIST,
+    CONTACT,
+    ENCRYPTED_MAGIC,
+    is_encrypted,
+    is_snapshot,
+    iter_records,
+    merge_objects,
+    read_snapshot,
+    write_snapshot,
+    KEEP_INCOMING,
+    KEEP_LOCAL,
+    KEEP_NEWEST
+)
+from datacombine import tasks
+from datacombine.transactions import TransactionPolicy
+from django.db import connection, IntegrityError
 from datacombine.models import (
     Contact,
     Phone,
@@ -8,11 +43,17 @@ from datacombine.models import (
     ConstantContactList,
     Note,
     Address,
-    UserStatusOnCCList
+    UserStatusOnCCList,
+    HighRiseProfile
 )
+import io
+import json
 import logging
 import os
 import re
+import requests
+import tempfile
+import types
 
 
 HERE = os.path.join(os.getcwd(), "tests")
@@ -156,16 +197,45 @@ class TestDataCombine(TestCase):
             "prefix_name",
             "job_title",
             "source",
-            "status"
+            "status",
+            "fingerprint",
+            "highrise_id"
         }
         self.assertEqual(init_values.difference(expected_values), set())
 
+    def test_model_mapper_plans(self):
+        address = MAPPERS[Address].build(
+            self._full_contact_json(self.jop_de_ruyterzoon, 1)['addresses'][0]
+        )
+        self.assertEqual(address.cc_id, '83d1f0e0-611c-11e3-d3ad-782bcb740001')
+        self.assertEqual(address.address_type, "PE")
+        self.assertEqual(address.state_code, "FL")
+        with self.assertRaises(KeyError):
+            MAPPERS[Address].build({'address_type': 'PERSONAL'})
+
+        emails = MAPPERS[EmailAddress].kwargs_list([
+            {'id': 'a', 'opt_in_date': '2011-06-24T19:32:49.000Z',
+             'confirm_status': 'NO_CONFIRMATION_REQUIRED', 'status': 'NOPE'}
+        ])
+        self.assertEqual(
+            emails[0]['opt_in_date'], parser.parse('2011-06-24T19:32:49Z')
+        )
+        self.assertEqual(emails[0]['confirm_status'], 'NC')
+        self.assertIsNone(emails[0]['status'])
+        self.assertIsNone(emails[0]['opt_out_date'])
+
+        jop = CONTACT_MAPPER.build(self.jop_de_ruyterzoon)
+        self.assertEqual(jop.cc_id, '1983')
+        self.assertEqual(jop.status, 'AC')
+        self.assertIsNone(jop.fingerprint)
+
     def test_get_init_values_for_model_phone(self):
         init_values = set(self.dc.get_init_values_for_model(Phone))
         expected_values = {
             "area_code",
             "number",
-            "extension"
+            "extension",
+            "phone_key"
         }
         self.assertEqual(init_values.difference(expected_values), set())
 
@@ -260,6 +330,31 @@ class TestDataCombine(TestCase):
         # Delete Nate
         nate.delete()
 
+    def test_phone_cache_evicts_least_recently_used(self):
+        cache = PhoneCache(maxsize=2)
+        cache.put("|1234567|", 1)
+        cache.put("|7654321|", 2)
+        cache.get("|1234567|")
+        cache.put("|1111111|", 3)
+        self.assertEqual(cache.get("|1234567|"), 1)
+        self.assertIsNone(cache.get("|7654321|"))
+        self.assertEqual(len(cache), 2)
+
+    def test_phone_cache_pks_for(self):
+        existing = Phone.objects.create(area_code="407", number="5551234")
+        cache = PhoneCache()
+        keys = [("407", "5551234", None), ("407", "5551234", ""),
+                ("904", "7121983", "")]
+        pks = cache.pks_for(keys)
+        self.assertEqual(pks[keys[0]], existing.pk)
+        self.assertEqual(pks[keys[1]], existing.pk)
+        self.assertEqual(
+            pks[keys[2]],
+            Phone.objects.get(area_code="904", number="7121983").pk
+        )
+        cache.pks_for(keys)
+        self.assertEqual(Phone.objects.count(), 2)
+
     def test__combine_m2m_field_into_db_addresses(self):
         nate = self.dc._initial_contact_setup_from_json(self.nathanial_conolly)
         aid_1 = '83d1f0e0-611c-11e3-d3ad-782bcb740129'
@@ -357,6 +452,494 @@ class TestDataCombine(TestCase):
         # Delete Nate
         nate.delete()
 
+    def _full_contact_json(self, contact, n):
+        contact = dict(contact)
+        contact.update(
+            home_phone=f"(407)-555-{n:04d}",
+            work_phone="(904)-712-1983",
+            cell_phone="",
+            fax="12",
+            addresses=[{
+                'address_type': 'PERSONAL',
+                'city': 'Orlando',
+                'country_code': 'us',
+                'id': f'83d1f0e0-611c-11e3-d3ad-782bcb74{n:04d}',
+                'line1': '1917 Petrograd Dr.',
+                'line2': '',
+                'line3': '',
+                'postal_code': '32801',
+                'state': 'Florida',
+                'state_code': 'FL',
+                'sub_postal_code': ''
+            }],
+            email_addresses=[{
+                'confirm_status': 'CONFIRMED',
+                'email_address': f'comrade{n}@ira.org',
+                'id': f'deadbeef-99d9-11e3-83e7-782aba74{n:04d}',
+                'opt_in_date': '2011-06-24T19:32:49.000Z',
+                'opt_in_source': 'ACTION_BY_VISITOR',
+                'status': 'ACTIVE'
+            }],
+            notes=[{
+                'created_date': '2017-07-13T20:11:19.000Z',
+                'id': f'6f12eae0-6807-11e7-af14-d4ae529a{n:04d}',
+                'modified_date': '2017-07-13T20:11:19.000Z',
+                'note': 'BLAH BLAH'
+            }],
+            lists=[{'id': self.yaya_orl_json['id'], 'status': 'ACTIVE'}]
+        )
+        return contact
+
+    def test_combine_contacts_into_db_in_batches(self):
+        self.dc.cclists = []
+        self.dc.contacts = [
+            self._full_contact_json(self.jop_de_ruyterzoon, 1),
+            self._full_contact_json(self.nathanial_conolly, 2),
+        ]
+        for _ in self.dc.combine_contacts_into_db(update_web_interface=True,
+                                                  batch_size=10):
+            pass
+
+        self.assertEqual(Contact.objects.count(), 2)
+        nate = Contact.objects.get(cc_id=1985)
+        self.assertEqual(
+            [str(ph) for ph in nate.home_phone.all()], ["(407)-555-0002"]
+        )
+        # Both contacts share the same work phone, which is only saved once
+        self.assertEqual(
+            Phone.objects.filter(area_code="904", number="7121983").count(), 1
+        )
+        self.assertEqual(nate.work_phone.count(), 1)
+        self.assertEqual(nate.addresses.first().address_type, "PE")
+        self.assertEqual(nate.email_addresses.first().confirm_status, "CO")
+        self.assertEqual(nate.notes.count(), 1)
+        self.assertEqual(
+            UserStatusOnCCList.objects.filter(user=nate).first().cclist,
+            self.yaya_orl_list
+        )
+        self.assertEqual(self.dc.bad_phone_nums['1985'], [{'fax': '12'}])
+
+    def _combine_changed_contact(self, batch_size):
+        self.dc.cclists = []
+        contact = self._full_contact_json(self.nathanial_conolly, 2)
+        contact['fax'] = ""
+        self.dc.contacts = [contact]
+        for _ in self.dc.combine_contacts_into_db(batch_size=batch_size):
+            pass
+        # As if matched by a HighRise import
+        Contact.objects.filter(cc_id=1985).update(highrise_id='7')
+
+        changed = self._full_contact_json(self.nathanial_conolly, 3)
+        changed.update(
+            fax="",
+            first_name="Nathaniel",
+            work_phone="",
+            modified_date='2018-01-01T00:00:00.000Z',
+            email_addresses=contact['email_addresses'],
+            lists=[{'id': self.yaya_orl_json['id'], 'status': 'HIDDEN'}]
+        )
+        self.dc.contacts = [changed]
+        for _ in self.dc.combine_contacts_into_db(batch_size=batch_size):
+            pass
+
+        self.assertEqual(self.dc.counts['updated'], 1)
+        self.assertEqual(Contact.objects.count(), 1)
+        nate = Contact.objects.get(cc_id=1985)
+        self.assertEqual(nate.first_name, "Nathaniel")
+        self.assertEqual(nate.highrise_id, '7')
+        self.assertEqual(
+            nate.cc_modified_date, parser.parse(changed['modified_date'])
+        )
+        self.assertEqual(
+            [str(ph) for ph in nate.home_phone.all()], ["(407)-555-0003"]
+        )
+        self.assertEqual(nate.work_phone.count(), 0)
+        # The old address is unlinked, the email kept
+        self.assertEqual(
+            [a.cc_id for a in nate.addresses.all()],
+            [changed['addresses'][0]['id']]
+        )
+        self.assertEqual(nate.email_addresses.count(), 1)
+        self.assertEqual(
+            [(u.cclist, u.status)
+             for u in UserStatusOnCCList.objects.filter(user=nate)],
+            [(self.yaya_orl_list, "HI")]
+        )
+
+    def test_combine_changed_contact(self):
+        self._combine_changed_contact(batch_size=None)
+
+    def test_combine_changed_contacts_in_batches(self):
+        self._combine_changed_contact(batch_size=10)
+
+    def test_combine_skips_contacts_by_fingerprint(self):
+        self.dc.cclists = []
+        contact = self._full_contact_json(self.nathanial_conolly, 2)
+        contact['fax'] = ""
+        self.dc.contacts = [contact]
+        for _ in self.dc.combine_contacts_into_db(batch_size=10):
+            pass
+        nate = Contact.objects.get(cc_id=1985)
+        self.assertEqual(nate.fingerprint, Contact.make_fingerprint(contact))
+
+        # Nested objects in another order are the same contact
+        same = dict(contact, lists=list(reversed(contact['lists'])))
+        same['email_addresses'] = contact['email_addresses'] * 1
+        self.assertEqual(
+            Contact.make_fingerprint(same), Contact.make_fingerprint(contact)
+        )
+        # ...but a changed note is caught, though modified_date wasn't bumped
+        changed = dict(contact, notes=[dict(contact['notes'][0], note="Hm")])
+        self.dc.contacts = [same, changed]
+        for _ in self.dc.combine_contacts_into_db(batch_size=1):
+            pass
+        self.assertEqual(self.dc.counts['skipped'], 1)
+        self.assertEqual(self.dc.counts['updated'], 1)
+        self.assertEqual(nate.notes.get().note, "Hm")
+
+        # Contacts combined without one get theirs on the next skip
+        Contact.objects.update(fingerprint=None)
+        self.dc.contacts = [changed]
+        for _ in self.dc.combine_contacts_into_db():
+            pass
+        self.assertEqual(self.dc.counts['skipped'], 1)
+        self.assertEqual(
+            Contact.objects.get(cc_id=1985).fingerprint,
+            Contact.make_fingerprint(changed)
+        )
+
+    def test_transaction_policy_rolls_back_one_contact(self):
+        self.dc.transaction_policy = TransactionPolicy(
+            contacts_per_transaction=2
+        )
+        self.dc.cclists = []
+        broken = self._full_contact_json(self.jop_de_ruyterzoon, 1)
+        broken['lists'] = None
+        self.dc.contacts = [
+            broken,
+            self._full_contact_json(self.nathanial_conolly, 2),
+            self._full_contact_json(dict(self.nathanial_conolly, id='1986'), 3)
+        ]
+        for _ in self.dc.combine_contacts_into_db(update_web_interface=True):
+            pass
+
+        # Jop's half-combined row went with his savepoint, and only his
+        self.assertEqual(
+            sorted(Contact.objects.values_list('cc_id', flat=True)),
+            [1985, 1986]
+        )
+        self.assertIsNone(self.dc.cc_index.contact('1983'))
+        self.assertEqual(self.dc.counts['errored'], 1)
+        latency = self.dc.transaction_policy.summary()
+        self.assertEqual(latency['commit']['count'], 2)
+        self.assertEqual(latency['savepoint']['count'], 2)
+
+    def test_harvest_and_combine_contacts(self):
+        pages = {
+            '/v2/contacts': (
+                [self._full_contact_json(self.jop_de_ruyterzoon, 1)],
+                '/v2/contacts?next=2'
+            ),
+            '/v2/contacts?next=2': (
+                [self._full_contact_json(self.nathanial_conolly, 2)], False
+            ),
+        }
+        self.dc.cclists = []
+        self.dc.logdir = tempfile.mkdtemp()
+        self.dc._fetch_contact_page = lambda params, api_url: pages[api_url]
+        progress = list(self.dc.harvest_and_combine_contacts(
+            update_web_interface=True, queue_size=1, batch_size=10
+        ))
+
+        self.assertEqual(Contact.objects.count(), 2)
+        self.assertEqual(self.dc.contacts, [])
+        self.assertEqual(progress[0]['pages'], 1)
+        self.assertEqual(progress[0]['processed'], 1)
+        self.assertEqual(
+            {k: progress[-1][k]
+             for k in ('processed', 'total', 'pages', 'harvest_done')},
+            {'processed': 2, 'total': 2, 'pages': 2, 'harvest_done': True}
+        )
+
+    def test_harvest_and_combine_contacts_raises_producer_failure(self):
+        def fetch(params, api_url):
+            if api_url == '/v2/contacts':
+                return ([self._full_contact_json(self.jop_de_ruyterzoon, 1)],
+                        '/v2/contacts?next=2')
+            raise CombineException(f"Harvest failed at '{api_url}'")
+
+        self.dc.cclists = []
+        self.dc.checkpointdir = tempfile.mkdtemp()
+        self.dc._fetch_contact_page = fetch
+        with self.assertRaises(CombineException):
+            for _ in self.dc.harvest_and_combine_contacts(
+                    update_web_interface=True, queue_size=1, checkpoint=True
+            ):
+                pass
+
+        # The page before the failure was combined, and the harvest can be
+        # resumed after it
+        self.assertEqual(Contact.objects.count(), 1)
+        checkpoint = self.dc.contact_checkpoint()
+        self.assertEqual(checkpoint.next_uri(), '/v2/contacts?next=2')
+
+    def test_harvest_contacts_resume(self):
+        pages = {
+            '/v2/contacts': ([{'id': '1'}], '/v2/contacts?next=2'),
+            '/v2/contacts?next=2': None,  # API hiccup ends the harvest
+            '/v2/contacts?next=3': ([{'id': '3'}], False),
+        }
+        fetched = []
+
+        def fetch(params, api_url):
+            fetched.append(api_url)
+            return pages[api_url]
+        self.dc.checkpointdir = tempfile.mkdtemp()
+        self.dc._fetch_contact_page = fetch
+
+        with self.assertRaises(CombineException):
+            self.dc.harvest_contacts(checkpoint=True)
+        # Nothing combined can clear the checkpoint of an unfinished harvest
+        self.dc.clear_harvest_checkpoints()
+        self.assertTrue(self.dc.contact_checkpoint().exists())
+        self.assertFalse(self.dc.contact_checkpoint().is_complete())
+
+        pages['/v2/contacts?next=2'] = ([{'id': '2'}], '/v2/contacts?next=3')
+        fetched.clear()
+        self.dc.harvest_contacts(resume=True)
+        self.assertEqual(
+            fetched, ['/v2/contacts?next=2', '/v2/contacts?next=3']
+        )
+        self.assertEqual(
+            self.dc.contacts, [{'id': '1'}, {'id': '2'}, {'id': '3'}]
+        )
+
+        # A finished harvest is replayed without calling the API
+        fetched.clear()
+        self.dc.harvest_contacts(resume=True)
+        self.assertEqual(fetched, [])
+        self.assertEqual(len(self.dc.contacts), 3)
+        self.assertTrue(self.dc.contact_checkpoint().is_complete())
+
+        # Without resume the checkpoint starts over
+        self.dc.harvest_contacts(checkpoint=True)
+        self.assertEqual(fetched[0], '/v2/contacts')
+
+        # Combining what was harvested removes the checkpoint
+        self.dc.contacts = []
+        self.dc.cclists = []
+        for _ in self.dc.combine_contacts_into_db():
+            pass
+        self.assertListEqual(os.listdir(self.dc.checkpointdir), [])
+
+    def test_harvest_checkpoints_opt_in_and_encrypted(self):
+        self.dc.checkpointdir = os.path.join(tempfile.mkdtemp(), "cp")
+        self.dc._fetch_contact_page = lambda params, api_url: (
+            [{'id': '1', 'email': 'jop@example.org'}], False
+        )
+        self.dc.harvest_contacts()
+        self.assertFalse(os.path.exists(self.dc.checkpointdir))
+
+        self.dc.fernet = Fernet(Fernet.generate_key())
+        self.dc.harvest_contacts(checkpoint=True)
+        path = self.dc.contact_checkpoint().path
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        with open(path) as f:
+            self.assertNotIn('jop@example.org', f.read())
+        self.assertTrue(self.dc.contact_checkpoint().is_complete())
+        self.dc.harvest_contacts(resume=True)
+        self.assertEqual(self.dc.contacts[0]['email'], 'jop@example.org')
+
+    def test_harvest_contacts_parallel(self):
+        def contact(cc_id, modified_date):
+            return {'id': cc_id, 'modified_date': modified_date}
+        pages = {
+            'ACTIVE': ([contact('1', '2017-01-01T00:00:00.000Z'),
+                        contact('2', '2017-01-01T00:00:00.000Z')], False),
+            # Opted out while the ACTIVE shard was being harvested
+            'OPTOUT': ([contact('2', '2017-02-01T00:00:00.000Z')],
+                       '/v2/contacts?next=optout'),
+            '/v2/contacts?next=optout': (
+                [contact('3', '2017-01-01T00:00:00.000Z')], False
+            ),
+        }
+
+        def fetch(params, api_url):
+            return pages['next' in api_url and api_url or params['status']]
+        self.dc.logdir = tempfile.mkdtemp()
+        self.dc._fetch_contact_page = fetch
+
+        self.dc.harvest_contacts_parallel(statuses=['ACTIVE', 'OPTOUT'])
+        contacts = {c['id']: c for c in self.dc.contacts}
+        self.assertEqual(len(self.dc.contacts), 3)
+        self.assertEqual(
+            contacts['2']['modified_date'], '2017-02-01T00:00:00.000Z'
+        )
+
+        # A shard that fails fails the whole harvest
+        pages['/v2/contacts?next=optout'] = None
+        with self.assertRaises(CombineException):
+            self.dc.harvest_contacts_parallel(statuses=['ACTIVE', 'OPTOUT'])
+
+    def test_progress_reporter_throttles(self):
+        now = [0.0]
+        payloads = []
+        reporter = ProgressReporter(
+            total=10, sink=payloads.append, min_interval=1.0,
+            clock=lambda: now[0]
+        )
+        reporter.counts['inserted'] = 3
+        now[0] = 0.5
+        self.assertIsNone(reporter.advance(2))
+        now[0] = 1.0
+        payload = reporter.advance(3)
+        self.assertEqual(payloads, [payload])
+        self.assertEqual(payload['processed'], 5)
+        self.assertEqual(payload['process_percent'], 50)
+        self.assertEqual(payload['contacts_per_second'], 5)
+        self.assertEqual(payload['eta_seconds'], 1)
+        self.assertEqual(payload['inserted'], 3)
+        self.assertEqual(payload['errored'], 0)
+        self.assertIsNone(reporter.advance(1))
+        # Finishing is always reported
+        self.assertEqual(reporter.advance(4)['processed'], 10)
+
+    def test_token_bucket_limits_rate(self):
+        now = [0.0]
+
+        def sleep(seconds):
+            now[0] += seconds
+        bucket = TokenBucket(rate=4, clock=lambda: now[0], sleep=sleep)
+        for _ in range(4):
+            self.assertEqual(bucket.acquire(), 0)
+        self.assertAlmostEqual(bucket.acquire(), 0.25)
+        self.assertAlmostEqual(now[0], 0.25)
+
+    def test_cc_client_retries_throttled_requests(self):
+        def response(status_code, **headers):
+            r = requests.Response()
+            r.status_code = status_code
+            r.headers.update(headers)
+            return r
+
+        class FakeSession():
+            responses = [response(429, **{'Retry-After': '3'}),
+                         response(503), response(200)]
+
+            def get(self, url, params=None, timeout=None):
+                self.url = url
+                return self.responses.pop(0)
+
+        waits = []
+        client = ConstantContactClient(
+            'key', 'token', sleep=waits.append,
+            rate_limiter=TokenBucket(rate=1000)
+        )
+        client.session = FakeSession()
+        r = client.get('/v2/lists')
+
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(
+            client.session.url, 'https://api.constantcontact.com/v2/lists'
+        )
+        self.assertEqual(waits[0], 3)
+        self.assertEqual(len(waits), 2)
+        self.assertEqual(client.stats.retries, 2)
+        self.assertEqual(client.stats.requests, 3)
+        self.assertEqual(client.stats.errors, 2)
+
+    def test_harvest_contacts_raises_once_client_gives_up(self):
+        r = requests.Response()
+        r.status_code = 503
+        r.reason = "Service Unavailable"
+        r._content = b""
+
+        class FakeSession():
+            def get(self, url, params=None, timeout=None):
+                return r
+
+        self.dc.client = ConstantContactClient(
+            'key', 'token', max_retries=1, sleep=lambda seconds: None,
+            rate_limiter=TokenBucket(rate=1000)
+        )
+        self.dc.client.session = FakeSession()
+        with self.assertRaises(CombineException):
+            self.dc.harvest_contacts()
+        self.assertEqual(self.dc.client.stats.requests, 2)
+
+        # Nor is a request the API won't retry taken for a finished harvest
+        r.status_code = 404
+        with self.assertRaises(CombineException):
+            self.dc.harvest_contacts()
+
+    @skipUnless(connection.vendor == 'postgresql', "COPY is postgres only")
+    def test_initial_load_contacts(self):
+        self.dc.cclists = []
+        self.dc.contacts = [
+            self._full_contact_json(self.jop_de_ruyterzoon, 1),
+            self._full_contact_json(self.nathanial_conolly, 2),
+        ]
+        for _ in self.dc.initial_load_contacts(batch_size=10):
+            pass
+
+        nate = Contact.objects.get(cc_id=1985)
+        self.assertEqual(
+            [str(ph) for ph in nate.home_phone.all()], ["(407)-555-0002"]
+        )
+        self.assertEqual(nate.notes.count(), 1)
+        self.assertEqual(nate.addresses.first().address_type, "PE")
+        self.assertTrue(self.dc.load_summary['consistent'])
+        self.assertEqual(
+            self.dc.load_summary['Phone'], {'expected': 3, 'loaded': 3}
+        )
+        # Keys were reserved from the sequences, so the ORM carries on
+        Phone(number="5550100").save()
+
+    @skipUnless(connection.vendor == 'postgresql', "COPY is postgres only")
+    def test_initial_load_contacts_reuses_fallback_phones(self):
+        # As left by a contact that fell back to the ORM in an earlier batch
+        ph = Phone()
+        ph.create_from_str("407-555-0002")
+        ph.save()
+        self.dc.cclists = []
+        self.dc.contacts = [
+            self._full_contact_json(self.jop_de_ruyterzoon, 1),
+            self._full_contact_json(self.nathanial_conolly, 2),
+        ]
+        with self.assertLogs(self.dc.logger, logging.DEBUG) as logs:
+            for _ in self.dc.initial_load_contacts(batch_size=10):
+                pass
+
+        self.assertFalse(
+            [line for line in logs.output if "falling back" in line]
+        )
+        nate = Contact.objects.get(cc_id=1985)
+        self.assertListEqual(list(nate.home_phone.all()), [ph])
+        self.assertEqual(Phone.objects.count(), 3)
+
+    def test_cc_index_load_for_contacts(self):
+        jop = self.dc._initial_contact_setup_from_json(self.jop_de_ruyterzoon)
+        self.dc._initial_contact_setup_from_json(self.nathanial_conolly)
+        index = CCIdIndex().load_for_contacts(
+            [self._full_contact_json(self.jop_de_ruyterzoon, 1)]
+        )
+        self.assertEqual(index.contact('1983')[0], jop.pk)
+        self.assertEqual(
+            index.contact(1983)[1],
+            parser.parse(self.jop_de_ruyterzoon['modified_date'])
+        )
+        self.assertIsNone(index.contact('1985'))
+        self.assertEqual(
+            index.pk(ConstantContactList, self.yaya_orl_json['id']),
+            self.yaya_orl_list.pk
+        )
+
+        index.begin()
+        index.add(Note, '6f12eae0-6807-11e7-af14-d4ae529a0001', 1)
+        self.assertIn((Note, '6f12eae0-6807-11e7-af14-d4ae529a0001'), index)
+        index.rollback()
+        self.assertNotIn((Note, '6f12eae0-6807-11e7-af14-d4ae529a0001'), index)
+
     def test_read_constantcontacts_from_json_nothing_in_dcobj(self):
         dcTT, dcTF, dcFT, dcFF = (DataCombine(), DataCombine(),
                                   DataCombine(), DataCombine())
@@ -388,9 +971,641 @@ class TestDataCombine(TestCase):
         dc2.read_constantcontact_objects_from_json(test_pth)
         self.assertListEqual(dc.cclists, dc2.cclists)
 
+    def test_merge_objects_policies(self):
+        local = [
+            {'id': '1', 'modified_date': '2017-01-01T00:00:00.000Z'},
+            {'id': '2', 'modified_date': '2017-06-01T00:00:00.000Z'},
+        ]
+        incoming = [
+            {'id': '2', 'modified_date': '2017-03-01T00:00:00.000Z'},
+            {'id': '1', 'modified_date': '2018-01-01T00:00:00.000Z'},
+            {'id': '3', 'modified_date': '2016-01-01T00:00:00.000Z'},
+        ]
+        self.assertListEqual(
+            merge_objects(local, incoming, KEEP_LOCAL),
+            local + incoming[2:]
+        )
+        self.assertListEqual(
+            merge_objects(local, incoming, KEEP_INCOMING),
+            [incoming[1], incoming[0], incoming[2]]
+        )
+        self.assertListEqual(
+            merge_objects(local, incoming, KEEP_NEWEST),
+            [incoming[1], local[1], incoming[2]]
+        )
+        with self.assertRaises(ValueError):
+            merge_objects(local, incoming, 'oldest')
+
+        # Linear: 8x the contacts mustn't take anywhere near 64x as long
+        small, large = benchmark_merge(sizes=(5000, 40000))
+        self.assertLess(large['seconds'], small['seconds'] * 30)
+
+    def test_dump_constantcontacts_to_json_merge(self):
+        jfname = os.path.join(tempfile.mkdtemp(), "snapshot.json")
+        dc = DataCombine()
+        dc.read_constantcontact_objects_from_json(test_pth)
+        dc.bad_phone_nums = {'1983': [{'fax': '12'}]}
+        dc.dump_constantcontact_objects_from_json(jfname)
+
+        newer = dict(dc.cclists[0], name="Renamed",
+                     modified_date="2020-01-01T00:00:00.000Z")
+        dc2 = DataCombine()
+        dc2.cclists = [newer]
+        dc2.dump_constantcontact_objects_from_json(
+            jfname, override_json=False, merge_policy=KEEP_NEWEST
+        )
+        dc3 = DataCombine()
+        dc3.read_constantcontact_objects_from_json(jfname)
+        self.assertListEqual(dc3.contacts, dc.contacts)
+        self.assertListEqual(dc3.cclists, [newer] + dc.cclists[1:])
+        self.assertDictEqual(dc3.bad_phone_nums, {})
+
+        dc.dump_constantcontact_objects_from_json(jfname)
+        dc3.read_constantcontact_objects_from_json(jfname)
+        self.assertDictEqual(dc3.bad_phone_nums, dc.bad_phone_nums)
+        self.assertFalse(os.path.exists(f"{jfname}.tmp"))
+
+    def test_snapshot_round_trip_and_streaming_combine(self):
+        jfname = os.path.join(tempfile.mkdtemp(), "snapshot.jsonl.gz")
+        # Legacy single-JSON dumps are read as the same records
+        self.dc.read_constantcontact_objects_from_json(test_pth)
+        self.assertFalse(is_snapshot(test_pth))
+        self.dc.contacts = [
+            self._full_contact_json(self.jop_de_ruyterzoon, 1),
+            self._full_contact_json(self.nathanial_conolly, 2),
+        ]
+        self.dc.bad_m2m = {'1983': [{'1983': {'note': 'too long'}}]}
+        self.assertEqual(self.dc.dump_snapshot(jfname), 4)
+        self.assertTrue(is_snapshot(jfname))
+        self.assertListEqual(
+            [kind for kind, _ in read_snapshot(jfname)],
+            ['cclist', 'contact', 'contact', 'bad_m2m']
+        )
+
+        dc = DataCombine()
+        dc.read_constantcontact_objects_from_json(jfname)
+        self.assertListEqual(dc.contacts, self.dc.contacts)
+        self.assertListEqual(dc.cclists, self.dc.cclists)
+        self.assertDictEqual(dc.bad_m2m, self.dc.bad_m2m)
+
+        dc = DataCombine()
+        for _ in dc.combine_snapshot_into_db(jfname, chunk_size=1):
+            pass
+        self.assertEqual(dc.counts['inserted'], 2)
+        self.assertEqual(
+            Contact.objects.filter(cc_id__in=['1983', '1985']).count(), 2
+        )
+        self.assertTrue(ConstantContactList.objects.filter(
+            cc_id=self.dc.cclists[0]['id']
+        ).exists())
+        self.assertListEqual(dc.contacts, [])
+        self.assertDictEqual(dc.bad_m2m, self.dc.bad_m2m)
+
+    def test_encrypted_snapshot_chunks(self):
+        jfname = os.path.join(tempfile.mkdtemp(), "snapshot.jsonl.gz")
+        key = Fernet.generate_key()
+        dc = DataCombine(snapshot_key=key)
+        dc.read_constantcontact_objects_from_json(test_pth)
+        dc.contacts = [
+            self._full_contact_json(self.jop_de_ruyterzoon, n)
+            for n in range(200)
+        ]
+        write_snapshot(jfname, iter_records(dc.contacts, dc.cclists),
+                       dc.fernet, chunk_size=1024)
+        self.assertTrue(is_encrypted(jfname))
+        with open(jfname, 'rb') as f:
+            self.assertNotIn(b'Ruyterzoon', f.read())
+
+        dc2 = DataCombine(snapshot_key=key)
+        dc2.read_constantcontact_objects_from_json(jfname)
+        self.assertListEqual(dc2.contacts, dc.contacts)
+        self.assertListEqual(dc2.cclists, dc.cclists)
+        with self.assertRaises(ValueError):
+            DataCombine().read_constantcontact_objects_from_json(jfname)
+        with self.assertRaises(InvalidToken):
+            DataCombine(snapshot_key=Fernet.generate_key())\
+                .read_constantcontact_objects_from_json(jfname)
+
+        # Dropping the last chunk is caught, not read as a shorter snapshot
+        with open(jfname, 'rb') as f:
+            data = f.read()
+        offset, offsets = len(ENCRYPTED_MAGIC), []
+        while offset < len(data):
+            offsets.append(offset)
+            offset += 4 + int.from_bytes(data[offset:offset + 4], 'big')
+        self.assertGreater(len(offsets), 2)
+        with open(jfname, 'wb') as f:
+            f.write(data[:offsets[-1]])
+        with self.assertRaises(ValueError):
+            dc2.read_constantcontact_objects_from_json(jfname)
+
+        reads = benchmark_snapshot_read(size=50, fernet=dc.fernet)
+        self.assertGreater(reads['encrypted']['records_per_second'], 0)
+        self.assertGreater(reads['plaintext']['records_per_second'], 0)
+
+    def test_snapshot_store_random_access(self):
+        jfname = os.path.join(tempfile.mkdtemp(), "snapshot.store")
+        self.dc.read_constantcontact_objects_from_json(test_pth)
+        xcclist = {'id': self.dc.cclists[0]['id'], 'status': 'ACTIVE'}
+        contacts = [
+            dict(self._full_contact_json(self.jop_de_ruyterzoon, n),
+                 id=str(2000 + n), lists=[xcclist])
+            for n in range(100)
+        ]
+        self.dc.contacts = contacts
+        self.assertEqual(self.dc.dump_snapshot_store(jfname), 101)
+        with SnapshotStore(jfname) as store:
+            self.assertEqual(len(store), 100)
+            self.assertIn(2042, store)
+            self.assertNotIn(404, store)
+            self.assertListEqual(
+                list(store.ids()), [c['id'] for c in contacts]
+            )
+            self.assertDictEqual(store.get('2042'), contacts[42])
+            self.assertListEqual(
+                store.get_many(['2001', '404', 2000]),
+                [contacts[1], contacts[0]]
+            )
+            with self.assertRaises(KeyError):
+                store.get('404')
+
+        dc = DataCombine()
+        for _ in dc.recombine_contacts_from_store(['2007', '2003'], jfname):
+            pass
+        self.assertListEqual(dc.contacts, [contacts[7], contacts[3]])
+        self.assertListEqual(dc.cclists, self.dc.cclists[:1])
+        self.assertEqual(
+            Contact.objects.filter(cc_id__in=['2003', '2007']).count(), 2
+        )
+        self.assertFalse(Contact.objects.filter(cc_id='2004').exists())
+
+        dc = DataCombine(snapshot_key=Fernet.generate_key())
+        dc.contacts = contacts
+        dc.dump_snapshot_store(jfname)
+        with self.assertRaises(ValueError):
+            SnapshotStore(jfname)
+        with SnapshotStore(jfname, dc.fernet) as store:
+            self.assertDictEqual(store.get(2099), contacts[99])
+
+        # An index left over from another data file is refused
+        with open(jfname, 'ab') as f:
+            f.write(b'x')
+        with self.assertRaises(ValueError):
+            SnapshotStore(jfname, dc.fernet)
+
+    def test_snapshot_chain_deltas_and_compaction(self):
+        manifest = os.path.join(tempfile.mkdtemp(), "chain.json")
+
+        def obj(cc_id, year, **kwargs):
+            return dict(kwargs, id=cc_id,
+                        modified_date=f"{year}-01-01T00:00:00.000Z")
+
+        chain = self.dc.snapshot_chain(manifest)
+        chain.append_delta(iter_records(
+            [obj('1', 2017), obj('2', 2017), obj('3', 2017)],
+            [obj('L1', 2017)]
+        ))
+        self.assertEqual(len(chain.deltas), 0)
+        chain.append_delta(iter_records(
+            [obj('2', 2018), obj('4', 2018)], [obj('L2', 2018)],
+            bad_m2m={'4': ['too long']}
+        ), modified_since='2017-06-01T00:00:00')
+        # Deltas reloaded from the manifest, and an out-of-date record in the
+        # newest delta doesn't win
+        chain = self.dc.snapshot_chain(manifest)
+        chain.append_delta(iter_records([obj('2', 2016), obj('3', 2019)]))
+        self.assertEqual(len(chain.deltas), 2)
+        self.assertEqual(
+            chain.deltas[0]['modified_since'], '2017-06-01T00:00:00'
+        )
+
+        latest = [
+            (CCLIST, obj('L1', 2017)), (CCLIST, obj('L2', 2018)),
+            (CONTACT, obj('1', 2017)), (CONTACT, obj('2', 2018)),
+            (CONTACT, obj('3', 2019)), (CONTACT, obj('4', 2018)),
+            (BAD_M2M, {'id': '4', 'entries': ['too long']})
+        ]
+        self.assertListEqual(list(chain.read()), latest)
+
+        old_files = [chain.base] + [d['path'] for d in chain.deltas]
+        self.assertEqual(chain.compact(), len(latest))
+        self.assertListEqual(chain.deltas, [])
+        self.assertFalse(any(os.path.exists(path) for path in old_files))
+        self.assertListEqual(list(chain.read()), latest)
+        self.assertIsNone(chain.compact())
+
+        dc = DataCombine()
+        dc.read_snapshot_chain(manifest)
+        self.assertListEqual([c['id'] for c in dc.contacts],
+                             ['1', '2', '3', '4'])
+        self.assertDictEqual(dc.bad_m2m, {'4': ['too long']})
+
+    def test_import_highrise_stash(self):
+        modified = parser.parse('2017-01-01T00:00:00.000Z')
+        by_email, by_phone = (
+            Contact.objects.create(cc_id=cc_id, created_date=modified,
+                                   cc_modified_date=modified)
+            for cc_id in (1, 2)
+        )
+        by_email.email_addresses.create(
+            cc_id='e1', email_address='Jop@Example.org', status='AC',
+            confirm_status='CO'
+        )
+        ph = Phone()
+        ph.create_from_str("407-555-0100")
+        ph.save()
+        by_phone.cell_phone.add(ph)
+
+        def person(pid, name, emails=(), phones=(), **fields):
+            return {
+                'pid': pid, 'name': name, 'tags': ['- Donor\n'],
+                'background': '  Met at the gala\n',
+                'contact': {'Email_addresses': list(emails),
+                            'Phone_numbers': list(phones)},
+                f'note_{pid}1': {
+                    'type': 'Note', 'author': 'Thomas\n',
+                    'written_on': '"March 1, 2017 10:00"\n',
+                    'about': f'{name}\n', 'body': ' Called back\n'
+                },
+                **fields
+            }
+        people = [
+            ("101.txt", person('101', "Jop de Ruyterzoon",
+                               emails=[' jop@example.ORG'])),
+            ("102.txt", person('102', "Nate Conolly",
+                               phones=['(407) 555-0100'])),
+            ("103.txt", person('103', "Ada Lovelace",
+                               emails=['ada@example.org'],
+                               phones=['321-555-0199'],
+                               Company={'- Name': 'Crimson Star',
+                                        '- Title': 'Director'})),
+            # Shares an email with someone new earlier in the stash
+            ("104.txt", person('104', "A. Lovelace",
+                               emails=['ADA@example.org'])),
+        ]
+        stash = os.path.join(tempfile.mkdtemp(), "yaya.jsonl")
+        with open(stash, 'w') as f:
+            for finame, data in people:
+                f.write(json.dumps({'file': finame, 'data': data}) + "\n")
+
+        self.assertEqual(self.dc.import_highrise_stash(stash, batch_size=2), 4)
+        self.assertEqual(self.dc.counts['highrise_matched'], 3)
+        self.assertEqual(self.dc.counts['highrise_inserted'], 1)
+
+        by_email.refresh_from_db()
+        self.assertEqual(by_email.highrise_id, '101')
+        self.assertEqual(by_email.highrise_profile.background,
+                         "Met at the gala")
+        self.assertListEqual(
+            [n.note for n in by_email.notes.all()], ["Called back"]
+        )
+        self.assertEqual(by_email.notes.get().created_date.year, 2017)
+        self.assertEqual(Contact.objects.get(highrise_id='102'), by_phone)
+
+        ada = Contact.objects.get(highrise_id='103')
+        self.assertIsNone(ada.cc_id)
+        self.assertEqual((ada.first_name, ada.last_name, ada.company_name,
+                          ada.job_title),
+                         ("Ada", "Lovelace", "Crimson Star", "Director"))
+        self.assertListEqual(
+            [e.email_address for e in ada.email_addresses.all()],
+            ['ada@example.org']
+        )
+        self.assertEqual(str(ada.work_phone.get()), "(321)-555-0199")
+        self.assertSetEqual(
+            {n.cc_id for n in ada.notes.all()},
+            {'highrise-1031', 'highrise-1041'}
+        )
+        # Contacts only in HighRise don't count as the latest from
+        # ConstantContact
+        self.assertEqual(
+            self.dc._get_most_recent_datetime(Contact, 'cc_modified_date'),
+            modified.isoformat()
+        )
+
+        # Importing again updates rather than duplicates
+        self.dc.import_highrise_stash(stash)
+        self.assertEqual(self.dc.counts['highrise_matched'], 4)
+        self.assertEqual(Contact.objects.count(), 3)
+        self.assertEqual(Note.objects.count(), 4)
+        self.assertEqual(HighRiseProfile.objects.count(), 3)
+
+    def test_import_highrise_stash_falls_back_per_person(self):
+        people = [
+            ("201.txt", {'pid': '201', 'name': "Grace Hopper", 'contact': {
+                'Email_addresses': ['grace@example.org']}}),
+            # Mangled by the miner
+            ("202.txt", {'pid': '202', 'name': "Bad Scan",
+                         'contact': ['Email_addresses']}),
+            ("203.txt", {'pid': '203', 'name': "G. Hopper", 'contact': {
+                'Email_addresses': ['GRACE@example.org']}}),
+        ]
+        stash = os.path.join(tempfile.mkdtemp(), "yaya.jsonl")
+        with open(stash, 'w') as f:
+            for finame, data in people:
+                f.write(json.dumps({'file': finame, 'data': data}) + "\n")
+
+        self.assertEqual(self.dc.import_highrise_stash(stash), 3)
+        self.assertEqual(self.dc.counts['highrise_errored'], 1)
+        self.assertEqual(self.dc.counts['highrise_inserted'], 1)
+        self.assertEqual(self.dc.counts['highrise_matched'], 1)
+        # Nothing was left in the match index by the rolled back batch, so
+        # the second Grace found the first one's contact
+        self.assertEqual(Contact.objects.count(), 1)
+        self.assertEqual(HighRiseProfile.objects.count(), 1)
+
+    def test_combine_chunk_task(self):
+        # Progress goes to memory rather than the broker
+        backend = CacheBackend(app=tasks.combine_chunk.app, backend='memory')
+        tasks.combine_chunk.backend = backend
+        self.addCleanup(setattr, tasks.combine_chunk, 'backend', None)
+        contacts = [
+            self._full_contact_json(self.jop_de_ruyterzoon, 1),
+            self._full_contact_json(self.nathanial_conolly, 2),
+        ]
+
+        job = tasks.combine_chunk.apply(args=(contacts,),
+                                        kwargs={'batch_size': 10})
+        result = job.get()
+        self.assertEqual(Contact.objects.count(), 2)
+        self.assertEqual(result['processed'], 2)
+        self.assertEqual(result['counts']['inserted'], 2)
+        self.assertEqual(result['bad_phone_nums']['1985'], [{'fax': '12'}])
+        self.assertEqual(backend.get_state(job.id), 'PROGRESS')
+        self.assertEqual(backend.get_result(job.id)['processed'], 2)
+
+    def test_aggregate_combine(self):
+        def chunk(seconds, inserted, bad_phone_nums=None):
+            return {
+                'processed': inserted + 1, 'total': inserted + 1,
+                'seconds': seconds,
+                'counts': {'inserted': inserted, 'errored': 1},
+                'bad_phone_nums': bad_phone_nums or {}, 'bad_m2m': {}
+            }
+
+        summary = tasks.aggregate_combine([
+            chunk(2.5, 3, {'1985': [{'fax': '12'}]}),
+            chunk(4.0, 5, {'1985': [{'cell_phone': '34'}]}),
+        ])
+        self.assertEqual(summary['processed'], 10)
+        self.assertEqual(summary['chunks'], 2)
+        self.assertEqual(summary['counts']['inserted'], 8)
+        self.assertEqual(summary['counts']['errored'], 2)
+        self.assertEqual(summary['counts']['updated'], 0)
+        self.assertEqual(summary['chunk_seconds'], [2.5, 4.0])
+        self.assertEqual(summary['slowest_chunk_seconds'], 4.0)
+        self.assertEqual(
+            summary['bad_phone_nums'],
+            {'1985': [{'fax': '12'}, {'cell_phone': '34'}]}
+        )
+        self.assertEqual(
+            tasks.aggregate_combine([])['slowest_chunk_seconds'], 0
+        )
+
+    def test_combine_progress(self):
+        states = {
+            'harvest': {'harvest_done': 1, 'total': 40,
+                        'chunks': ['chunk1', 'chunk2'],
+                        'callback': 'callback'},
+            'chunk1': {'processed': 10},
+            'chunk2': {'processed': 20},
+        }
+        finished = set()
+
+        class StubAsyncResult():
+            # Celery's AsyncResult, answered from `states` and `finished`
+            def __init__(self, task_id):
+                self.task_id = task_id
+                self.result = self.info = states.get(task_id)
+                if task_id in finished:
+                    self.state = 'SUCCESS'
+                else:
+                    self.state = 'PENDING' if self.result is None\
+                        else 'PROGRESS'
+
+            def ready(self):
+                return self.task_id in finished
+
+        self.addCleanup(setattr, tasks, 'AsyncResult', tasks.AsyncResult)
+        tasks.AsyncResult = StubAsyncResult
+
+        self.assertEqual(tasks.combine_progress('unknown'), 'PENDING')
+        progress = tasks.combine_progress('harvest')
+        self.assertEqual(progress['process_percent'], 75)
+        # The harvest's own state is left as it was
+        self.assertNotIn('process_percent', states['harvest'])
+
+        states['callback'] = {'processed': 40}
+        finished.add('callback')
+        progress = tasks.combine_progress('harvest')
+        self.assertIsNone(progress['process_percent'])
+        self.assertEqual(progress['summary'], {'processed': 40})
+
     def tearDown(self):
         if os.path.isfile(self.log_loc):
             os.remove(self.log_loc)
 
         ConstantContactList.objects.all().delete()
         Contact.objects.all().delete()
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            "workers need a DB they can all connect to")
+class TestShardedCombine(TransactionTestCase):
+    def _contact_json(self, n):
+        return dict(
+            id=str(n), confirmed=False, company_name="Co",
+            first_name=f"F{n}", middle_name="", last_name=f"L{n}",
+            modified_date="2016-04-16T17:41:31.000Z",
+            created_date="2016-04-16T17:41:31.000Z",
+            prefix_name="", job_title="", status="ACTIVE", source="Site Owner",
+            home_phone="(407)-555-0001", work_phone="", cell_phone="",
+            fax="12" if n % 10 == 0 else "",
+            addresses=[], notes=[],
+            email_addresses=[{
+                'confirm_status': 'CONFIRMED',
+                'email_address': f'c{n}@ira.org',
+                'id': f'deadbeef-99d9-11e3-83e7-782aba74{n:04d}',
+                'opt_in_date': '2011-06-24T19:32:49.000Z',
+                'opt_in_source': 'ACTION_BY_VISITOR',
+                'status': 'ACTIVE'
+            }],
+            lists=[{'id': '101', 'status': 'ACTIVE'}]
+        )
+
+    def test_combine_contacts_into_db_with_workers(self):
+        dc = self.dc = DataCombine(
+            loglvl=logging.DEBUG, logfile='dcombine_test.log'
+        )
+        dc.cclists = [{
+            'created_date': '2013-08-04T23:38:45.000Z', 'id': '101',
+            'modified_date': '2013-12-05T21:33:39.000Z',
+            'name': 'YAYA Florida - Orlando', 'status': 'ACTIVE'
+        }]
+        dc.contacts = [self._contact_json(n) for n in range(1, 41)]
+        shards = dc.shard_contacts(dc.contacts + [dc.contacts[0]], 3)
+        self.assertEqual(sum(len(shard) for shard in shards), 41)
+        self.assertEqual(
+            sum(dc.contacts[0] in shard for shard in shards), 1
+        )
+
+        progress = list(dc.combine_contacts_into_db(
+            update_web_interface=True, batch_size=5, workers=3
+        ))
+        self.assertEqual(progress[-1]['processed'], 40)
+        self.assertEqual(dc.counts['inserted'], 40)
+        self.assertEqual(Contact.objects.count(), 40)
+        # Every worker wanted the same home phone; it was stored once
+        self.assertEqual(Phone.objects.count(), 1)
+        self.assertEqual(
+            UserStatusOnCCList.objects.filter(cclist__cc_id=101).count(), 40
+        )
+        self.assertEqual(
+            sorted(dc.bad_phone_nums), [str(n) for n in (10, 20, 30, 40)]
+        )
+
+    def tearDown(self):
+        logs = ["dcombine_test.log"] + [
+            f"dcombine_test-shard{n}.log" for n in range(3)
+        ]
+        for log in logs:
+            log = os.path.join(self.dc.logdir, log)
+            if os.path.isfile(log):
+                os.remove(log)
+
+
+class TestHighRiseDataMiner(SimpleTestCase):
+    def _export(self, pid, name):
+        return (
+            "---\n"
+            f"- ID: {pid}\n"
+            f"- Name: {name}\n"
+            "  Tags:\n"
+            "    - Donor\n"
+            "    - Volunteer\n"
+            "- Background: Met at the gala\n"
+            "  in Orlando\n"
+            "- Contact: \n"
+            "  -\n"
+            "    - Email_addresses\n"
+            f"      - person{pid}@example.org\n"
+            "  -\n"
+            "    - Phone_numbers\n"
+            "      - (407) 555-0100\n"
+            f"- Note {pid}1:\n"
+            "  -\n"
+            "  - Author: Thomas\n"
+            "  -\n"
+            "  - Written: \"March 1, 2017 10:00\"\n"
+            "  -\n"
+            f"  - About: {name}\n"
+            "  -\n"
+            "  - Body: Called back\n"
+            "    and again\n"
+            "- Company:\n"
+            "  - Name: Crimson Star\n"
+        )
+
+    def setUp(self):
+        self.exportdir = tempfile.mkdtemp()
+        for pid, name in ((101, "Jop de Ruyterzoon"), (102, "Nate Conolly")):
+            with open(os.path.join(self.exportdir, f"{pid}.txt"), 'w') as f:
+                f.write(self._export(pid, name))
+        with open(os.path.join(self.exportdir, "broken.txt"), 'wb') as f:
+            f.write(b"---\n\xff\xfe\xfa\n")
+
+    def test_mine_directory_workers(self):
+        miner = HighRiseDataMiner(self.exportdir)
+        serial = miner.mine_directory()
+        self.assertListEqual(sorted(serial), ["101.txt", "102.txt"])
+        self.assertEqual(serial["101.txt"]['pid'], "101")
+        self.assertEqual(
+            serial["102.txt"]['contact']['Email_addresses'],
+            ["person102@example.org"]
+        )
+        self.assertListEqual(list(miner.errors), ["broken.txt"])
+        self.assertIn("UnicodeDecodeError", miner.errors["broken.txt"])
+        self.assertEqual(len(miner.timings), 3)
+
+        pooled = HighRiseDataMiner(self.exportdir)
+        self.assertDictEqual(pooled.mine_directory(workers=2), serial)
+        self.assertListEqual(list(pooled.errors), ["broken.txt"])
+
+    def test_write_stash_streams_json_lines(self):
+        stash = os.path.join(tempfile.mkdtemp(), "yaya.jsonl")
+        miner = HighRiseDataMiner(self.exportdir)
+        self.assertEqual(miner.write_stash(stash, workers=2), 2)
+        self.assertListEqual(list(miner.errors), ["broken.txt"])
+        with open(stash) as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+        people = DataCombine.iter_highrise_contact_stash(stash)
+        self.assertIsInstance(people, types.GeneratorType)
+        people = dict(people)
+        self.assertDictEqual(people, miner.mine_directory())
+
+        # A stash in the old, single JSON object, format still reads
+        with open(stash, 'w') as f:
+            json.dump(people, f)
+        self.assertDictEqual(
+            dict(DataCombine.iter_highrise_contact_stash(stash)), people
+        )
+
+    def test_single_pass_parser_matches_readline_miner(self):
+        miner = HighRiseDataMiner(self.exportdir)
+        exports = [
+            self._export(101, "Jop de Ruyterzoon"),
+            synthetic_export(7, notes=3),
+            # A background at the end is dropped by the readline miner, and
+            # so must be here
+            "---\n- ID: 1\n- Name: A\n- Background: x\n  more\n",
+            "---\n- ID: 1\n- Name: A\n- Company:\n  - Name: CS",
+            "---\n- ID: 1\n",
+            "",
+        ]
+        for text in exports:
+            self.assertDictEqual(
+                miner.parse_export(text, "f.txt"),
+                miner.mine_file_readline(io.StringIO(text), "f.txt")
+            )
+        mined = miner.parse_export(exports[0], "101.txt")
+        self.assertEqual(mined['note_1011']['author'], "Thomas\n")
+        self.assertListEqual(mined['tags'], ["- Donor\n", "- Volunteer\n"])
+
+        self.assertTrue(benchmark_miners(files=5, notes=2)['identical'])
+
+    def test_mining_cache(self):
+        cachepath = os.path.join(tempfile.mkdtemp(), "cache.sqlite3")
+        miner = HighRiseDataMiner(self.exportdir)
+        with MiningCache(cachepath) as cache:
+            first = miner.mine_directory(cache=cache)
+        with MiningCache(cachepath) as cache:
+            results = {
+                r['file']: r for r in miner.iter_mine_directory(cache=cache)
+            }
+        self.assertTrue(results["101.txt"]['cached'])
+        self.assertTrue(results["102.txt"]['cached'])
+        # Errors aren't cached
+        self.assertFalse(results["broken.txt"]['cached'])
+        self.assertEqual(results["101.txt"]['data'], first["101.txt"])
+
+        # Touched but unchanged, then changed
+        path = os.path.join(self.exportdir, "101.txt")
+        os.utime(path, ns=(0, 0))
+        with open(os.path.join(self.exportdir, "102.txt"), 'a') as f:
+            f.write("- Title: Treasurer\n")
+        os.remove(os.path.join(self.exportdir, "broken.txt"))
+        with MiningCache(cachepath) as cache:
+            results = {
+                r['file']: r for r in miner.iter_mine_directory(cache=cache)
+            }
+            self.assertTrue(results["101.txt"]['cached'])
+            self.assertFalse(results["102.txt"]['cached'])
+            self.assertIn("Title", results["102.txt"]["data"])
+            self.assertEqual(cache.lookup(path)['mtime_ns'], 0)
+
+        # Another miner version mines everything again
+        with MiningCache(cachepath, version=0) as cache:
+            self.assertIsNone(cache.lookup(path))
+            results = list(miner.iter_mine_directory(cache=cache))
+        self.assertFalse(any(r['cached'] for r in results))
@@ -2,6 +2,7 @@ from django.test import TestCase
 from datacombine import models as dcmodels
 from collections import namedtuple
 from django.core.exceptions import FieldError
+from django.db import IntegrityError, transaction
 import re
 
 
@@ -82,6 +83,15 @@ class PhoneTestCase(TestCase):
         ph.create_from_str("")
         self.assertTrue(ph == None)
 
+    def test_phone_key_is_normalized(self):
+        ph = dcmodels.Phone(area_code="407", number="5559999", extension="")
+        self.assertEqual(ph.make_key(*ph.key), "407|5559999|")
+        self.assertTrue(dcmodels.Phone.is_phone_in_db(ph))
+
+    def test_phone_key_is_unique(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            dcmodels.Phone.objects.create(number="1234567", extension="")
+
     def tearDown(self):
         dcmodels.Phone.objects.all().delete()
 